@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""Run the plugins on MusicBrainz releases without MusicBrainz Picard.
+
+Releases are read from a folder of release JSON files, or from a file with
+one release JSON per line (`-` for the standard input). Every metadata
+processor of this repository is run on each release in a pool of
+processes, and the tags changed on each track are written as JSON lines, in
+the order of the input.
+
+Requests of the plugins for other releases, e.g. transliterated
+tracklists, are served from a folder of release JSON files named by
+release ID, such as the `related` folder of a `replay.py` corpus.
+"""
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from collections import deque
+from json import dumps as json_dumps, loads as json_loads
+from multiprocessing import Pool
+from multiprocessing.pool import AsyncResult, Pool as PoolType
+from os import cpu_count
+from pathlib import Path
+from sys import stdin, stdout
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    TextIO,
+    TypeVar,
+)
+
+from picard import log
+from picard.metadata import Metadata
+
+from harness import (
+    Processors,
+    Release,
+    iter_tracks,
+    load_processors,
+    process_release,
+    release_to_metadata,
+    track_to_metadata,
+)
+from replay import CorpusReleases
+
+
+# Releases queued for each process, bounding the releases held in memory
+QUEUED_RELEASES_PER_JOB = 4
+
+T = TypeVar("T")
+U = TypeVar("U")
+
+# State of the worker processes, see `_init_worker`
+_processors: Optional[Processors] = None
+_related: Mapping[str, Release] = {}
+
+
+def iter_inputs(source: str) -> Iterator[str]:
+    """Yield the JSON of each release of a folder or a JSON-lines file."""
+    if source == "-":
+        yield from (line for line in stdin if line.strip())
+        return
+
+    path = Path(source)
+    if path.is_dir():
+        for release_path in sorted(path.glob("*.json")):
+            yield release_path.read_text(encoding="utf-8")
+        return
+
+    with open(path, "r", encoding="utf-8") as in_file:
+        yield from (line for line in in_file if line.strip())
+
+
+def tag_changes(
+    before: Metadata, after: Metadata
+) -> Dict[str, Dict[str, List[str]]]:
+    """Return the old and new values of the tags which differ."""
+    changes: Dict[str, Dict[str, List[str]]] = {}
+    for name in sorted(set(before.keys()) | set(after.keys())):
+        old, new = before.getall(name), after.getall(name)
+        if old != new:
+            changes[name] = {"old": list(old), "new": list(new)}
+    return changes
+
+
+def diff_release(
+    processors: Processors,
+    release: Release,
+    related: Mapping[str, Release],
+) -> List[Dict[str, Any]]:
+    """Return the tags changed by the plugins on each track of a release.
+
+    Tracks without changes are omitted.
+    """
+    album_metadata = release_to_metadata(release)
+    before = [
+        track_to_metadata(album_metadata, medium, track)
+        for medium, track in iter_tracks(release)
+    ]
+    _album_metadata, after = process_release(processors, release, related)
+
+    diffs: List[Dict[str, Any]] = []
+    for (medium, track), old, new in zip(iter_tracks(release), before, after):
+        changes = tag_changes(old, new)
+        if changes:
+            diffs.append(
+                {
+                    "release": release["id"],
+                    "disc": medium["position"],
+                    "track": track["position"],
+                    "recording": track["recording"]["id"],
+                    "changes": changes,
+                }
+            )
+    return diffs
+
+
+def _init_worker(related_dir: Optional[Path], log_level: str) -> None:
+    global _processors, _related
+
+    log.set_level(log_level)
+    _processors = load_processors()
+    _related = CorpusReleases(related_dir) if related_dir else {}
+
+
+def _process(text: str) -> List[str]:
+    """Return the JSON lines of the changes of a release JSON."""
+    if _processors is None:
+        raise RuntimeError("The worker is not initialized")
+
+    try:
+        release: Release = json_loads(text)
+        diffs = diff_release(_processors, release, _related)
+    except (ValueError, KeyError, TypeError) as e:
+        return [json_dumps({"error": f"Invalid release: {e!r}"})]
+
+    return [
+        json_dumps(diff, ensure_ascii=False, sort_keys=True) for diff in diffs
+    ]
+
+
+def _ordered_map(
+    pool: PoolType,
+    function: Callable[[T], U],
+    items: Iterable[T],
+    queued: int,
+) -> Iterator[U]:
+    """Yield the results of `function` on `items` run in `pool`, in order.
+
+    Unlike `Pool.imap`, at most `queued` items are read ahead of the
+    results, so a long input is never held in memory.
+    """
+    pending: Deque["AsyncResult[U]"] = deque()
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= queued:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def run_batch(
+    source: str,
+    output: TextIO,
+    related_dir: Optional[Path] = None,
+    jobs: int = 1,
+    log_level: str = "WARNING",
+) -> int:
+    """Write the tags changed by the plugins on the releases of `source`.
+
+    Runs `jobs` processes, or the current process only if `jobs` is 1.
+    Returns the number of releases processed.
+    """
+    releases = 0
+
+    if jobs == 1:
+        _init_worker(related_dir, log_level)
+        for lines in map(_process, iter_inputs(source)):
+            releases += 1
+            output.writelines(f"{line}\n" for line in lines)
+        return releases
+
+    with Pool(jobs, _init_worker, (related_dir, log_level)) as pool:
+        for lines in _ordered_map(
+            pool,
+            _process,
+            iter_inputs(source),
+            jobs * QUEUED_RELEASES_PER_JOB,
+        ):
+            releases += 1
+            output.writelines(f"{line}\n" for line in lines)
+
+    return releases
+
+
+def main() -> None:
+    """Program entrypoint."""
+    parser = ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "source",
+        help="folder of release JSON files, or JSON-lines file (- for stdin)",
+    )
+    parser.add_argument(
+        "--related",
+        type=Path,
+        help="folder of the releases requested by the plugins",
+    )
+    parser.add_argument(
+        "--jobs",
+        default=cpu_count() or 1,
+        type=int,
+        help="number of processes",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="WARNING",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="level of the messages logged by the plugins",
+    )
+    args = parser.parse_args()
+
+    run_batch(
+        args.source, stdout, args.related, max(args.jobs, 1), args.log_level
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+"""Benchmark the plugins' metadata processors on synthetic releases."""
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from json import dump as json_dump, load as json_load
+from os import environ
+from pathlib import Path
+from sys import exit, stderr
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from picard import log
+
+from harness import (
+    PIPELINE_ID,
+    Processors,
+    load_processors,
+    make_pipeline,
+    make_release,
+    process_release,
+    process_release_pipeline,
+)
+
+
+# Default path of the benchmark baseline
+BASELINE_FILE = Path(__file__).parent / "benchmarks" / "baseline.json"
+
+# Number of discs and tracks per disc of the releases for each size
+SIZES: Dict[str, Tuple[int, int]] = {
+    "1-disc": (1, 12),
+    "10-disc": (10, 20),
+    "200-disc": (200, 100),
+}
+
+# Release languages used for each size
+LANGUAGES = ("eng", "deu", "fra", "ita", "jpn")
+
+# Timing entry of all the processors registered separately, compared with
+# the pipeline
+PROCESSORS_ID = "processors"
+
+# Timings of each processor in seconds, by release size
+Results = Dict[str, Dict[str, float]]
+
+
+class Regression(NamedTuple):
+    """A processor slower than its baseline."""
+
+    size: str
+    processor: str
+    baseline: float
+    current: float
+
+    def __str__(self) -> str:
+        """Describe the regression."""
+        return (
+            f"{self.processor} on {self.size} releases: "
+            f"{self.baseline * 1000:.3f}ms -> {self.current * 1000:.3f}ms "
+            f"(+{(self.current / self.baseline - 1) * 100:.0f}%)"
+        )
+
+
+def benchmark_size(
+    processors: Processors,
+    discs: int,
+    tracks_per_disc: int,
+    repeat: int,
+    pipeline: Optional[Any] = None,
+) -> Dict[str, float]:
+    """Return the best time of each processor on releases of a given size.
+
+    Each run processes one release per language in `LANGUAGES`. If
+    `pipeline` is set, the time of the pipeline running all the processors
+    is also returned, with the total time of the processors of the same run
+    to compare it with.
+    """
+    releases = [
+        make_release(discs, tracks_per_disc, language=language)
+        for language in LANGUAGES
+    ]
+    best: Dict[str, float] = {}
+
+    for _ in range(repeat):
+        timings: Dict[str, float] = {}
+        for release, related in releases:
+            process_release(processors, release, related, timings)
+            if pipeline is not None:
+                process_release_pipeline(pipeline, release, related, timings)
+        if pipeline is not None:
+            timings[PROCESSORS_ID] = sum(
+                timing
+                for processor_id, timing in timings.items()
+                if processor_id != PIPELINE_ID
+            )
+        for processor_id, timing in timings.items():
+            best[processor_id] = min(best.get(processor_id, timing), timing)
+
+    return best
+
+
+def run_benchmarks(
+    sizes: Sequence[str],
+    repeat: int,
+    pipeline: bool = False,
+) -> Results:
+    """Benchmark all the processors for each release size.
+
+    If `pipeline` is True, also benchmark the pipeline of the support
+    library running all the processors.
+    """
+    processors = load_processors()
+    processor_pipeline = make_pipeline(processors) if pipeline else None
+    results: Results = {}
+
+    for size in sizes:
+        discs, tracks_per_disc = SIZES[size]
+        results[size] = benchmark_size(
+            processors, discs, tracks_per_disc, repeat, processor_pipeline
+        )
+
+    return results
+
+
+def find_regressions(
+    results: Results,
+    baseline: Results,
+    threshold: float,
+    min_delta: float,
+) -> List[Regression]:
+    """Return the processors slower than their baseline.
+
+    A processor regresses if it is more than `threshold` (a ratio) slower
+    than its baseline, and at least `min_delta` seconds slower.
+    """
+    regressions: List[Regression] = []
+
+    for size, timings in results.items():
+        for processor_id, current in timings.items():
+            previous = baseline.get(size, {}).get(processor_id)
+            if previous is None:
+                continue
+            if (
+                current > previous * (1 + threshold)
+                and current - previous >= min_delta
+            ):
+                regressions.append(
+                    Regression(size, processor_id, previous, current)
+                )
+
+    return regressions
+
+
+def print_results(results: Results) -> None:
+    """Print the timings of each processor."""
+    for size, timings in results.items():
+        discs, tracks_per_disc = SIZES[size]
+        tracks = discs * tracks_per_disc * len(LANGUAGES)
+        width = max(map(len, timings), default=0)
+        print(f"{size} ({tracks} tracks):")
+        for processor_id, timing in sorted(timings.items()):
+            print(
+                f"  {processor_id:<{width}} {timing * 1000:10.3f}ms "
+                f"{timing / tracks * 1_000_000:8.2f}µs/track"
+            )
+
+
+def main() -> None:
+    """Program entrypoint."""
+    parser = ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--size",
+        action="append",
+        choices=SIZES,
+        dest="sizes",
+        help="release size to benchmark, can be repeated (default: all)",
+    )
+    parser.add_argument(
+        "--repeat",
+        default=3,
+        type=int,
+        help="number of runs, the best time is kept",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE_FILE,
+        type=Path,
+        help="path of the baseline timings",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="save the timings as the new baseline",
+    )
+    parser.add_argument(
+        "--require-baseline",
+        action="store_true",
+        default=bool(environ.get("CI")),
+        help=(
+            "fail if there is no baseline, the default when the CI "
+            "environment variable is set"
+        ),
+    )
+    parser.add_argument(
+        "--threshold",
+        default=0.2,
+        type=float,
+        help="slowdown ratio compared to the baseline considered a failure",
+    )
+    parser.add_argument(
+        "--min-delta",
+        default=0.001,
+        type=float,
+        help="minimum slowdown in seconds considered a failure",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="also time the pipeline running all the processors",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="WARNING",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="level of the messages logged by the plugins",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="path of a JSON file to write the timings to",
+    )
+    args = parser.parse_args()
+
+    log.set_level(args.log_level)
+
+    results = run_benchmarks(
+        args.sizes or list(SIZES), args.repeat, args.pipeline
+    )
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as out_file:
+            json_dump(results, out_file, sort_keys=True, indent=2)
+
+    baseline_path: Path = args.baseline
+
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline_path, "w") as out_file:
+            json_dump(results, out_file, sort_keys=True, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+        return
+
+    if not baseline_path.is_file():
+        if args.require_baseline:
+            print(f"No baseline found at {baseline_path}", file=stderr)
+            exit(1)
+        print(f"No baseline found at {baseline_path}")
+        return
+
+    with open(baseline_path, "r", encoding="utf-8") as in_file:
+        baseline: Results = json_load(in_file)
+
+    regressions = find_regressions(
+        results, baseline, args.threshold, args.min_delta
+    )
+
+    for regression in regressions:
+        print(f"Regression: {regression}", file=stderr)
+
+    if regressions:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+"""Benchmark the tagging scripts on synthetic track metadata.
+
+Each script is parsed once, and the parsed script is evaluated on every
+track. The time spent in each script function is also reported, excluding
+the time spent in the functions it calls. Functions which evaluate their
+own arguments, like `$if`, include the time spent evaluating them.
+"""
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from random import Random
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence
+
+from picard.metadata import Metadata
+from picard.script import ScriptParser
+from picard.script.functions import FunctionRegistryItem
+
+from lib import Script, get_script_paths
+
+# Register $replacemany, used by some scripts
+import plugins.replace_many.replace_many  # noqa: F401
+
+
+# Phrases of the synthetic titles, with the characters the scripts replace
+_PHRASES = (
+    "L'amour",
+    "J'ai dit",
+    "Y'a d'la joie",
+    "It's over",
+    "Rock'n'roll",
+    "Attends...",
+    "« Bonjour »",
+    "<< Salut >>",
+    "Pourquoi ?",
+    "Viens !",
+    "Acte 1 : Ouverture",
+    "Oui ; non",
+    "The Night",
+    "Summer Rain",
+)
+
+_COUNTRIES = ("FR", "BE", "CH", "CA", "US", "GB", "DE", "JP", "IT", "ES")
+
+
+class FunctionTimings(NamedTuple):
+    """Calls of a script function and the time spent in it."""
+
+    calls: int
+    seconds: float
+
+
+class ScriptTimings(NamedTuple):
+    """Time spent evaluating a script."""
+
+    seconds: float
+    functions: Dict[str, FunctionTimings]
+
+
+def make_tracks(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Return the tags of synthetic tracks, identical for a given seed."""
+    rand = Random(seed)
+    tracks: List[Dict[str, Any]] = []
+
+    def text() -> str:
+        return " ".join(rand.sample(_PHRASES, rand.randint(1, 3)))
+
+    for number in range(1, count + 1):
+        artist = text()
+        tags: Dict[str, Any] = {
+            "title": text(),
+            "album": text(),
+            "artist": artist,
+            "artistsort": artist if rand.random() < 0.5 else f"{artist}, X",
+            "albumartist": artist,
+            "albumartistsort": artist,
+            "tracknumber": str(number),
+            "~musicbrainz_tracknumber": (
+                f"A{number}" if rand.random() < 0.2 else str(number)
+            ),
+            "~releaselanguage": rand.choice(("fra", "eng")),
+            "~releasecountries": rand.sample(
+                _COUNTRIES, rand.randint(1, len(_COUNTRIES))
+            ),
+        }
+        if rand.random() < 0.5:
+            tags["work"] = text()
+        if rand.random() < 0.3:
+            tags["composer"] = tags["composersort"] = text()
+        if rand.random() < 0.1:
+            tags["~performance_attributes"] = "instrumental"
+        tracks.append(tags)
+
+    return tracks
+
+
+class ScriptProfiler:
+    """Evaluate parsed scripts and time the script functions they call."""
+
+    def __init__(self) -> None:
+        self.parser = ScriptParser()
+        self.parser.load_functions()
+        # Same functions, timed
+        self.profiling_parser = ScriptParser()
+        self.profiling_parser.load_functions()
+        self.functions: Dict[str, List[float]] = {}
+        # Time spent in the functions called by the running functions
+        self._nested: List[float] = []
+
+        for name, item in self.parser.functions.items():
+            self.profiling_parser.functions[name] = FunctionRegistryItem(
+                self._timed(name, item.function),
+                item.eval_args,
+                item.argcount,
+                documentation=item.documentation,
+                name=item.name,
+                module=item.module,
+            )
+
+    def _timed(
+        self, name: str, function: Callable[..., str]
+    ) -> Callable[..., str]:
+        timings = self.functions.setdefault(name, [0, 0.0])
+
+        def timed(*args: Any) -> str:
+            self._nested.append(0.0)
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                duration = perf_counter() - start
+                nested = self._nested.pop()
+                timings[0] += 1
+                timings[1] += duration - nested
+                if self._nested:
+                    self._nested[-1] += duration
+
+        return timed
+
+    def profile(
+        self, script: Script, tracks: Sequence[Dict[str, Any]]
+    ) -> ScriptTimings:
+        """Evaluate a script on each track.
+
+        The script is evaluated twice, once to time the whole script and once
+        with the script functions timed, which slows it down.
+        """
+        expression = self.parser.parse(script.source, True)
+
+        for timings in self.functions.values():
+            timings[:] = [0, 0.0]
+
+        for parser in (self.profiling_parser, self.parser):
+            contexts = [Metadata(tags) for tags in tracks]
+            parser.file = None
+            start = perf_counter()
+            for context in contexts:
+                parser.context = context
+                expression.eval(parser)
+            seconds = perf_counter() - start
+
+        return ScriptTimings(
+            seconds,
+            {
+                name: FunctionTimings(int(calls), total)
+                for name, (calls, total) in self.functions.items()
+                if calls
+            },
+        )
+
+
+def run_benchmarks(
+    names: Sequence[str],
+    count: int,
+    seed: int = 0,
+) -> Dict[str, ScriptTimings]:
+    """Profile the scripts called `names`, or all, on `count` tracks."""
+    profiler = ScriptProfiler()
+    tracks = make_tracks(count, seed)
+
+    return {
+        path.stem: profiler.profile(Script.load(path), tracks)
+        for path in get_script_paths()
+        if not names or path.stem in names
+    }
+
+
+def print_results(results: Dict[str, ScriptTimings], count: int) -> None:
+    """Print the time spent in each script and script function."""
+    for name, timings in sorted(
+        results.items(), key=lambda item: item[1].seconds, reverse=True
+    ):
+        print(
+            f"{name}: {timings.seconds * 1000:.3f}ms "
+            f"{timings.seconds / count * 1_000_000:.2f}µs/track"
+        )
+        width = max(map(len, timings.functions), default=0)
+        for function, function_timings in sorted(
+            timings.functions.items(),
+            key=lambda item: item[1].seconds,
+            reverse=True,
+        ):
+            print(
+                f"  ${function:<{width}} {function_timings.calls:8d} calls "
+                f"{function_timings.seconds * 1000:10.3f}ms "
+                f"{function_timings.seconds / count * 1_000_000:8.2f}µs/track"
+            )
+
+
+def main() -> None:
+    """Program entrypoint."""
+    parser = ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--script",
+        action="append",
+        dest="scripts",
+        metavar="NAME",
+        help="name of a script to benchmark, can be repeated (default: all)",
+    )
+    parser.add_argument(
+        "--tracks",
+        default=5000,
+        type=int,
+        help="number of synthetic tracks",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="seed of the synthetic tracks",
+    )
+    args = parser.parse_args()
+
+    print_results(
+        run_benchmarks(args.scripts or [], args.tracks, args.seed),
+        args.tracks,
+    )
+
+
+if __name__ == "__main__":
+    main()
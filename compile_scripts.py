@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+"""Compile tagging scripts to Python plugins.
+
+Only scripts made of `$set(tag,$replace(%tag%,old,new))` or
+`$set(tag,$replacemany(%tag%,old1,new1,...))` statements, optionally grouped
+in `$if` blocks whose condition compares variables the script does not set,
+are supported. The replacements of each tag are done
+in a single pass when this gives the same result as replacing the patterns
+one after the other.
+"""
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from pathlib import Path
+from sys import stderr
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from picard.script import ScriptParser
+from picard.script.parser import (
+    ScriptExpression,
+    ScriptFunction,
+    ScriptText,
+    ScriptVariable,
+    normalize_tagname,
+)
+
+from lib import Script, get_script_paths
+
+# Register $replacemany, used by some scripts
+import plugins.replace_many.replace_many  # noqa: F401
+
+
+# Picard API versions of the generated plugins
+API_VERSIONS = ("2.0", "2.1", "2.2", "2.3", "2.4", "2.5", "2.6", "2.7")
+
+Replacements = Tuple[Tuple[str, str], ...]
+
+
+class UnsupportedScript(Exception):
+    """The script uses features the compiler does not support."""
+
+
+class Statement(NamedTuple):
+    """`$set(tag,$replace(%tag%,old,new))`."""
+
+    tag: str
+    old: str
+    new: str
+
+
+class Block(NamedTuple):
+    """Statements run when a condition is true, or always if it is None."""
+
+    condition: Optional[str]
+    statements: Tuple[Statement, ...]
+
+
+def _text(expression: ScriptExpression) -> str:
+    """Return the value of an argument made of plain text."""
+    if not all(isinstance(item, ScriptText) for item in expression):
+        raise UnsupportedScript(f"Expected plain text, got {expression!r}")
+    return "".join(expression)
+
+
+def _operand(expression: ScriptExpression, variables: Set[str]) -> str:
+    """Return the Python expression of a text or a variable argument."""
+    if len(expression) == 1 and isinstance(expression[0], ScriptVariable):
+        tag = normalize_tagname(expression[0].name)
+        variables.add(tag)
+        return f"context.get({tag!r})"
+    return repr(_text(expression))
+
+
+def _condition(expression: ScriptExpression, variables: Set[str]) -> str:
+    """Return the Python expression of an `$if` condition."""
+    if len(expression) == 1 and isinstance(expression[0], ScriptFunction):
+        function = expression[0]
+        operator = {"eq": "==", "ne": "!="}.get(function.name)
+        if operator is not None:
+            left, right = (_operand(arg, variables) for arg in function.args)
+            return f"{left} {operator} {right}"
+    return _operand(expression, variables)
+
+
+def _statements_of_set(function: ScriptFunction) -> List[Statement]:
+    """Parse a `$set(tag,$replace(%tag%,old,new))` statement.
+
+    `$replacemany(%tag%,old1,new1,...)` is also supported when it gives the
+    same result as chained `$replace` calls.
+    """
+    tag = normalize_tagname(_text(function.args[0]))
+    value = function.args[1]
+
+    if (
+        len(value) != 1
+        or not isinstance(value[0], ScriptFunction)
+        or value[0].name not in ("replace", "replacemany")
+    ):
+        raise UnsupportedScript(f"Expected $replace, got {value!r}")
+
+    text, *args = value[0].args
+    if (
+        len(text) != 1
+        or not isinstance(text[0], ScriptVariable)
+        or normalize_tagname(text[0].name) != tag
+    ):
+        raise UnsupportedScript(f"Expected %{tag}%, got {text!r}")
+    if tag.endswith("*"):
+        raise UnsupportedScript(f"Wildcard tags are not supported: {tag}")
+
+    replacements = tuple(
+        (_text(old), _text(new)) for old, new in zip(args[::2], args[1::2])
+    )
+    if value[0].name == "replacemany" and not can_fuse(replacements):
+        raise UnsupportedScript(
+            f"$replacemany differs from chained $replace: {value!r}"
+        )
+
+    return [Statement(tag, old, new) for old, new in replacements]
+
+
+def _statements(expression: ScriptExpression) -> Tuple[Statement, ...]:
+    """Parse a sequence of `$set` statements, ignoring the text around."""
+    statements: List[Statement] = []
+    for item in expression:
+        if isinstance(item, ScriptFunction) and item.name == "set":
+            statements.extend(_statements_of_set(item))
+        elif not isinstance(item, ScriptText):
+            raise UnsupportedScript(f"Unsupported statement {item!r}")
+    return tuple(statements)
+
+
+def parse_script(source: str) -> List[Block]:
+    """Parse the supported subset of the tagging script language.
+
+    Raises UnsupportedScript if the script uses other features.
+    """
+    blocks: List[Block] = []
+    variables: Set[str] = set()
+
+    for item in ScriptParser().parse(source):
+        # $noop is used for comments
+        if isinstance(item, ScriptText) or (
+            isinstance(item, ScriptFunction) and item.name == "noop"
+        ):
+            continue
+        if isinstance(item, ScriptFunction) and item.name == "if":
+            if len(item.args) != 2:
+                raise UnsupportedScript("$if with an else branch")
+            blocks.append(
+                Block(
+                    _condition(item.args[0], variables),
+                    _statements(item.args[1]),
+                )
+            )
+        else:
+            statements = _statements(ScriptExpression([item]))
+            # Merge the consecutive statements run unconditionally
+            if blocks and blocks[-1].condition is None:
+                statements = blocks.pop().statements + statements
+            blocks.append(Block(None, statements))
+
+    tags = {
+        statement.tag for block in blocks for statement in block.statements
+    }
+    if tags & variables:
+        raise UnsupportedScript(
+            f"Conditions depend on modified tags: {sorted(tags & variables)}"
+        )
+
+    return blocks
+
+
+def _overlaps(first: str, second: str) -> bool:
+    """Return whether a proper suffix of `first` is a prefix of `second`."""
+    return any(second.startswith(first[i:]) for i in range(1, len(first)))
+
+
+def can_fuse(replacements: Replacements) -> bool:
+    """Return whether the replacements can be done in a single pass.
+
+    Replacing the leftmost match of any pattern, preferring the earlier
+    patterns, gives the same result as replacing each pattern one after the
+    other as long as a pattern never overlaps an earlier pattern from the
+    left or contains it, and never matches across or around an earlier
+    replacement. Deleting text can join the characters around it, so a
+    deletion can only be followed by single character patterns.
+    """
+    for i, (old, new) in enumerate(replacements):
+        if not old:
+            return False
+        for later, _ in replacements[i + 1 :]:  # noqa: E203
+            if (
+                old in later
+                or later in old
+                or later in new
+                or (new in later if new else len(later) > 1)
+                or _overlaps(later, old)
+                or _overlaps(later, new)
+                or _overlaps(new, later)
+            ):
+                return False
+    return True
+
+
+def _group(statements: Sequence[Statement]) -> Dict[str, Replacements]:
+    """Return the replacements done on each tag, in order.
+
+    Statements only read the tag they set, so the statements of different
+    tags can be reordered.
+    """
+    replacements: Dict[str, List[Tuple[str, str]]] = {}
+    for statement in statements:
+        replacements.setdefault(statement.tag, []).append(
+            (statement.old, statement.new)
+        )
+    return {tag: tuple(pairs) for tag, pairs in replacements.items()}
+
+
+def _replace_function(index: int, replacements: Replacements) -> List[str]:
+    """Return the lines of a function doing the replacements."""
+    if can_fuse(replacements):
+        lines = [f"_REPLACEMENTS_{index} = {{"]
+        lines.extend(f"    {old!r}: {new!r}," for old, new in replacements)
+        lines.extend(
+            [
+                "}",
+                f"_PATTERN_{index} = re_compile(",
+                f'    "|".join(map(escape, _REPLACEMENTS_{index}))',
+                ")",
+                "",
+                "",
+                f"def _replace_{index}(text: str) -> str:",
+                f"    return _PATTERN_{index}.sub(",
+                f"        lambda match: _REPLACEMENTS_{index}[match.group()],",
+                "        text,",
+                "    )",
+            ]
+        )
+    else:
+        lines = [f"def _replace_{index}(text: str) -> str:"]
+        lines.extend(
+            f"    text = text.replace({old!r}, {new!r})"
+            for old, new in replacements
+        )
+        lines.append("    return text")
+    return lines + ["", ""]
+
+
+def compile_script(script: Script, name: str) -> str:
+    """Return the source of a plugin doing the same as a tagging script.
+
+    Raises UnsupportedScript if the script cannot be compiled.
+    """
+    blocks = parse_script(script.source)
+    functions: Dict[Replacements, int] = {}
+    header = [
+        f'"""{script.title} (compiled)."""',
+        "",
+        f"# Generated by compile_scripts.py from {name}.ptsp, do not edit",
+        "",
+        "from re import compile as re_compile, escape",
+        "from typing import TYPE_CHECKING, Any, Dict, Optional",
+        "",
+        "from picard.metadata import Metadata",
+        "from picard.plugins._support import (",
+        "    TrackContext,",
+        "    register_track_metadata_processor,",
+        ")",
+        "",
+        "",
+        "if TYPE_CHECKING:",
+        "    from picard.album import Album",
+        "",
+        "",
+        f"PLUGIN_NAME = {script.title + ' (compiled)'!r}",
+        'PLUGIN_AUTHOR = "Alexis Jeandeau"',
+        'PLUGIN_DESCRIPTION = """',
+        f"Compiled version of the “{script.title}” tagging script",
+        f"({script.script_id}).",
+        "",
+        "Requires the “Plugin support library” plugin.",
+        '"""',
+        'PLUGIN_VERSION = "1.0"',
+        "PLUGIN_API_VERSIONS = [",
+        *(f'    "{version}",' for version in API_VERSIONS),
+        "]",
+        'PLUGIN_LICENSE = "GPL-2.0-or-later"',
+        'PLUGIN_LICENSE_URL = "https://www.gnu.org/licenses/gpl-2.0.html"',
+        "",
+        "",
+    ]
+    definitions: List[str] = []
+    body: List[str] = []
+
+    for block in blocks:
+        indent = "    "
+        if block.condition is not None:
+            body.append(f"    if {block.condition}:")
+            indent += "    "
+        statements = _group(block.statements)
+        if not statements:
+            body.append(f"{indent}pass")
+        for tag, replacements in statements.items():
+            if replacements not in functions:
+                functions[replacements] = len(functions)
+                definitions.extend(
+                    _replace_function(functions[replacements], replacements)
+                )
+            body.append(
+                f"{indent}_set(context, {tag!r}, "
+                f"_replace_{functions[replacements]}"
+                f"(context.get({tag!r})))"
+            )
+
+    footer = [
+        "def _set(context: TrackContext, name: str, value: str) -> None:",
+        "    # Same as $set, an empty value removes the tag",
+        "    if value:",
+        "        context.set(name, value)",
+        "    else:",
+        "        context.unset(name)",
+        "",
+        "",
+        "def process_track(",
+        '    _album: "Album",',
+        "    metadata: Metadata,",
+        "    _track: Dict[str, Any],",
+        "    _release: Dict[str, Any],",
+        "    context: Optional[TrackContext] = None,",
+        ") -> None:",
+        f'    """Run the “{script.title}” script."""',
+        "    if context is None:",
+        "        context = TrackContext(metadata)",
+        *body,
+        "",
+        "",
+        "register_track_metadata_processor(process_track)",
+    ]
+
+    return "\n".join(header + definitions + footer) + "\n"
+
+
+def compile_scripts(dest_dir: Path) -> None:
+    """Compile the supported tagging scripts to plugins."""
+    for path in get_script_paths():
+        name = f"{path.stem}_compiled"
+        try:
+            source = compile_script(Script.load(path), path.stem)
+        except UnsupportedScript as error:
+            print(f"Skipping {path.name}: {error}", file=stderr)
+            continue
+
+        plugin_dir = dest_dir / name
+        plugin_dir.mkdir(parents=True, exist_ok=True)
+        (plugin_dir / f"{name}.py").write_text(source, encoding="utf-8")
+        print(f"Compiled {path.name} to {plugin_dir}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--build-dir",
+        default=Path("build") / "compiled",
+        type=Path,
+        help="path of the generated plugins",
+    )
+    args = parser.parse_args()
+
+    compile_scripts(args.build_dir)
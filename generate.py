@@ -12,17 +12,40 @@ from ast import (
     literal_eval,
     parse as ast_parse,
 )
-from hashlib import md5
-from json import dump as json_dump
-from pathlib import Path, PurePosixPath
+from contextlib import suppress
+from gzip import GzipFile
+from hashlib import md5, sha256
+from json import dump as json_dump, dumps, load as json_load
+from pathlib import Path
 from sys import stderr
-from typing import Dict, Union
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Union, cast
+
+from lib import (
+    ARCHIVE_HASH_LENGTH,
+    PLUGIN_FILE,
+    Plugin,
+    Script,
+    create_hashed_zip,
+    create_patch_zip,
+    create_zip,
+    files_digest,
+    get_plugin_tree,
+    get_script_paths,
+    rm_path,
+    scan_plugin,
+    watch_plugin_dirs,
+)
+
 
-from lib import create_zip, get_plugin_dirs
+# The compact index of the sharded json data
+INDEX_FILE = "index.json"
 
+# The folder that contains the json data of each plugin
+SHARD_DIR = "plugins"
 
-# The file that contains json data
-PLUGIN_FILE = "plugins.json"
+# The file that contains the tagging scripts
+SCRIPTS_FILE = "scripts.json"
 
 # Known metadata for Picard plugins
 KNOWN_DATA = [
@@ -35,7 +58,8 @@ KNOWN_DATA = [
     "PLUGIN_DESCRIPTION",
 ]
 
-PluginMetadata = Dict[str, Union[str, Dict[str, str]]]
+PluginMetadata = Dict[str, Union[str, Dict[str, Any]]]
+ScriptMetadata = Dict[str, str]
 
 
 def get_plugin_data(filepath: str) -> PluginMetadata:
@@ -77,61 +101,397 @@ def get_plugin_data(filepath: str) -> PluginMetadata:
     return data
 
 
-def build_json(dest_dir: Path) -> None:
-    """Traverse the plugins directory to generate JSON data."""
-    plugins: Dict[str, PluginMetadata] = {}
+def get_plugin_json(
+    plugin: Plugin,
+    files: Optional[Dict[str, str]] = None,
+) -> Optional[PluginMetadata]:
+    """Return the JSON data of a plugin, or None if it is not a plugin.
 
-    for plugin_dir in get_plugin_dirs():
-        files: Dict[str, str] = {}
-        data: PluginMetadata = {}
-
-        script_files = [f for f in plugin_dir.glob("**/*") if f.is_file()]
+    `files` maps the names of the files of the plugin to their MD5, if they
+    were already computed while building its archive.
+    """
+    data: PluginMetadata = {}
 
-        for script_file in script_files:
-            ext = script_file.suffix
+    if files is None:
+        files = {}
+        for script_file in plugin.files:
+            with open(script_file.path, "rb") as md5file:
+                md5_hash = md5(md5file.read()).hexdigest()  # noqa: S303
+            files[script_file.name] = md5_hash
+
+    for script_file in plugin.python_files:
+        try:
+            data = get_plugin_data(str(script_file.path))
+        except ValueError:
+            print(f"Cannot parse {script_file.path}")
+            raise
+        if data:
+            break
+
+    if not files or not data:
+        return None
+
+    data["files"] = files
+    return data
 
-            if ext != ".pyc":
-                with open(script_file, "rb") as md5file:
-                    md5_hash = md5(md5file.read()).hexdigest()  # noqa: S303
-                files[
-                    str(PurePosixPath(script_file.relative_to(plugin_dir)))
-                ] = md5_hash
 
-                if ext == ".py" and not data:
-                    try:
-                        data = get_plugin_data(str(script_file))
-                    except ValueError:
-                        print(f"Cannot parse {script_file}")
-                        raise
+def write_file(path: Path, data: bytes, compress: bool = False) -> None:
+    """Write data to a file, and optionally a gzipped copy of it."""
+    path.write_bytes(data)
+
+    if compress:
+        # Use a fixed timestamp so that unchanged data gives the same file
+        with open(f"{path}.gz", "wb") as raw_file, GzipFile(
+            filename="",
+            mode="wb",
+            compresslevel=9,
+            fileobj=raw_file,
+            mtime=0,
+        ) as gz_file:
+            gz_file.write(data)
+
+
+def write_sharded_json(
+    dest_dir: Path,
+    plugins: Dict[str, PluginMetadata],
+) -> None:
+    """Write a compact index and the JSON data of each plugin separately.
+
+    Each file also gets a precompressed `.gz` copy.
+    """
+    shard_dir = dest_dir / SHARD_DIR
+    shard_dir.mkdir(exist_ok=True)
+
+    index: Dict[str, Dict[str, object]] = {}
+
+    for name, data in plugins.items():
+        shard = dumps(data, sort_keys=True, separators=(",", ":")).encode()
+        write_file(shard_dir / f"{name}.json", shard, compress=True)
+        index[name] = {
+            "version": data.get("version"),
+            "shard": f"{SHARD_DIR}/{name}.json",
+            "sha256": sha256(shard).hexdigest(),
+        }
+
+    # Remove the data of deleted plugins
+    for shard_file in shard_dir.glob("*.json*"):
+        if shard_file.name.split(".", 1)[0] not in plugins:
+            rm_path(shard_file)
+
+    write_file(
+        dest_dir / INDEX_FILE,
+        dumps(
+            {"plugins": index}, sort_keys=True, separators=(",", ":")
+        ).encode(),
+        compress=True,
+    )
 
-        if files and data:
-            print(f"Added {plugin_dir.name}")
-            data["files"] = files
-            plugins[plugin_dir.name] = data
 
+def write_json(
+    dest_dir: Path,
+    plugins: Dict[str, PluginMetadata],
+    sharded: bool = False,
+) -> None:
+    """Write the JSON data of the plugins to the destination folder."""
     out_path = dest_dir / PLUGIN_FILE
 
     with open(out_path, "w") as out_file:
         json_dump({"plugins": plugins}, out_file, sort_keys=True, indent=2)
 
+    if sharded:
+        write_sharded_json(dest_dir, plugins)
+
+
+def add_delta(
+    plugin: Plugin,
+    data: PluginMetadata,
+    previous: Optional[PluginMetadata],
+    dest_dir: Path,
+) -> None:
+    """Add the changes since the previous build of a plugin to its data.
+
+    The changed files are written to a patch archive. The `delta` of the
+    plugin data gives the name of the patch archive, the changed and removed
+    files, and the `files_digest` of the files of the previous build.
+    Nothing is added for new plugins.
+    """
+    if not previous:
+        return
+
+    old_files = cast(Dict[str, str], previous["files"])
+    new_files = cast(Dict[str, str], data["files"])
+
+    if old_files == new_files:
+        # Keep the delta of the previous build when nothing changed
+        delta = previous.get("delta")
+        if isinstance(delta, dict) and (dest_dir / delta["patch"]).is_file():
+            data["delta"] = delta
+        return
+
+    changed: List[str] = sorted(
+        name
+        for name, md5_hash in new_files.items()
+        if old_files.get(name) != md5_hash
+    )
+    base = files_digest(old_files)
+    patch = (
+        f"{plugin.name}-{base[:ARCHIVE_HASH_LENGTH]}-"
+        f"{files_digest(new_files)[:ARCHIVE_HASH_LENGTH]}.patch.zip"
+    )
+    create_patch_zip(plugin, dest_dir / patch, changed)
+
+    data["delta"] = {
+        "base": base,
+        "changed": changed,
+        "removed": sorted(set(old_files) - set(new_files)),
+        "patch": patch,
+    }
+
+
+def build_json(
+    dest_dir: Path,
+    sharded: bool = False,
+    archives: Optional[Dict[str, str]] = None,
+    deltas: bool = False,
+    zip_archives: bool = False,
+) -> None:
+    """Traverse the plugins directory to generate JSON data.
+
+    `archives` maps plugin names to the names of their content-addressed
+    archives, which are added to the data of the plugins. If `deltas` is
+    True, the changes since the previous JSON data are added too, see
+    `add_delta`. If `zip_archives` is True, the archives are built at the
+    same time, reading the files of each plugin once for both.
+    """
+    plugins: Dict[str, PluginMetadata] = {}
+    previous: Dict[str, PluginMetadata] = {}
+
+    if deltas and (dest_dir / PLUGIN_FILE).is_file():
+        with open(dest_dir / PLUGIN_FILE, "r", encoding="utf-8") as in_file:
+            previous = json_load(in_file)["plugins"]
+
+    for plugin in get_plugin_tree():
+        files: Optional[Dict[str, str]] = {} if zip_archives else None
+        if files is not None and not zip_plugin(
+            plugin, dest_dir, archives, files
+        ):
+            exit(1)
+        data = get_plugin_json(plugin, files)
+
+        if data:
+            print(f"Added {plugin.name}")
+            if archives and plugin.name in archives:
+                data["archive"] = archives[plugin.name]
+            if deltas:
+                add_delta(plugin, data, previous.get(plugin.name), dest_dir)
+            plugins[plugin.name] = data
+
+    write_json(dest_dir, plugins, sharded)
+
+
+def update_json(
+    dest_dir: Path,
+    plugin_dirs: Iterable[Path],
+    sharded: bool = False,
+    archives: Optional[Dict[str, str]] = None,
+    zip_archives: bool = False,
+) -> None:
+    """Update the entries of some plugins in the existing JSON data.
+
+    `archives` and `zip_archives` are the same as for `build_json`.
+    """
+    out_path = dest_dir / PLUGIN_FILE
+    plugins: Dict[str, PluginMetadata] = {}
 
-def zip_files(dest_dir: Path) -> None:
-    """Zip up the plugin folders."""
-    for plugin_dir in get_plugin_dirs():
-        python_files = list(plugin_dir.glob("**/*.py"))
-        if len(python_files) == 1:
-            create_zip(plugin_dir, dest_dir, single_file=True)
-        elif len(python_files) > 1:
-            if not any(
-                str(python_file.relative_to(plugin_dir)) == "__init__.py"
-                for python_file in python_files
+    if out_path.is_file():
+        with open(out_path, "r", encoding="utf-8") as in_file:
+            plugins = json_load(in_file)["plugins"]
+
+    for plugin_dir in plugin_dirs:
+        data: Optional[PluginMetadata] = None
+        if plugin_dir.is_dir():
+            plugin = scan_plugin(plugin_dir)
+            files: Optional[Dict[str, str]] = {} if zip_archives else None
+            if files is not None and not zip_plugin(
+                plugin, dest_dir, archives, files
             ):
-                print(
-                    f'No "__init__.py" file found in {plugin_dir}',
-                    file=stderr,
-                )
-                exit(1)
-            create_zip(plugin_dir, dest_dir)
+                # Hash the files separately
+                files = None
+            data = get_plugin_json(plugin, files)
+
+        if data:
+            print(f"Updated {plugin_dir.name}")
+            if archives and plugin_dir.name in archives:
+                data["archive"] = archives[plugin_dir.name]
+            plugins[plugin_dir.name] = data
+        elif plugins.pop(plugin_dir.name, None):
+            print(f"Removed {plugin_dir.name}")
+
+    write_json(dest_dir, plugins, sharded)
+
+
+def normalize_script(source: str) -> str:
+    """Return a script with Unix line endings and no surrounding whitespace.
+
+    The whitespace around a valid script is output text, which is ignored by
+    tagging scripts.
+    """
+    return source.replace("\r\n", "\n").strip()
+
+
+def get_script_json(
+    path: Path,
+    previous: Optional[ScriptMetadata] = None,
+) -> ScriptMetadata:
+    """Return the JSON data of a tagging script.
+
+    The script is parsed to check that it is valid, unless `previous` is the
+    data of the same file.
+
+    Raises ValueError or ScriptError if the script is invalid.
+    """
+    # Picard is only needed to build the scripts
+    from picard.script import ScriptParser
+
+    # Register $replacemany, used by some scripts
+    import plugins.replace_many.replace_many  # noqa: F401
+
+    checksum = sha256(path.read_bytes()).hexdigest()
+    if previous and previous.get("sha256") == checksum:
+        return previous
+
+    script = Script.load(path)
+    source = normalize_script(script.source)
+    ScriptParser().parse(source)
+
+    return {
+        "id": script.script_id,
+        "title": script.title,
+        "script_language_version": script.language_version,
+        "sha256": checksum,
+        "script": source,
+    }
+
+
+def build_scripts_json(dest_dir: Path, compress: bool = False) -> None:
+    """Validate the tagging scripts and bundle them in a single file.
+
+    Scripts whose checksum did not change since the previous bundle are not
+    parsed again.
+    """
+    from picard.script import ScriptError
+
+    out_path = dest_dir / SCRIPTS_FILE
+    previous: Dict[str, ScriptMetadata] = {}
+    scripts: Dict[str, ScriptMetadata] = {}
+    ids: Dict[str, str] = {}
+
+    if out_path.is_file():
+        with open(out_path, "r", encoding="utf-8") as in_file:
+            previous = json_load(in_file)["scripts"]
+
+    for path in get_script_paths():
+        try:
+            data = get_script_json(path, previous.get(path.stem))
+        except (ValueError, ScriptError) as error:
+            print(f"Invalid script {path}: {error}", file=stderr)
+            exit(1)
+
+        if data["id"] in ids:
+            print(
+                f"Duplicate script ID {data['id']} in {path} "
+                f"and {ids[data['id']]}",
+                file=stderr,
+            )
+            exit(1)
+
+        ids[data["id"]] = path.name
+        print(f"Added {path.stem}")
+        scripts[path.stem] = data
+
+    write_file(
+        out_path,
+        dumps(
+            {"scripts": scripts}, ensure_ascii=False, sort_keys=True, indent=2
+        ).encode(),
+        compress,
+    )
+
+
+def zip_plugin(
+    plugin: Plugin,
+    dest_dir: Path,
+    archives: Optional[Dict[str, str]] = None,
+    files: Optional[Dict[str, str]] = None,
+) -> bool:
+    """Zip up a plugin folder.
+
+    If `archives` is set, the archive is named after a hash of its contents
+    and its name is added to `archives`. If `files` is set, the MD5 of the
+    files of the plugin are added to it.
+
+    Returns False if the plugin has multiple files but no `__init__.py`.
+    """
+    if not plugin.python_files:
+        return True
+    if not plugin.is_single_file and not plugin.is_package:
+        print(
+            f'No "__init__.py" file found in {plugin.path}',
+            file=stderr,
+        )
+        return False
+
+    if archives is None:
+        create_zip(plugin, dest_dir, plugin.is_single_file, files)
+    else:
+        archives[plugin.name] = create_hashed_zip(
+            plugin, dest_dir, plugin.is_single_file, files
+        ).name
+    return True
+
+
+def zip_files(
+    dest_dir: Path,
+    archives: Optional[Dict[str, str]] = None,
+) -> None:
+    """Zip up the plugin folders.
+
+    If `archives` is set, the archives are named after a hash of their
+    contents, and their names are added to `archives` by plugin name.
+    """
+    for plugin in get_plugin_tree():
+        if not zip_plugin(plugin, dest_dir, archives):
+            exit(1)
+
+
+def watch(
+    dest_dir: Path,
+    json: bool,
+    zip_archives: bool,
+    sharded: bool = False,
+    content_addressed: bool = False,
+) -> None:
+    """Rebuild the JSON data and ZIP files of plugins when they change.
+
+    Content-addressed archives of deleted plugins are kept, like those of
+    previous versions, for the clients which have not fetched the new JSON
+    data yet.
+    """
+    for plugin_dirs in watch_plugin_dirs():
+        start = perf_counter()
+        archives: Optional[Dict[str, str]] = {} if content_addressed else None
+
+        if zip_archives:
+            for plugin_dir in plugin_dirs:
+                if not plugin_dir.is_dir():
+                    if not content_addressed:
+                        rm_path(dest_dir / f"{plugin_dir.name}.zip")
+                elif not json:
+                    zip_plugin(scan_plugin(plugin_dir), dest_dir, archives)
+        if json:
+            update_json(dest_dir, plugin_dirs, sharded, archives, zip_archives)
+
+        print(f"Rebuilt in {perf_counter() - start:.3f}s")
 
 
 if __name__ == "__main__":
@@ -157,12 +517,61 @@ if __name__ == "__main__":
         dest="json",
         help="Do not generate the json file in the build output",
     )
+    parser.add_argument(
+        "--no-scripts",
+        action="store_false",
+        dest="scripts",
+        help=f"Do not generate the {SCRIPTS_FILE} file in the build output",
+    )
+    parser.add_argument(
+        "--sharded",
+        action="store_true",
+        help=(
+            f"also generate a compact {INDEX_FILE} file, a json file per "
+            "plugin and gzipped copies of them and of the scripts"
+        ),
+    )
+    parser.add_argument(
+        "--content-addressed",
+        action="store_true",
+        help=(
+            "name the zip files <plugin>-<hash>.zip after a hash of their "
+            f"contents, and reference them in {PLUGIN_FILE}"
+        ),
+    )
+    parser.add_argument(
+        "--deltas",
+        action="store_true",
+        help=(
+            "also generate patch archives with the files changed since the "
+            f"previous {PLUGIN_FILE}, and describe them in {PLUGIN_FILE}"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and rebuild the plugins when their files change",
+    )
     args = parser.parse_args()
 
     dest_dir: Path = args.build_dir
     dest_dir.mkdir(parents=True, exist_ok=True)
 
+    archives: Optional[Dict[str, str]] = {} if args.content_addressed else None
+
+    # The archives are built with the JSON data, reading each file once
     if args.json:
-        build_json(dest_dir)
-    if args.zip:
-        zip_files(dest_dir)
+        build_json(dest_dir, args.sharded, archives, args.deltas, args.zip)
+    elif args.zip:
+        zip_files(dest_dir, archives)
+    if args.scripts:
+        build_scripts_json(dest_dir, args.sharded)
+    if args.watch:
+        with suppress(KeyboardInterrupt):
+            watch(
+                dest_dir,
+                args.json,
+                args.zip,
+                args.sharded,
+                args.content_addressed,
+            )
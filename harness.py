@@ -0,0 +1,542 @@
+"""Run the plugins' metadata processors outside of MusicBrainz Picard.
+
+Provides a generator of deterministic synthetic MusicBrainz releases,
+the mapping of release JSON to Picard metadata, and stand-ins for the
+Picard objects used by the plugins.
+"""
+
+from importlib.util import module_from_spec, spec_from_file_location
+from random import Random
+from sys import modules
+from time import perf_counter
+from types import ModuleType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from unittest.mock import patch
+from uuid import UUID
+
+from picard.metadata import (
+    Metadata,
+    register_album_metadata_processor,
+    register_track_metadata_processor,
+)
+from picard.plugin import _PLUGIN_MODULE_PREFIX, PluginPriority
+
+from lib import Plugin, get_plugin_tree
+
+
+Release = Dict[str, Any]
+
+# Timing entry of the processor pipeline
+PIPELINE_ID = "pipeline"
+
+
+class Processor(NamedTuple):
+    """A metadata processor registered by a plugin."""
+
+    plugin: str
+    name: str
+    function: Callable[..., None]
+    priority: int
+
+    @property
+    def id(self) -> str:  # noqa: A003
+        """Unique name of the processor."""
+        return f"{self.plugin}.{self.name}"
+
+
+class Processors(NamedTuple):
+    """Album and track metadata processors, in the order Picard runs them."""
+
+    album: List[Processor]
+    track: List[Processor]
+
+
+def load_plugin(plugin: Plugin) -> Tuple[ModuleType, Processors]:
+    """Import a plugin and return the metadata processors it registers.
+
+    The plugin is loaded as a new module each time, with the same name as
+    in Picard, so its state is not shared with other instances. Its
+    processors are not registered in Picard.
+    """
+    processors = Processors([], [])
+    module_name = f"{_PLUGIN_MODULE_PREFIX}{plugin.name}"
+
+    def register(
+        processor_list: List[Processor],
+        register_function: Callable[..., None],
+    ) -> Callable[..., None]:
+        def register_processor(
+            function: Callable[..., None],
+            priority: int = PluginPriority.NORMAL,
+        ) -> None:
+            if function.__module__ != module_name and not (
+                function.__module__.startswith(f"{module_name}.")
+            ):
+                # Registered by a Picard module imported by the plugin
+                register_function(function, priority)
+                return
+            processor_list.append(
+                Processor(
+                    plugin=plugin.name,
+                    name=getattr(function, "__qualname__", repr(function)),
+                    function=function,
+                    priority=priority,
+                )
+            )
+
+        return register_processor
+
+    if plugin.is_package:
+        spec = spec_from_file_location(
+            module_name,
+            str(plugin.path / "__init__.py"),
+            submodule_search_locations=[str(plugin.path)],
+        )
+    else:
+        spec = spec_from_file_location(
+            module_name, str(plugin.python_files[0].path)
+        )
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Cannot load {plugin.path}")
+
+    module = module_from_spec(spec)
+    modules[module_name] = module
+    with patch(
+        "picard.metadata.register_album_metadata_processor",
+        register(processors.album, register_album_metadata_processor),
+    ), patch(
+        "picard.metadata.register_track_metadata_processor",
+        register(processors.track, register_track_metadata_processor),
+    ):
+        spec.loader.exec_module(module)
+
+    return module, processors
+
+
+def load_processors() -> Processors:
+    """Load the metadata processors of all the plugins of this repository.
+
+    Plugins are loaded in the same order as Picard, so that the support
+    library is loaded before the plugins which import it.
+    """
+    processors = Processors([], [])
+
+    for plugin in get_plugin_tree():
+        if not plugin.python_files:
+            continue
+        _module, plugin_processors = load_plugin(plugin)
+        processors.album.extend(plugin_processors.album)
+        processors.track.extend(plugin_processors.track)
+
+    # Picard runs processors with a higher priority first
+    processors.album.sort(key=lambda processor: -processor.priority)
+    processors.track.sort(key=lambda processor: -processor.priority)
+
+    return processors
+
+
+def _without_timings(function: Callable[..., None]) -> Callable[..., None]:
+    """Return a processor without its timing instrumentation."""
+    wrapped: Callable[..., None] = getattr(function, "__wrapped__", function)
+    return wrapped
+
+
+def make_pipeline(processors: Processors) -> Any:
+    """Return a pipeline of the support library running `processors`.
+
+    The plugins must have been loaded with `load_processors`. All of them are
+    considered enabled. The pipeline records the timings of the processors
+    itself, like when the plugins register them with the pipeline enabled.
+    """
+    support = modules[f"{_PLUGIN_MODULE_PREFIX}_support"]
+    pipeline = support.Pipeline(
+        enabled_plugins={
+            processor.plugin
+            for processor in processors.album + processors.track
+        }
+    )
+
+    for processor in processors.album:
+        pipeline.add_album_processor(
+            _without_timings(processor.function), processor.priority
+        )
+    for processor in processors.track:
+        pipeline.add_track_processor(
+            _without_timings(processor.function), processor.priority
+        )
+
+    return pipeline
+
+
+class FakeNetworkReply:
+    """Stand-in for the `QNetworkReply` passed to web service callbacks."""
+
+    def __init__(self, error: str) -> None:
+        self.error = error
+
+    def errorString(self) -> str:  # noqa: N802
+        """Return the error message."""
+        return self.error
+
+
+class FakeMBAPIHelper:
+    """Stand-in for `MBAPIHelper`, serving releases from a callable.
+
+    Callbacks are called synchronously.
+    """
+
+    def __init__(self, get_release: Callable[[str], Optional[Release]]):
+        self.get_release = get_release
+        self.requests = 0
+
+    def get_release_by_id(
+        self,
+        releaseid: str,
+        handler: Callable[[Release, Any, int], None],
+        inc: Optional[Sequence[str]] = None,
+        priority: bool = False,
+        important: bool = False,
+        mblogin: bool = False,
+        refresh: bool = False,
+    ) -> None:
+        """Call `handler` with the release `releaseid`."""
+        self.requests += 1
+        document = self.get_release(releaseid)
+        if document is None:
+            handler({}, FakeNetworkReply(f"Release {releaseid} not found"), 1)
+        else:
+            handler(document, None, 0)
+
+
+class FakeTagger:
+    """Stand-in for `Tagger`."""
+
+    def __init__(self, mb_api: FakeMBAPIHelper) -> None:
+        self.mb_api = mb_api
+
+
+class FakeAlbum:
+    """Stand-in for `Album`, counting the pending web service requests."""
+
+    def __init__(self, release_id: str, tagger: FakeTagger) -> None:
+        self.id = release_id
+        self.tagger = tagger
+        self._requests = 0
+
+    def _finalize_loading(self, error: Optional[bool]) -> None:
+        pass
+
+
+def release_to_metadata(release: Release) -> Metadata:
+    """Return the album metadata Picard sets for a release."""
+    metadata = Metadata()
+    metadata["musicbrainz_albumid"] = release["id"]
+    metadata["album"] = release["title"]
+    metadata["totaldiscs"] = len(release["media"])
+
+    status = release.get("status")
+    if status:
+        metadata["releasestatus"] = status.lower()
+
+    text_representation = release.get("text-representation") or {}
+    if text_representation.get("language"):
+        metadata["~releaselanguage"] = text_representation["language"]
+    if text_representation.get("script"):
+        metadata["script"] = text_representation["script"]
+
+    for label_info in release.get("label-info", []):
+        if label_info.get("label"):
+            metadata.add("label", label_info["label"]["name"])
+        if label_info.get("catalog-number"):
+            metadata.add("catalognumber", label_info["catalog-number"])
+
+    return metadata
+
+
+def track_to_metadata(
+    album_metadata: Metadata,
+    medium: Dict[str, Any],
+    track: Dict[str, Any],
+) -> Metadata:
+    """Return the track metadata Picard sets for a track of a release."""
+    metadata = Metadata(album_metadata)
+    metadata["title"] = track["title"]
+    metadata["discnumber"] = medium["position"]
+    metadata["tracknumber"] = track["position"]
+    metadata["totaltracks"] = medium["track-count"]
+    metadata["musicbrainz_trackid"] = track["id"]
+    metadata["musicbrainz_recordingid"] = track["recording"]["id"]
+    return metadata
+
+
+def iter_tracks(
+    release: Release,
+) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Yield the medium and track JSON of each track of a release."""
+    for medium in release["media"]:
+        for track in medium["tracks"]:
+            yield medium, track
+
+
+_WORDS = (
+    "Love",
+    "Night",
+    "Summer",
+    "River",
+    "Dream",
+    "Light",
+    "Heart",
+    "Wind",
+    "Fire",
+    "Stars",
+    "Road",
+    "Rain",
+)
+_PREFIXES = {
+    "eng": ("The ", "A ", ""),
+    "fra": ("Le ", "La ", "L’", ""),
+    "deu": ("Der ", "Die ", "Das ", ""),
+    "ita": ("Il ", "La ", "Gli ", ""),
+    "jpn": ("",),
+}
+_KEYS = {
+    "eng": ("in C Minor", "in E-Flat", "in F-Sharp Minor", "in A"),
+    "fra": ("en do mineur", "en mi bémol", "en fa dièse mineur", "en la"),
+    "deu": ("in c-Moll", "in Es", "in Fis-Moll", "in A"),
+    "ita": ("in do minore", "in mi bemolle", "in fa diesis minore", "in la"),
+    "jpn": ("",),
+}
+
+
+def make_release(
+    discs: int,
+    tracks_per_disc: int,
+    seed: int = 0,
+    language: Optional[str] = None,
+) -> Tuple[Release, Dict[str, Release]]:
+    """Generate a synthetic MusicBrainz release.
+
+    The same arguments always produce the same release. Releases contain
+    titles with language prefixes and musical keys, per-disc catalog number
+    ranges, video tracks and media, and a relationship to a transliterated
+    tracklist for Japanese releases.
+
+    Returns the release and a dictionary of the related releases by ID.
+    """
+    rand = Random(f"{seed}-{discs}-{tracks_per_disc}-{language}")
+
+    def mbid() -> str:
+        return str(UUID(int=rand.getrandbits(128), version=4))
+
+    if language is None:
+        language = rand.choice(sorted(_PREFIXES))
+    script = "Jpan" if language == "jpn" else "Latn"
+
+    def title() -> str:
+        words = " ".join(
+            rand.choice(_WORDS) for _ in range(rand.randint(1, 4))
+        )
+        text = f"{rand.choice(_PREFIXES[language])}{words}"
+        if rand.random() < 0.3:
+            text = f"{text} {rand.choice(_KEYS[language])}".rstrip()
+        return text
+
+    # Some releases end with a DVD, which has no catalog number of its own
+    has_video_disc = discs > 1 and rand.random() < 0.5
+    audio_discs = discs - 1 if has_video_disc else discs
+    catalog_start = rand.randint(1000, 9000)
+    release: Release = {
+        "id": mbid(),
+        "title": title(),
+        "status": "Official",
+        "text-representation": {"language": language, "script": script},
+        "label-info": [
+            {
+                "catalog-number": (
+                    f"ABCD-{catalog_start}"
+                    if audio_discs == 1
+                    else f"ABCD-{catalog_start}~"
+                    f"{catalog_start + audio_discs - 1}"
+                ),
+                "label": {"id": mbid(), "name": "Synthetic Records"},
+            },
+        ],
+        "media": [],
+        "relations": [],
+    }
+
+    for position in range(1, discs + 1):
+        is_video = has_video_disc and position == discs
+        medium: Dict[str, Any] = {
+            "position": position,
+            "title": "",
+            "format": "DVD-Video" if is_video else "CD",
+            "track-count": tracks_per_disc,
+            "track-offset": 0,
+            "tracks": [],
+        }
+        for track_position in range(1, tracks_per_disc + 1):
+            track_title = title()
+            medium["tracks"].append(
+                {
+                    "id": mbid(),
+                    "title": track_title,
+                    "number": str(track_position),
+                    "position": track_position,
+                    "length": rand.randint(60_000, 600_000),
+                    "recording": {
+                        "id": mbid(),
+                        "title": track_title,
+                        "length": rand.randint(60_000, 600_000),
+                        "video": is_video,
+                    },
+                }
+            )
+        release["media"].append(medium)
+
+    related: Dict[str, Release] = {}
+
+    if language == "jpn":
+        transliterated: Release = {
+            "id": mbid(),
+            "title": f"{release['title']} (Romaji)",
+            "status": "Pseudo-Release",
+            "disambiguation": "transliterated",
+            "text-representation": {"language": "jpn", "script": "Latn"},
+            "media": [
+                {
+                    "position": medium["position"],
+                    "tracks": [
+                        {
+                            "position": track["position"],
+                            "title": f"{track['title']} (Romaji)",
+                            "recording": {"id": track["recording"]["id"]},
+                        }
+                        for track in medium["tracks"]
+                    ],
+                }
+                for medium in release["media"]
+            ],
+        }
+        related[transliterated["id"]] = transliterated
+        release["relations"].append(
+            {
+                "target-type": "release",
+                "type": "transl-tracklisting",
+                "direction": "forward",
+                "release": {
+                    "id": transliterated["id"],
+                    "disambiguation": transliterated["disambiguation"],
+                    "text-representation": transliterated[
+                        "text-representation"
+                    ],
+                },
+            }
+        )
+
+    return release, related
+
+
+def _make_album(
+    release: Release,
+    related: Optional[Mapping[str, Release]],
+) -> FakeAlbum:
+    """Return an album serving requests for other releases from `related`."""
+    if related is None:
+        related = {}
+    return FakeAlbum(release["id"], FakeTagger(FakeMBAPIHelper(related.get)))
+
+
+def process_release(
+    processors: Processors,
+    release: Release,
+    related: Optional[Mapping[str, Release]] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[Metadata, List[Metadata]]:
+    """Run all the metadata processors on a release, like Picard does.
+
+    Requests for other releases are served from `related`. Each track
+    processor is run on all the tracks before running the next one, which
+    keeps the order of the processors for each track. If `timings` is set,
+    the time spent in each processor is added to it.
+
+    Returns the album metadata and the metadata of each track.
+    """
+    album = _make_album(release, related)
+    album_metadata = release_to_metadata(release)
+
+    for processor in processors.album:
+        start = perf_counter()
+        processor.function(album, album_metadata, release)
+        if timings is not None:
+            timings[processor.id] = (
+                timings.get(processor.id, 0.0) + perf_counter() - start
+            )
+
+    tracks = [
+        (track, track_to_metadata(album_metadata, medium, track))
+        for medium, track in iter_tracks(release)
+    ]
+
+    for processor in processors.track:
+        function = processor.function
+        start = perf_counter()
+        for track, metadata in tracks:
+            function(album, metadata, track, release)
+        if timings is not None:
+            timings[processor.id] = (
+                timings.get(processor.id, 0.0) + perf_counter() - start
+            )
+
+    return album_metadata, [metadata for _track, metadata in tracks]
+
+
+def process_release_pipeline(
+    pipeline: Any,
+    release: Release,
+    related: Optional[Mapping[str, Release]] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[Metadata, List[Metadata]]:
+    """Run a processor pipeline on a release, like Picard does.
+
+    `pipeline` is a `Pipeline` of the support library, see `make_pipeline`.
+    If `timings` is set, the time spent in the pipeline is added to its
+    `pipeline` entry.
+
+    Returns the album metadata and the metadata of each track.
+    """
+    album = _make_album(release, related)
+    album_metadata = release_to_metadata(release)
+    elapsed = 0.0
+
+    start = perf_counter()
+    pipeline.run_album(album, album_metadata, release)
+    elapsed += perf_counter() - start
+
+    tracks_metadata = [
+        track_to_metadata(album_metadata, medium, track)
+        for medium, track in iter_tracks(release)
+    ]
+
+    start = perf_counter()
+    for (_medium, track), metadata in zip(
+        iter_tracks(release), tracks_metadata
+    ):
+        pipeline.run_track(album, metadata, track, release)
+    elapsed += perf_counter() - start
+
+    if timings is not None:
+        timings[PIPELINE_ID] = timings.get(PIPELINE_ID, 0.0) + elapsed
+
+    return album_metadata, tracks_metadata
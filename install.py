@@ -2,17 +2,55 @@
 
 """Installs the plugins to the MusicBrainz Picard plugin folder.
 
-Creates symlinks for single file plugins, creates and copies a ZIP file
-for multi-files plugins.
+Creates and copies a ZIP file for each plugin. Archives whose contents did
+not change are not rewritten. With `--dev`, symlinks single file plugins
+and the folders of multi-files plugins instead, so that changes are picked
+up by Picard without installing them again.
+
+Several plugin folders can be given, e.g. for multiple Picard profiles.
+The archives are then built once, in the first folder, and hardlinked,
+reflinked or copied to the others.
+
+With `--from-build`, installs the archives generated by `generate.py`
+instead, applying the patch archives of the plugins generated with
+`--deltas` when the installed version is the one they apply to.
 """
 
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
-from os import environ
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
+from json import load as json_load
+from os import environ, link, replace
 from pathlib import Path
 from platform import system
+from shutil import copyfile
 from sys import exit, stderr
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from lib import (
+    PLUGIN_FILE,
+    Plugin,
+    archive_digest,
+    archive_files,
+    archive_prefix,
+    create_zip,
+    files_digest,
+    get_plugin_tree,
+    is_compiled,
+    rm_path,
+    scan_plugin,
+    watch_plugin_dirs,
+)
 
-from lib import create_zip, get_plugin_dirs, rm_path
+
+# Number of archives copied in parallel to other plugin folders
+COPY_JOBS = 8
+
+# ioctl cloning a file on the filesystems supporting it, see ioctl_ficlone(2)
+_FICLONE = 0x40049409
 
 
 def path_from_env(variable: str, default: Path) -> Path:
@@ -40,7 +78,10 @@ def get_picard_user_plugin_dir() -> Path:
 
 
 def create_symlink(python_file: Path, plugin_dir: Path) -> None:
-    """Create a symlink to a file in the MusicBrainz Picard plugin folder."""
+    """Create a symlink to a file in the MusicBrainz Picard plugin folder.
+
+    `python_file` can also be the folder of a package plugin.
+    """
     symlink = plugin_dir / python_file.name
 
     if symlink.is_symlink():
@@ -50,11 +91,279 @@ def create_symlink(python_file: Path, plugin_dir: Path) -> None:
     if symlink.exists():
         rm_path(symlink)
 
-    symlink.symlink_to(python_file)
+    symlink.symlink_to(python_file, target_is_directory=python_file.is_dir())
 
     print(f"Symlinked {symlink} to {symlink.resolve()}")
 
 
+def is_loadable_package(path: Path) -> bool:
+    """Return whether Picard loads the package plugin installed at `path`.
+
+    Asks Picard's plugin manager when Picard can be imported, the installer
+    does not require it otherwise.
+    """
+    try:
+        from picard.pluginmanager import _plugin_name_from_path
+    except ImportError:
+        # Picard only requires a package entry
+        return (path / "__init__.py").is_file()
+
+    name: Optional[str] = _plugin_name_from_path(str(path))
+    return name == path.name
+
+
+def install_plugin(plugin: Plugin, user_plugin_dir: Path, dev: bool) -> bool:
+    """Install a plugin to the MusicBrainz Picard plugin folder.
+
+    Returns False if the plugin has multiple files but no `__init__.py`, or
+    if Picard would not load the symlinked folder of a package plugin.
+    """
+    if plugin.python_files and not (
+        plugin.is_single_file or plugin.is_package
+    ):
+        print(
+            f'No "__init__.py" file found in {plugin.path}',
+            file=stderr,
+        )
+        return False
+
+    if plugin.python_files and dev:
+        # Picard loads an archive instead of a module of the same name
+        rm_path(user_plugin_dir / f"{plugin.name}.zip")
+
+    if plugin.is_single_file:
+        if dev:
+            # Symlink the file
+            create_symlink(plugin.python_files[0].path, user_plugin_dir)
+        else:
+            # Create a ZIP file and copy
+            create_zip(plugin, user_plugin_dir, single_file=True)
+    elif plugin.python_files:
+        if dev:
+            # Symlink the folder
+            create_symlink(plugin.path, user_plugin_dir)
+            if not is_loadable_package(user_plugin_dir / plugin.name):
+                print(
+                    f"Picard cannot load {user_plugin_dir / plugin.name}",
+                    file=stderr,
+                )
+                return False
+        else:
+            # Create a ZIP file and copy
+            create_zip(plugin, user_plugin_dir)
+    return True
+
+
+def _reflink(source: Path, dest: Path) -> bool:
+    try:
+        from fcntl import ioctl
+    except ImportError:  # Windows
+        return False
+
+    with open(source, "rb") as source_file, open(dest, "wb") as dest_file:
+        try:
+            ioctl(dest_file.fileno(), _FICLONE, source_file.fileno())
+        except OSError:
+            return False
+    return True
+
+
+def link_archive(archive: Path, user_plugin_dir: Path, digest: str) -> bool:
+    """Install an archive built in another plugin folder.
+
+    The archive is hardlinked if possible, else reflinked if the filesystem
+    supports it, else copied. Archives are always replaced with a new file,
+    never modified, so the other links are not affected. If the installed
+    archive already has the same contents, it is left untouched.
+
+    `digest` is the `archive_digest` of `archive`.
+
+    Returns whether the archive was installed.
+    """
+    dest = user_plugin_dir / archive.name
+
+    if dest.is_file() and (
+        dest.samefile(archive) or archive_digest(dest) == digest
+    ):
+        print(f"{dest} is up to date")
+        return False
+
+    with TemporaryDirectory(prefix=".", dir=str(user_plugin_dir)) as tmp_dir:
+        new_archive = Path(tmp_dir) / archive.name
+        try:
+            link(str(archive), str(new_archive))
+            method = "Hardlinked"
+        except OSError:
+            if _reflink(archive, new_archive):
+                method = "Reflinked"
+            else:
+                copyfile(str(archive), str(new_archive))
+                method = "Copied"
+        replace(str(new_archive), str(dest))
+
+    print(f"{method} {archive} to {dest}")
+    return True
+
+
+def install_plugins(
+    plugins: Iterable[Plugin],
+    user_plugin_dirs: Sequence[Path],
+    dev: bool,
+    jobs: int = COPY_JOBS,
+) -> bool:
+    """Install plugins to one or more MusicBrainz Picard plugin folders.
+
+    Each archive is built once in the first folder, then installed in the
+    other folders by `link_archive`, `jobs` at a time.
+
+    Returns False if a plugin cannot be installed, see `install_plugin`.
+    """
+    first_dir, *other_dirs = user_plugin_dirs
+    futures: List["Future[bool]"] = []
+
+    with ThreadPoolExecutor(jobs) as executor:
+        for plugin in plugins:
+            if not install_plugin(plugin, first_dir, dev):
+                return False
+            if not other_dirs or not plugin.python_files:
+                continue
+
+            if dev:
+                # Symlinks are cheap, create them in each folder
+                for user_plugin_dir in other_dirs:
+                    if not install_plugin(plugin, user_plugin_dir, dev):
+                        return False
+                continue
+
+            archive = first_dir / f"{plugin.name}.zip"
+            digest = archive_digest(archive)
+            futures.extend(
+                executor.submit(link_archive, archive, user_plugin_dir, digest)
+                for user_plugin_dir in other_dirs
+            )
+
+        # Raise the errors of the copies
+        for future in futures:
+            future.result()
+
+    return True
+
+
+def read_plugin_dirs(path: Path) -> List[Path]:
+    """Return the plugin folders listed in a file, one per line.
+
+    Empty lines and lines starting with `#` are ignored.
+    """
+    with open(path, "r", encoding="utf-8") as in_file:
+        return [
+            Path(line.strip())
+            for line in in_file
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+
+def apply_patch(
+    archive: Path,
+    patch: Path,
+    name: str,
+    data: Dict[str, Any],
+) -> bool:
+    """Update the installed archive of a plugin with a patch archive.
+
+    `data` is the JSON data of the new version of the plugin, with the
+    `delta` generated by `generate.py --deltas`. The patched archive is
+    checked against the `files` of `data` before replacing the installed
+    one.
+
+    Returns False, leaving the installed archive untouched, if it is not the
+    version the patch applies to or if the patched archive is invalid.
+    """
+    delta = data["delta"]
+    if files_digest(archive_files(archive, name)) != delta["base"]:
+        return False
+
+    replaced = set(delta["changed"]) | set(delta["removed"])
+
+    with TemporaryDirectory(prefix=".", dir=str(archive.parent)) as tmp_dir:
+        new_archive = Path(tmp_dir) / archive.name
+
+        with ZipFile(archive) as old_zip, ZipFile(patch) as patch_zip, ZipFile(
+            new_archive, "w", ZIP_DEFLATED
+        ) as new_zip:
+            prefix = archive_prefix(old_zip, name)
+            for info in old_zip.infolist():
+                file_name = info.filename[len(prefix) :]  # noqa: E203
+                # Compiled files of the previous version would be stale
+                if file_name not in replaced and not is_compiled(file_name):
+                    new_zip.writestr(info, old_zip.read(info))
+            for info in patch_zip.infolist():
+                new_zip.writestr(info, patch_zip.read(info))
+
+        if archive_files(new_archive, name) != data["files"]:
+            print(f"Invalid patch {patch} for {archive}", file=stderr)
+            return False
+
+        replace(str(new_archive), str(archive))
+
+    print(f"Patched {archive} with {patch}")
+    return True
+
+
+def install_from_build(build_dir: Path, user_plugin_dir: Path) -> None:
+    """Install the plugin archives generated by `generate.py`.
+
+    Installed plugins are patched when possible, and only downloaded in
+    full otherwise. Plugins which did not change are left untouched.
+    """
+    with open(build_dir / PLUGIN_FILE, "r", encoding="utf-8") as in_file:
+        plugins: Dict[str, Dict[str, Any]] = json_load(in_file)["plugins"]
+
+    for name, data in plugins.items():
+        archive = user_plugin_dir / f"{name}.zip"
+
+        if archive.is_file():
+            installed = files_digest(archive_files(archive, name))
+            if installed == files_digest(data["files"]):
+                print(f"{archive} is up to date")
+                continue
+            delta = data.get("delta")
+            if delta and apply_patch(
+                archive, build_dir / delta["patch"], name, data
+            ):
+                continue
+
+        source = build_dir / data.get("archive", f"{name}.zip")
+        with TemporaryDirectory(
+            prefix=".", dir=str(user_plugin_dir)
+        ) as tmp_dir:
+            new_archive = Path(tmp_dir) / archive.name
+            copyfile(str(source), str(new_archive))
+            replace(str(new_archive), str(archive))
+        print(f"Installed {archive} from {source}")
+
+
+def watch(user_plugin_dirs: Sequence[Path], dev: bool) -> None:
+    """Reinstall plugins when their files change."""
+    for plugin_dirs in watch_plugin_dirs():
+        start = perf_counter()
+
+        install_plugins(
+            (
+                scan_plugin(plugin_dir)
+                for plugin_dir in plugin_dirs
+                if plugin_dir.is_dir()
+            ),
+            user_plugin_dirs,
+            dev,
+        )
+        for plugin_dir in plugin_dirs:
+            if not plugin_dir.is_dir():
+                for user_plugin_dir in user_plugin_dirs:
+                    rm_path(user_plugin_dir / f"{plugin_dir.name}.zip")
+
+        print(f"Reinstalled in {perf_counter() - start:.3f}s")
+
+
 def main() -> None:
     """Program entrypoint."""
     parser = ArgumentParser(
@@ -65,37 +374,71 @@ def main() -> None:
         "--dev",
         action="store_true",
         dest="dev",
-        help="create symlinks for single-file plugins instead of archives",
+        help="create symlinks to the plugins instead of archives",
+    )
+    parser.add_argument(
+        "--target",
+        action="append",
+        dest="targets",
+        metavar="DIR",
+        type=Path,
+        help=(
+            "plugin folder to install to, can be repeated "
+            "(default: the folder of the current user)"
+        ),
+    )
+    parser.add_argument(
+        "--targets-file",
+        metavar="FILE",
+        type=Path,
+        help="file listing plugin folders to install to, one per line",
+    )
+    parser.add_argument(
+        "--jobs",
+        default=COPY_JOBS,
+        type=int,
+        help="number of archives copied in parallel to other plugin folders",
+    )
+    parser.add_argument(
+        "--from-build",
+        metavar="BUILD_DIR",
+        type=Path,
+        help=(
+            "install the archives generated by generate.py in BUILD_DIR, "
+            "applying their patches when possible"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and reinstall the plugins when their files change",
     )
     args = parser.parse_args()
 
-    user_plugin_dir = get_picard_user_plugin_dir()
+    user_plugin_dirs: List[Path] = list(args.targets or [])
+    if args.targets_file:
+        user_plugin_dirs.extend(read_plugin_dirs(args.targets_file))
+    if not user_plugin_dirs:
+        user_plugin_dirs.append(get_picard_user_plugin_dir())
+
+    for user_plugin_dir in user_plugin_dirs:
+        if not user_plugin_dir.is_dir():
+            print(f"Plugin directory {user_plugin_dir} not found", file=stderr)
+            exit(1)
 
-    if not user_plugin_dir.is_dir():
-        print(f"Plugin directory {user_plugin_dir} not found", file=stderr)
+    if args.from_build:
+        for user_plugin_dir in user_plugin_dirs:
+            install_from_build(args.from_build, user_plugin_dir)
+        return
+
+    if not install_plugins(
+        get_plugin_tree(), user_plugin_dirs, args.dev, max(args.jobs, 1)
+    ):
         exit(1)
 
-    for plugin_dir in get_plugin_dirs():
-        python_files = list(plugin_dir.glob("**/*.py"))
-        if len(python_files) == 1:
-            if args.dev:
-                # Symlink the file
-                create_symlink(python_files[0], user_plugin_dir)
-            else:
-                # Create a ZIP file and copy
-                create_zip(plugin_dir, user_plugin_dir, single_file=True)
-        elif len(python_files) > 1:
-            if not any(
-                str(python_file.relative_to(plugin_dir)) == "__init__.py"
-                for python_file in python_files
-            ):
-                print(
-                    f'No "__init__.py" file found in {plugin_dir}',
-                    file=stderr,
-                )
-                exit(1)
-            # Create a ZIP file and copy
-            create_zip(plugin_dir, user_plugin_dir)
+    if args.watch:
+        with suppress(KeyboardInterrupt):
+            watch(user_plugin_dirs, args.dev)
 
 
 if __name__ == "__main__":
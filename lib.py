@@ -1,51 +1,622 @@
 """Picard plugin utilities."""
 
-from pathlib import Path
-from shutil import make_archive
-from typing import List
+from contextlib import suppress
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from functools import lru_cache
+from hashlib import md5, sha256
+from json import dumps
+from os import DirEntry, close, read, replace, scandir, strerror, walk
+from pathlib import Path, PurePosixPath
+from select import select
+from shutil import rmtree
+from struct import calcsize, unpack_from
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
+from typing import (
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
+
+from yaml import safe_load
 
 
 # The directory which contains plugin files
 PLUGIN_DIR = Path(__file__).parent / "plugins"
 
+# The directory which contains the tagging scripts
+SCRIPT_DIR = Path(__file__).parent / "scripts"
+
+# The file that contains json data
+PLUGIN_FILE = "plugins.json"
+
+# Number of hexadecimal digits of the hash in content-addressed archive names
+ARCHIVE_HASH_LENGTH = 16
+
+# Size of the chunks of the plugin files streamed to the archives, in bytes
+_CHUNK_SIZE = 64 * 1024
+
+
+class PluginFile(NamedTuple):
+    """A file from a plugin directory."""
+
+    path: Path
+    # POSIX path relative to the plugin directory
+    name: str
+    size: int
+
+
+class Plugin(NamedTuple):
+    """A plugin directory and the files it contains."""
+
+    path: Path
+    files: Tuple[PluginFile, ...]
+
+    @property
+    def name(self) -> str:
+        """Name of the plugin module."""
+        return self.path.name
+
+    @property
+    def python_files(self) -> Tuple[PluginFile, ...]:
+        """Python modules of the plugin."""
+        return tuple(file for file in self.files if file.name.endswith(".py"))
+
+    @property
+    def is_single_file(self) -> bool:
+        """Whether the plugin is a single Python module."""
+        return len(self.python_files) == 1
+
+    @property
+    def is_package(self) -> bool:
+        """Whether the plugin is a Python package."""
+        return len(self.python_files) > 1 and any(
+            file.name == "__init__.py" for file in self.python_files
+        )
+
+    @property
+    def size(self) -> int:
+        """Total size of the plugin files, in bytes."""
+        return sum(file.size for file in self.files)
+
+
+class Script(NamedTuple):
+    """A tagging script loaded from a `.ptsp` file."""
+
+    script_id: str
+    title: str
+    source: str
+    language_version: str = "1.0"
+
+    @classmethod
+    def load(cls, path: Path) -> "Script":
+        """Load a tagging script file.
+
+        Raises ValueError if a required field is missing.
+        """
+        with open(path, "r", encoding="utf-8") as script_file:
+            data = safe_load(script_file)
+        try:
+            return cls(
+                script_id=data["id"],
+                title=data["title"],
+                source=data["script"],
+                language_version=str(
+                    data.get("script_language_version", "1.0")
+                ),
+            )
+        except (KeyError, TypeError) as error:
+            raise ValueError(f"Invalid script file {path}: {error}") from error
+
+
+def get_script_paths() -> List[Path]:
+    """Get the list of tagging script files from this repository."""
+    return sorted(SCRIPT_DIR.glob("*.ptsp"))
+
+
+def _is_plugin_dir(entry: "DirEntry[str]") -> bool:
+    return (
+        entry.is_dir()
+        and not entry.name.startswith(".")
+        and not entry.name.startswith("__")
+    )
+
+
+def scan_plugin(plugin_dir: Path) -> Plugin:
+    """Walk a plugin directory once and return its files.
+
+    Compiled Python files are ignored.
+    """
+    files: List[PluginFile] = []
+    dirs = [plugin_dir]
+
+    while dirs:
+        current_dir = dirs.pop()
+        with scandir(str(current_dir)) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if entry.name != "__pycache__":
+                        dirs.append(Path(entry.path))
+                elif entry.is_file() and not entry.name.endswith(".pyc"):
+                    path = Path(entry.path)
+                    files.append(
+                        PluginFile(
+                            path=path,
+                            name=str(
+                                PurePosixPath(path.relative_to(plugin_dir))
+                            ),
+                            size=entry.stat().st_size,
+                        )
+                    )
+
+    return Plugin(
+        path=plugin_dir,
+        files=tuple(sorted(files, key=lambda file: file.name)),
+    )
+
+
+class PluginTree:
+    """The plugins of a directory, scanned once."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        with scandir(str(root)) as entries:
+            self.plugins = [
+                scan_plugin(Path(entry.path))
+                for entry in sorted(entries, key=lambda entry: entry.name)
+                if _is_plugin_dir(entry)
+            ]
+
+    def __iter__(self) -> Iterator[Plugin]:
+        """Iterate over the plugins, sorted by name."""
+        return iter(self.plugins)
+
+    def __len__(self) -> int:
+        """Return the number of plugins."""
+        return len(self.plugins)
+
+    def get(self, name: str) -> Optional[Plugin]:
+        """Return the plugin called `name`, if any."""
+        return next(
+            (plugin for plugin in self.plugins if plugin.name == name), None
+        )
+
+
+@lru_cache(maxsize=None)
+def _get_plugin_tree(root: Path) -> PluginTree:
+    return PluginTree(root)
+
+
+def get_plugin_tree(root: Optional[Path] = None) -> PluginTree:
+    """Return the plugins from this repository.
+
+    The plugin directory is only scanned the first time this is called, use
+    `scan_plugin` to get up-to-date data for a plugin.
+    """
+    return _get_plugin_tree(root or PLUGIN_DIR)
+
 
 def get_plugin_dirs() -> List[Path]:
     """Get the list of plugin directories from this repository."""
-    return [
-        path
-        for path in PLUGIN_DIR.iterdir()
-        if path.is_dir()
-        and not path.name.startswith(".")
-        and not path.name.startswith("__")
-    ]
+    return [plugin.path for plugin in get_plugin_tree()]
 
 
 def rm_path(path: Path) -> None:
-    """Delete a file or directory."""
+    """Delete a file or directory, with its contents."""
     if path.exists():
         print(f"Deleting existing {path}...")
-        if path.is_dir():
-            path.rmdir()
+        if path.is_dir() and not path.is_symlink():
+            rmtree(str(path))
         else:
             path.unlink()
 
 
+def archive_digest(archive: Path) -> str:
+    """Return a hash of the names and contents of the files in a ZIP archive.
+
+    Timestamps and compression settings are ignored, so two archives built
+    from the same files at different times have the same digest.
+    """
+    digest = sha256()
+
+    with ZipFile(archive) as zip_file:
+        for info in sorted(zip_file.infolist(), key=lambda i: i.filename):
+            digest.update(info.filename.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(zip_file.read(info))
+            digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
+def _make_zip(
+    plugin: Plugin,
+    tmp_dir: Path,
+    single_file: bool,
+    files: Optional[Dict[str, str]] = None,
+) -> Path:
+    """Create a ZIP archive of a plugin in a temporary folder.
+
+    The files found when the plugin was scanned are archived, the plugin
+    directory is not walked again. Each file is read once, its contents
+    going both to the archive and to its MD5, which is added to `files` by
+    file name if it is set.
+    """
+    script_dir = plugin.path
+    archive = tmp_dir / f"{plugin.name}.zip"
+    prefix = "" if single_file else f"{plugin.name}/"
+    dirs: Set[PurePosixPath] = set()
+
+    with ZipFile(archive, "w", ZIP_DEFLATED) as zip_file:
+        # Folders get their own entries, like with `shutil.make_archive`
+        if prefix:
+            zip_file.write(str(script_dir), prefix)
+        for plugin_file in plugin.files:
+            for parent in reversed(PurePosixPath(plugin_file.name).parents):
+                if parent.name and parent not in dirs:
+                    dirs.add(parent)
+                    zip_file.write(
+                        str(script_dir / parent), f"{prefix}{parent}"
+                    )
+
+            info = ZipInfo.from_file(
+                str(plugin_file.path), f"{prefix}{plugin_file.name}"
+            )
+            info.compress_type = ZIP_DEFLATED
+            file_hash = md5()  # noqa: S303
+            with open(plugin_file.path, "rb") as in_file, zip_file.open(
+                info, "w"
+            ) as out_file:
+                for chunk in iter(lambda: in_file.read(_CHUNK_SIZE), b""):
+                    file_hash.update(chunk)
+                    out_file.write(chunk)
+            if files is not None:
+                files[plugin_file.name] = file_hash.hexdigest()
+
+    return archive
+
+
 def create_zip(
-    script_dir: Path,
+    plugin: Plugin,
+    dest_dir: Path,
+    single_file: bool = False,
+    files: Optional[Dict[str, str]] = None,
+) -> bool:
+    """Create a ZIP archive in the destination folder.
+
+    The archive is built in a temporary folder next to the destination and
+    atomically renamed over the previous one, so a half-written archive is
+    never visible. If the existing archive already has the same contents, it
+    is left untouched. The MD5 of the files of the plugin are added to
+    `files`, if set, see `_make_zip`.
+
+    Returns whether the archive in the destination folder was written.
+    """
+    archive = dest_dir / f"{plugin.name}.zip"
+
+    # The temporary folder must be on the same filesystem as the destination
+    # for the rename to be atomic
+    with TemporaryDirectory(prefix=".", dir=str(dest_dir)) as tmp_dir:
+        new_archive = _make_zip(plugin, Path(tmp_dir), single_file, files)
+
+        if archive.is_file() and (
+            archive_digest(archive) == archive_digest(new_archive)
+        ):
+            print(f"{archive} is up to date")
+            return False
+
+        replace(str(new_archive), str(archive))
+
+    print(f"Created {archive} from {plugin.path}")
+    return True
+
+
+def create_hashed_zip(
+    plugin: Plugin,
     dest_dir: Path,
     single_file: bool = False,
+    files: Optional[Dict[str, str]] = None,
+) -> Path:
+    """Create a ZIP archive named after a hash of its contents.
+
+    The archive is called `<plugin>-<hash>.zip`, where the hash is the
+    `archive_digest` of its files, so it never changes once published. If an
+    archive with the same contents already exists, it is left untouched.
+    `files` is the same as for `create_zip`.
+
+    Returns the path of the archive.
+    """
+    with TemporaryDirectory(prefix=".", dir=str(dest_dir)) as tmp_dir:
+        new_archive = _make_zip(plugin, Path(tmp_dir), single_file, files)
+        digest = archive_digest(new_archive)[:ARCHIVE_HASH_LENGTH]
+        archive = dest_dir / f"{plugin.name}-{digest}.zip"
+
+        if archive.is_file():
+            print(f"{archive} is up to date")
+            return archive
+
+        replace(str(new_archive), str(archive))
+
+    print(f"Created {archive} from {plugin.path}")
+    return archive
+
+
+def is_compiled(name: str) -> bool:
+    """Return whether a file of a plugin is a compiled Python file."""
+    return name.endswith(".pyc") or "__pycache__/" in name
+
+
+def files_digest(files: Mapping[str, str]) -> str:
+    """Return a hash identifying a version of a plugin.
+
+    `files` maps the names of the files of the plugin to their MD5, like the
+    `files` of the JSON data of the plugins.
+    """
+    return sha256(
+        dumps(files, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
+def archive_prefix(zip_file: ZipFile, name: str) -> str:
+    """Return the folder of the files of the plugin `name` in its archive.
+
+    The files of packages are in a folder named after the plugin.
+    """
+    prefix = f"{name}/"
+    if all(info.filename.startswith(prefix) for info in zip_file.infolist()):
+        return prefix
+    return ""
+
+
+def archive_files(archive: Path, name: str) -> Dict[str, str]:
+    """Return the MD5 of each file of the plugin `name` in its archive.
+
+    Compiled Python files are ignored, like in `scan_plugin`.
+    """
+    files: Dict[str, str] = {}
+
+    with ZipFile(archive) as zip_file:
+        prefix = archive_prefix(zip_file, name)
+        for info in zip_file.infolist():
+            file_name = info.filename[len(prefix) :]  # noqa: E203
+            if info.is_dir() or is_compiled(file_name):
+                continue
+            files[file_name] = md5(  # noqa: S303
+                zip_file.read(info)
+            ).hexdigest()
+
+    return files
+
+
+def create_patch_zip(
+    plugin: Plugin,
+    archive: Path,
+    names: Iterable[str],
 ) -> None:
-    """Create a ZIP archive in the destination folder."""
-    archive = dest_dir / f"{script_dir.name}.zip"
+    """Create a ZIP archive with some of the files of a plugin.
+
+    The files are stored at the same place as in the archive of the whole
+    plugin, see `create_zip`.
+    """
+    prefix = "" if plugin.is_single_file else f"{plugin.name}/"
+
+    with TemporaryDirectory(prefix=".", dir=str(archive.parent)) as tmp_dir:
+        new_archive = Path(tmp_dir) / archive.name
+        with ZipFile(new_archive, "w", ZIP_DEFLATED) as zip_file:
+            for name in names:
+                zip_file.write(str(plugin.path / name), f"{prefix}{name}")
+        replace(str(new_archive), str(archive))
 
-    if archive.exists():
-        rm_path(archive)
+    print(f"Created {archive} from {plugin.path}")
+
+
+# inotify event flags, see inotify(7)
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_ISDIR = 0x40000000
+_IN_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+)
+_IN_EVENT_FORMAT = "iIII"
+_IN_EVENT_SIZE = calcsize(_IN_EVENT_FORMAT)
+
+
+def _is_ignored(path: Path) -> bool:
+    """Return whether changes to a file should not trigger a rebuild."""
+    return path.suffix == ".pyc" or any(
+        part.startswith(".") or part == "__pycache__" for part in path.parts
+    )
+
+
+def _plugin_dir_of(path: Path, plugin_names: Set[str]) -> Optional[Path]:
+    """Return the plugin directory which contains `path`, if any.
+
+    `plugin_names` are the names of the plugin directories seen so far, new
+    directories are added to it. A deleted path at the top level is only a
+    plugin directory if it was seen before, files at the top level are not
+    part of any plugin.
+    """
+    try:
+        relative = path.relative_to(PLUGIN_DIR)
+    except ValueError:
+        return None
+    if (
+        not relative.parts
+        or _is_ignored(relative)
+        or relative.parts[0].startswith("__")
+    ):
+        return None
+    if len(relative.parts) == 1:
+        if path.is_dir():
+            plugin_names.add(path.name)
+        elif path.name not in plugin_names:
+            return None
+    return PLUGIN_DIR / relative.parts[0]
+
+
+class _Inotify:
+    """Minimal recursive inotify watcher for a directory tree (Linux only)."""
+
+    def __init__(self, root: Path) -> None:
+        self._libc = CDLL(find_library("c") or "libc.so.6", use_errno=True)
+        self._fd: int = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(get_errno(), strerror(get_errno()))
+        self._watches: Dict[int, Path] = {}
+        self._add_tree(root)
+
+    def _add_tree(self, root: Path) -> None:
+        for dirpath, _dirnames, _filenames in walk(str(root)):
+            watch = self._libc.inotify_add_watch(
+                self._fd, dirpath.encode(), _IN_WATCH_MASK
+            )
+            if watch >= 0:
+                self._watches[watch] = Path(dirpath)
+
+    def read(self, timeout: Optional[float]) -> Set[Path]:
+        """Return the paths changed until `timeout` expires."""
+        readable, _, _ = select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed: Set[Path] = set()
+        buffer = read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(buffer):
+            watch, mask, _cookie, length = unpack_from(
+                _IN_EVENT_FORMAT, buffer, offset
+            )
+            offset += _IN_EVENT_SIZE
+            name = buffer[offset : offset + length].rstrip(b"\0")  # noqa: E203
+            offset += length
+
+            parent = self._watches.get(watch)
+            if parent is None:
+                continue
+            path = parent / name.decode() if name else parent
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._add_tree(path)
+            changed.add(path)
+
+        return changed
+
+    def close(self) -> None:
+        """Stop watching."""
+        close(self._fd)
+
+
+def _snapshot() -> Dict[Path, Tuple[int, int]]:
+    """Return the modification time and size of every plugin file."""
+    snapshot: Dict[Path, Tuple[int, int]] = {}
+    for path in PLUGIN_DIR.glob("**/*"):
+        if path.is_file() and not _is_ignored(path.relative_to(PLUGIN_DIR)):
+            stat = path.stat()
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def _inotify_changes(
+    inotify: _Inotify, debounce: float
+) -> Iterator[Set[Path]]:
+    """Yield the paths changed during each burst of inotify events."""
+    while True:
+        changed = inotify.read(None)
+        while True:
+            more = inotify.read(debounce)
+            if not more:
+                break
+            changed |= more
+        yield changed
+
+
+def _polling_changes(
+    debounce: float,
+    poll_interval: float,
+) -> Iterator[Set[Path]]:
+    """Yield the paths changed between two snapshots of the plugin files."""
+    previous = _snapshot()
+    while True:
+        sleep(poll_interval)
+        current = _snapshot()
+        if current == previous:
+            continue
+        # Wait for the burst of changes to settle
+        deadline = monotonic() + debounce
+        while monotonic() < deadline:
+            sleep(debounce)
+            settled = _snapshot()
+            if settled != current:
+                current = settled
+                deadline = monotonic() + debounce
+        yield {
+            path
+            for path in set(previous) | set(current)
+            if previous.get(path) != current.get(path)
+        }
+        previous = current
+
+
+def watch_plugin_dirs(
+    debounce: float = 0.1,
+    poll_interval: float = 0.5,
+    polling: bool = False,
+) -> Generator[Set[Path], None, None]:
+    """Yield the set of plugin directories changed since the last iteration.
+
+    Uses inotify when available, and falls back to polling the modification
+    time of the plugin files otherwise. Changes happening less than
+    `debounce` seconds apart are grouped together.
+    """
+    inotify: Optional[_Inotify] = None
+    if not polling:
+        # inotify is only available on Linux
+        with suppress(AttributeError, OSError):
+            inotify = _Inotify(PLUGIN_DIR)
+
+    print(
+        f"Watching {PLUGIN_DIR} "
+        f"({'inotify' if inotify else 'polling'}), press Ctrl+C to stop"
+    )
 
-    make_archive(
-        base_name=str(archive)[:-4],
-        format="zip",
-        root_dir=str(script_dir) if single_file else str(script_dir.parent),
-        base_dir=None if single_file else script_dir.name,
+    changes = (
+        _inotify_changes(inotify, debounce)
+        if inotify is not None
+        else _polling_changes(debounce, poll_interval)
     )
+    with scandir(str(PLUGIN_DIR)) as entries:
+        plugin_names = {entry.name for entry in entries if entry.is_dir()}
 
-    print(f"Created {archive} from {script_dir}")
+    try:
+        for changed in changes:
+            plugin_dirs = {
+                plugin_dir
+                for plugin_dir in (
+                    _plugin_dir_of(path, plugin_names) for path in changed
+                )
+                if plugin_dir is not None
+            }
+            if plugin_dirs:
+                yield plugin_dirs
+    finally:
+        if inotify is not None:
+            inotify.close()
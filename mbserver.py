@@ -0,0 +1,669 @@
+#!/usr/bin/env python3
+
+"""Load albums through MusicBrainz Picard's web service from a local server.
+
+`FakeMusicBrainz` is a local stand-in for the MusicBrainz web service,
+serving release JSON with a configurable latency, error rate and rate
+limit. Picard's `WebService` is pointed at it, and the albums are loaded by
+Picard's `Album`, so that the release and the requests of the plugins go
+through the real request queue, rate control and loading flow. Only the
+metadata processors of the plugins are run, not the ones of Picard, such as
+the cover art download.
+
+The end-to-end latency of the album loads is reported with a plugin
+enabled and disabled.
+"""
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+import builtins
+from functools import partial
+from gettext import NullTranslations
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from importlib import import_module
+from json import dumps as json_dumps
+from math import ceil
+from pathlib import Path
+from pkgutil import iter_modules
+from random import Random
+from re import compile as re_compile
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from time import monotonic, perf_counter, sleep
+from types import SimpleNamespace
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from unittest.mock import patch
+from uuid import NAMESPACE_URL, uuid5
+
+from PyQt5.QtCore import (
+    QCoreApplication,
+    QEventLoop,
+    QObject,
+    QTimer,
+    pyqtSignal,
+)
+from picard import config, log, metadata as picard_metadata
+from picard.album import Album
+from picard.config import Option
+from picard.plugin import PluginFunctions
+from picard.releasegroup import ReleaseGroup
+import picard.ui.options as option_pages
+from picard.webservice import WebService, ratecontrol
+from picard.webservice.api_helpers import MBAPIHelper
+
+from harness import Processors, Release, load_processors, make_release
+from replay import RELATED_DIR, RELEASES_DIR, CorpusReleases
+
+
+# Path of the release lookups of the MusicBrainz web service
+_RELEASE_PATH = re_compile(r"/ws/2/release/([0-9a-fA-F-]+)(?:\?.*)?")
+
+# Settings read by Picard's web service
+_PICARD_SETTINGS = {
+    "network_transfer_timeout_seconds": 30,
+    "use_proxy": False,
+    "use_adv_search_syntax": False,
+}
+
+# Latency percentiles reported
+PERCENTILES = (50, 90, 99)
+
+# Prefix of the modules of the plugins loaded by Picard
+_PLUGIN_MODULE_PREFIX = "picard.plugins."
+
+# Artist credited on the synthetic releases
+_ARTIST_CREDIT: List[Dict[str, Any]] = [
+    {
+        "name": "Various Artists",
+        "joinphrase": "",
+        "artist": {
+            "id": "89ad4ac3-39f7-470e-963a-56509c546377",
+            "name": "Various Artists",
+            "sort-name": "Various Artists",
+            "disambiguation": "",
+        },
+    }
+]
+
+
+class ServiceSettings(NamedTuple):
+    """Behavior of the local MusicBrainz web service."""
+
+    # Delay before each response, in seconds
+    latency: float = 0.0
+    # Maximum random delay added to the latency, in seconds
+    jitter: float = 0.0
+    # Probability of a response being an internal server error
+    error_rate: float = 0.0
+    # Requests accepted per second, the others get a 503 error like on
+    # musicbrainz.org, or None for no limit
+    rate_limit: Optional[float] = None
+    # Seed of the jitter and errors
+    seed: int = 0
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeMusicBrainz:
+    """Local HTTP server serving releases like the MusicBrainz web service.
+
+    Releases are served from a callable, like with `FakeMBAPIHelper`. Only
+    release lookups are supported, with the same response whatever the
+    includes. Each request is handled in its own thread, so the latency of
+    concurrent requests overlaps.
+    """
+
+    def __init__(
+        self,
+        get_release: Callable[[str], Optional[Release]],
+        settings: Optional[ServiceSettings] = None,
+    ) -> None:
+        self.get_release = get_release
+        self.settings = settings = settings or ServiceSettings()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._lock = Lock()
+        self._random = Random(settings.seed)
+        self._next_request = 0.0
+        self._server = _Server(("127.0.0.1", 0), self._handler_class())
+        self._thread: Optional[Thread] = None
+
+    @property
+    def host(self) -> str:
+        """Host name of the server."""
+        return str(self._server.server_address[0])
+
+    @property
+    def port(self) -> int:
+        """Port of the server."""
+        return int(self._server.server_address[1])
+
+    def start(self) -> None:
+        """Serve the requests in a background thread."""
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop serving the requests."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "FakeMusicBrainz":
+        """Start the server."""
+        self.start()
+        return self
+
+    def __exit__(self, *_args: Any) -> None:
+        """Stop the server."""
+        self.stop()
+
+    def _response(self, path: str) -> Tuple[int, Dict[str, Any], float]:
+        """Return the status, JSON and delay of the response to a request."""
+        settings = self.settings
+
+        with self._lock:
+            self.requests += 1
+            now = monotonic()
+            if settings.rate_limit:
+                if now < self._next_request:
+                    self.throttled += 1
+                    return 503, {"error": "Rate limit exceeded"}, 0.0
+                self._next_request = now + 1 / settings.rate_limit
+            delay = settings.latency + self._random.uniform(0, settings.jitter)
+            if self._random.random() < settings.error_rate:
+                self.errors += 1
+                return 500, {"error": "Internal server error"}, delay
+
+        match = _RELEASE_PATH.fullmatch(path)
+        release = self.get_release(match.group(1)) if match else None
+        if release is None:
+            return 404, {"error": "Not Found"}, delay
+        return 200, release, delay
+
+    def _handler_class(self) -> Callable[..., BaseHTTPRequestHandler]:
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:  # noqa: N802
+                status, document, delay = service._response(self.path)
+                if delay:
+                    sleep(delay)
+                body = json_dumps(document).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                # Every album load must reach the server
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_args: Any) -> None:
+                pass
+
+        return Handler
+
+
+# Qt application of the web service, if there was none
+_app: Optional[QCoreApplication] = None
+
+
+class _Settings(Dict[str, Any]):
+    """Picard settings, with the default value of the unset options."""
+
+    def __init__(self, section: str) -> None:
+        super().__init__()
+        self.section = section
+
+    def __missing__(self, name: str) -> Any:
+        option = Option.get(self.section, name)
+        if option is None:
+            raise KeyError(name)
+        return option.default
+
+
+class _Window:
+    """Methods of the main window called by `Album`."""
+
+    def set_statusbar_message(self, *_args: Any, **_kwargs: Any) -> None:
+        pass
+
+    def refresh_metadatabox(self) -> None:
+        pass
+
+
+class _AlbumItem:
+    """Item of an album in the main window, see `Album.item`."""
+
+    def isSelected(self) -> bool:  # noqa: N802
+        return False
+
+    def update(self, *_args: Any, **_kwargs: Any) -> None:
+        pass
+
+
+class _Tagger(QObject):
+    """Stand-in for `Tagger`, with what `Album` and the web service use."""
+
+    tagger_stats_changed = pyqtSignal()
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.window = _Window()
+        self.albums: Dict[str, Album] = {}
+        self.mbid_redirects: Dict[str, str] = {}
+        self.release_groups: Dict[str, ReleaseGroup] = {}
+        self.files: Dict[str, Any] = {}
+        self.webservice: Optional[WebService] = None
+        self.mb_api: Optional[MBAPIHelper] = None
+
+    def get_release_group_by_id(self, release_group_id: str) -> ReleaseGroup:
+        """Return the release group of an ID, created on first use."""
+        release_group = self.release_groups.get(release_group_id)
+        if release_group is None:
+            release_group = ReleaseGroup(release_group_id)
+            self.release_groups[release_group_id] = release_group
+        return release_group
+
+
+def _register_options() -> None:
+    """Register the options of Picard, declared by its option pages."""
+    for module in iter_modules(option_pages.__path__):
+        import_module(f"{option_pages.__name__}.{module.name}")
+
+
+def connect_picard(server: FakeMusicBrainz, delay: int = 0) -> _Tagger:
+    """Return a tagger sending its web service requests to `server`.
+
+    Sets up the Qt application if needed, and replaces the Picard settings
+    with their defaults. `delay` is the initial and minimum delay between
+    two requests, in milliseconds, which Picard sets to 1000 for
+    musicbrainz.org.
+    """
+    global _app
+
+    if QCoreApplication.instance() is None:
+        _app = QCoreApplication([])
+    if not hasattr(builtins, "_"):
+        # Installed by Picard at startup
+        NullTranslations().install()
+    _register_options()
+
+    tagger = _Tagger()
+    # The tagger of the Picard objects
+    setattr(QObject, "tagger", tagger)  # noqa: B010
+
+    config.config = SimpleNamespace(
+        setting=_Settings("setting"), persist=_Settings("persist")
+    )
+    settings = config.config.setting
+    for name, value in _PICARD_SETTINGS.items():
+        settings[name] = value
+    settings["server_host"] = server.host
+    settings["server_port"] = server.port
+
+    hostkey = (server.host, server.port)
+    ratecontrol.set_minimum_delay(hostkey, delay)
+    # There is no API to set the delay before the first reply
+    ratecontrol.REQUEST_DELAY[hostkey] = delay
+
+    tagger.webservice = WebService()
+    tagger.mb_api = MBAPIHelper(tagger.webservice)
+    return tagger
+
+
+class AlbumLoad(NamedTuple):
+    """An album loaded by Picard."""
+
+    album: Album
+    # Time from the start of the load until the album is loaded, or failed
+    # to load, in seconds
+    latency: float
+
+
+def _registries(
+    processors: Processors,
+) -> Tuple[PluginFunctions, PluginFunctions]:
+    """Return Picard registries of the album and track processors."""
+    album_processors = PluginFunctions()
+    track_processors = PluginFunctions()
+    for registry, plugin_processors in (
+        (album_processors, processors.album),
+        (track_processors, processors.track),
+    ):
+        for processor in plugin_processors:
+            registry.register(
+                f"{_PLUGIN_MODULE_PREFIX}{processor.plugin}",
+                processor.function,
+                processor.priority,
+            )
+    return album_processors, track_processors
+
+
+def load_albums(
+    tagger: _Tagger,
+    release_ids: Sequence[str],
+    processors: Processors,
+    timeout: float = 60.0,
+) -> List[AlbumLoad]:
+    """Load albums at the same time and wait for them to be loaded.
+
+    Picard runs `processors` instead of its own metadata processors.
+    Raises TimeoutError if the albums are not all loaded after `timeout`
+    seconds.
+    """
+    loop = QEventLoop()
+    pending = len(release_ids)
+    latencies: Dict[int, float] = {}
+
+    def loaded(index: int, start: float) -> None:
+        nonlocal pending
+        latencies[index] = perf_counter() - start
+        pending -= 1
+        if not pending:
+            loop.quit()
+
+    # Picard only runs the processors of the enabled plugins
+    config.config.setting["enabled_plugins"] = sorted(
+        {processor.plugin for processor in processors.album + processors.track}
+    )
+    album_processors, track_processors = _registries(processors)
+    albums = [Album(release_id) for release_id in release_ids]
+
+    with patch.object(
+        picard_metadata, "_album_metadata_processors", album_processors
+    ), patch.object(
+        picard_metadata, "_track_metadata_processors", track_processors
+    ):
+        for index, album in enumerate(albums):
+            album.item = _AlbumItem()
+            tagger.albums[album.id] = album
+            album.run_when_loaded(
+                partial(loaded, index, perf_counter()), always=True
+            )
+            album.load()
+
+        if pending:
+            timer = QTimer()
+            timer.setSingleShot(True)
+            timer.timeout.connect(loop.quit)
+            timer.start(int(timeout * 1000))
+            loop.exec_()
+            timer.stop()
+
+    if pending:
+        raise TimeoutError(f"{pending} albums still loading after {timeout}s")
+    return [
+        AlbumLoad(album, latencies[index])
+        for index, album in enumerate(albums)
+    ]
+
+
+def percentiles(
+    values: Sequence[float],
+    points: Sequence[int] = PERCENTILES,
+) -> Dict[int, float]:
+    """Return percentiles of `values`, using the nearest-rank method."""
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    return {
+        point: ordered[max(ceil(point / 100 * len(ordered)), 1) - 1]
+        for point in points
+    }
+
+
+class LatencyReport(NamedTuple):
+    """End-to-end latency of album loads."""
+
+    albums: int
+    errors: int
+    requests: int
+    # Latency percentiles, in seconds
+    percentiles: Dict[int, float]
+
+
+def without_plugin(processors: Processors, plugin: str) -> Processors:
+    """Return the processors of the plugins other than `plugin`."""
+    return Processors(
+        [
+            processor
+            for processor in processors.album
+            if processor.plugin != plugin
+        ],
+        [
+            processor
+            for processor in processors.track
+            if processor.plugin != plugin
+        ],
+    )
+
+
+def measure_latency(
+    get_release: Callable[[str], Optional[Release]],
+    release_ids: Sequence[str],
+    plugin: str,
+    settings: Optional[ServiceSettings] = None,
+    delay: int = 0,
+    repeat: int = 1,
+) -> Dict[str, LatencyReport]:
+    """Load albums from a local server with `plugin` enabled and disabled.
+
+    Each run uses a new server, so that the rate control of Picard starts
+    from the same state. Returns a report for `enabled` and `disabled`.
+    """
+    processors = load_processors()
+    reports: Dict[str, LatencyReport] = {}
+
+    for name, run_processors in (
+        ("enabled", processors),
+        ("disabled", without_plugin(processors, plugin)),
+    ):
+        latencies: List[float] = []
+        errors = 0
+        requests = 0
+        for _ in range(repeat):
+            with FakeMusicBrainz(get_release, settings) as server:
+                tagger = connect_picard(server, delay)
+                loads = load_albums(tagger, release_ids, run_processors)
+                requests += server.requests
+            latencies.extend(load.latency for load in loads)
+            errors += sum(1 for load in loads if load.album.errors)
+        reports[name] = LatencyReport(
+            len(latencies), errors, requests, percentiles(latencies)
+        )
+
+    return reports
+
+
+def complete_release(release: Release) -> Release:
+    """Add the artists and release group required by Picard to a release.
+
+    The web service returns them with the includes requested by Picard,
+    but the synthetic releases do not have them.
+    """
+    release.setdefault("artist-credit", _ARTIST_CREDIT)
+    release.setdefault(
+        "release-group",
+        {
+            "id": str(uuid5(NAMESPACE_URL, release["id"])),
+            "title": release["title"],
+            "primary-type": "Album",
+            "secondary-types": [],
+            "artist-credit": _ARTIST_CREDIT,
+        },
+    )
+    for medium in release["media"]:
+        for track in medium["tracks"]:
+            track.setdefault("artist-credit", _ARTIST_CREDIT)
+            track["recording"].setdefault("artist-credit", _ARTIST_CREDIT)
+    return release
+
+
+def make_releases(
+    count: int,
+    discs: int,
+    tracks_per_disc: int,
+    language: Optional[str],
+) -> Tuple[Dict[str, Release], List[str]]:
+    """Return synthetic releases and their related releases by ID.
+
+    Also returns the IDs of the releases to load.
+    """
+    releases: Dict[str, Release] = {}
+    release_ids: List[str] = []
+    for seed in range(count):
+        release, related = make_release(discs, tracks_per_disc, seed, language)
+        releases[release["id"]] = complete_release(release)
+        releases.update(
+            (release_id, complete_release(related_release))
+            for release_id, related_release in related.items()
+        )
+        release_ids.append(release["id"])
+    return releases, release_ids
+
+
+def main() -> None:
+    """Program entrypoint."""
+    parser = ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--plugin",
+        default="transliteration_sort",
+        help="plugin enabled and disabled",
+    )
+    parser.add_argument(
+        "--corpus",
+        type=Path,
+        help="load the releases of a replay.py corpus (default: synthetic)",
+    )
+    parser.add_argument(
+        "--albums",
+        default=50,
+        type=int,
+        help="number of synthetic releases loaded at the same time",
+    )
+    parser.add_argument(
+        "--discs",
+        default=1,
+        type=int,
+        help="number of discs of the synthetic releases",
+    )
+    parser.add_argument(
+        "--tracks",
+        default=12,
+        type=int,
+        help="number of tracks per disc of the synthetic releases",
+    )
+    parser.add_argument(
+        "--language",
+        default="jpn",
+        help="language of the synthetic releases, or random if empty",
+    )
+    parser.add_argument(
+        "--latency",
+        default=50.0,
+        type=float,
+        help="delay of the responses, in milliseconds",
+    )
+    parser.add_argument(
+        "--jitter",
+        default=20.0,
+        type=float,
+        help="maximum random delay added to the responses, in milliseconds",
+    )
+    parser.add_argument(
+        "--error-rate",
+        default=0.0,
+        type=float,
+        help="probability of a response being a server error",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="requests per second accepted by the server (default: no limit)",
+    )
+    parser.add_argument(
+        "--picard-delay",
+        default=0,
+        type=int,
+        help=(
+            "minimum delay between the requests of Picard, in milliseconds "
+            "(1000 for musicbrainz.org)"
+        ),
+    )
+    parser.add_argument(
+        "--repeat",
+        default=1,
+        type=int,
+        help="number of times the albums are loaded",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="ERROR",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="level of the messages logged by the plugins and Picard",
+    )
+    args = parser.parse_args()
+
+    log.set_level(args.log_level)
+
+    get_release: Callable[[str], Optional[Release]]
+    if args.corpus:
+        loaded = CorpusReleases(args.corpus / RELEASES_DIR)
+        related = CorpusReleases(args.corpus / RELATED_DIR)
+        release_ids = list(loaded)
+
+        def get_release(release_id: str) -> Optional[Release]:
+            return loaded.get(release_id) or related.get(release_id)
+
+    else:
+        releases, release_ids = make_releases(
+            args.albums, args.discs, args.tracks, args.language or None
+        )
+        get_release = releases.get
+
+    reports = measure_latency(
+        get_release,
+        release_ids,
+        args.plugin,
+        ServiceSettings(
+            latency=args.latency / 1000,
+            jitter=args.jitter / 1000,
+            error_rate=args.error_rate,
+            rate_limit=args.rate_limit,
+        ),
+        args.picard_delay,
+        args.repeat,
+    )
+
+    for name, report in reports.items():
+        latencies = " ".join(
+            f"p{point}={seconds * 1000:.1f}ms"
+            for point, seconds in report.percentiles.items()
+        )
+        print(
+            f"{args.plugin} {name:<8} {latencies} "
+            f"({report.albums} albums, {report.errors} errors, "
+            f"{report.requests} requests)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,869 @@
+"""Shared code for the plugins of this repository."""
+
+from atexit import register as register_exit_function
+from bisect import bisect_left
+from functools import wraps
+from json import dump as json_dump
+from logging import DEBUG
+from os import environ
+from sys import getsizeof, modules
+from time import perf_counter
+import tracemalloc
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Container,
+    Dict,
+    Generic,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+from weakref import WeakKeyDictionary, WeakSet
+
+from picard import log, metadata as picard_metadata
+from picard.metadata import Metadata
+from picard.plugin import PluginPriority
+from picard.script import ScriptParser, register_script_function
+
+
+if TYPE_CHECKING:
+    from picard.album import Album
+
+try:
+    from picard.config import get_config
+except ImportError:  # Picard < 2.6
+    from picard import config as _config
+
+    def get_config() -> Any:
+        """Return the configuration of Picard."""
+        return _config
+
+
+PLUGIN_NAME = "Plugin support library"
+PLUGIN_AUTHOR = "Alexis Jeandeau"
+PLUGIN_DESCRIPTION = """
+Code shared by the other plugins of this repository, which use it when
+it is enabled.
+
+Set the `PICARD_PLUGINS_TIMINGS` environment variable to `1` before
+starting Picard to record the number of calls and the latency of each
+metadata processor. A summary is logged when Picard exits, or written to a
+JSON file if the variable is set to a path.
+Use `$dumptimings()` in a script to log the summary on demand, or
+`$dumptimings(path)` to write it to a JSON file.
+
+Set the `PICARD_PLUGINS_PIPELINE` environment variable to `1` before
+starting Picard to run the metadata processors of all the plugins from a
+single album processor and a single track processor, which share the tags
+they parse for each track.
+
+Use `$pluginstats()` in a script to log and return the number of entries
+and the approximate memory used by the state kept by each plugin. If the
+`PICARD_PLUGINS_TRACEMALLOC` environment variable is set, memory
+allocations are traced from startup and `$pluginstats()` also reports the
+memory allocated by the code of each plugin.
+
+The state the plugins keep for each album is dropped when the album is
+removed from Picard.
+
+With debug logging, only the first 20 debug messages of each plugin for the
+tracks of an album are logged, then one in 100, followed by a summary line
+once all the tracks are processed. Set the `PICARD_PLUGINS_TRACK_LOG`
+environment variable to `<count>,<sample>` to change these numbers, e.g.
+`0,0` to only log the summaries or `1000000,1` to log every message.
+"""
+PLUGIN_VERSION = "1.0"
+PLUGIN_API_VERSIONS = [
+    "2.0",
+    "2.1",
+    "2.2",
+    "2.3",
+    "2.4",
+    "2.5",
+    "2.6",
+    "2.7",
+]
+PLUGIN_LICENSE = "GPL-2.0-or-later"
+PLUGIN_LICENSE_URL = "https://www.gnu.org/licenses/gpl-2.0.html"
+
+# Environment variable enabling the processor timings
+TIMINGS_VARIABLE = "PICARD_PLUGINS_TIMINGS"
+
+# Environment variable enabling memory allocation tracing
+TRACEMALLOC_VARIABLE = "PICARD_PLUGINS_TRACEMALLOC"
+
+# Environment variable enabling the processor pipeline
+PIPELINE_VARIABLE = "PICARD_PLUGINS_PIPELINE"
+
+# Environment variable setting the number of debug messages logged for the
+# tracks of each album, see `TrackLog`
+TRACK_LOG_VARIABLE = "PICARD_PLUGINS_TRACK_LOG"
+
+# Debug messages logged for the tracks of each album, then one in
+# `TRACK_LOG_SAMPLE`, by default
+TRACK_LOG_LIMIT = 20
+TRACK_LOG_SAMPLE = 100
+
+# Prefix of the modules of the plugins loaded by Picard
+_PLUGIN_MODULE_PREFIX = "picard.plugins."
+
+# Upper bounds of the latency histogram buckets, in seconds
+_BUCKETS: Tuple[float, ...] = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0)
+_BUCKET_LABELS: Tuple[str, ...] = (
+    "<10µs",
+    "<100µs",
+    "<1ms",
+    "<10ms",
+    "<100ms",
+    "<1s",
+    "≥1s",
+)
+
+Processor = Callable[..., None]
+
+T = TypeVar("T")
+
+
+class ProcessorTimings:
+    """Call count and latency histogram of a metadata processor."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram: List[int] = [0] * len(_BUCKET_LABELS)
+
+    def add(self, duration: float) -> None:
+        """Record a call."""
+        self.calls += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.histogram[bisect_left(_BUCKETS, duration)] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the timings as a JSON-serializable dictionary."""
+        return {
+            "calls": self.calls,
+            "total": self.total,
+            "max": self.max,
+            "histogram": dict(zip(_BUCKET_LABELS, self.histogram)),
+        }
+
+    def __str__(self) -> str:
+        """Describe the timings in one line."""
+        mean = self.total / self.calls if self.calls else 0.0
+        histogram = " ".join(
+            f"{label}:{count}"
+            for label, count in zip(_BUCKET_LABELS, self.histogram)
+            if count
+        )
+        return (
+            f"{self.calls} calls, total {self.total * 1000:.3f}ms, "
+            f"mean {mean * 1_000_000:.1f}µs, max {self.max * 1000:.3f}ms "
+            f"[{histogram}]"
+        )
+
+
+class Instrumentation:
+    """Timings of the metadata processors registered through this module.
+
+    When disabled, the only overhead of a processor call is checking the
+    `enabled` attribute.
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.timings: Dict[str, ProcessorTimings] = {}
+
+    def wrap(self, function: Processor) -> Processor:
+        """Return `function` recording its timings when enabled."""
+        name = (
+            f"{function.__module__.rsplit('.', 1)[-1]}."
+            f"{getattr(function, '__qualname__', function.__name__)}"
+        )
+
+        # Keep the module of the processor, Picard uses it to enable and
+        # disable the processors of each plugin
+        @wraps(function)
+        def timed(*args: Any) -> None:
+            if not self.enabled:
+                function(*args)
+                return
+
+            start = perf_counter()
+            try:
+                function(*args)
+            finally:
+                duration = perf_counter() - start
+                timings = self.timings.get(name)
+                if timings is None:
+                    timings = self.timings[name] = ProcessorTimings()
+                timings.add(duration)
+
+        return timed
+
+    def reset(self) -> None:
+        """Discard the recorded timings."""
+        self.timings.clear()
+
+    def log_summary(self) -> None:
+        """Log the timings of each processor."""
+        if not self.timings:
+            log.info("No metadata processor timings recorded")
+            return
+        for name, timings in sorted(self.timings.items()):
+            log.info("Processor %s: %s", name, timings)
+
+    def dump(self, path: str) -> None:
+        """Write the timings of each processor to a JSON file."""
+        with open(path, "w", encoding="utf-8") as out_file:
+            json_dump(
+                {
+                    name: timings.to_dict()
+                    for name, timings in self.timings.items()
+                },
+                out_file,
+                ensure_ascii=False,
+                sort_keys=True,
+                indent=2,
+            )
+        log.info("Wrote metadata processor timings to %s", path)
+
+
+instrumentation = Instrumentation(enabled=bool(environ.get(TIMINGS_VARIABLE)))
+
+
+class TrackContext:
+    """Tags of a track shared by the track processors of the plugins.
+
+    Each tag is read and parsed once. Processors using the context must
+    change tags with `set` so the other processors see the new values.
+    """
+
+    __slots__ = ("metadata", "_values", "_integers")
+
+    def __init__(self, metadata: Metadata) -> None:
+        self.metadata = metadata
+        self._values: Dict[str, str] = {}
+        self._integers: Dict[str, int] = {}
+
+    def get(self, name: str) -> str:
+        """Return the value of a tag, or an empty string."""
+        value = self._values.get(name)
+        if value is None:
+            value = self._values[name] = self.metadata[name]
+        return value
+
+    def integer(self, name: str) -> int:
+        """Return the value of a numeric tag.
+
+        Raises ValueError if the tag is not a number.
+        """
+        value = self._integers.get(name)
+        if value is None:
+            value = self._integers[name] = int(self.get(name))
+        return value
+
+    def set(self, name: str, value: Any) -> None:  # noqa: A003
+        """Change the value of a tag."""
+        self.metadata[name] = value
+        self._values.pop(name, None)
+        self._integers.pop(name, None)
+
+    def unset(self, name: str) -> None:
+        """Remove a tag."""
+        self.metadata.unset(name)
+        self._values.pop(name, None)
+        self._integers.pop(name, None)
+
+    def reset(self, metadata: Metadata) -> None:
+        """Use the context for the tags of another track."""
+        self.metadata = metadata
+        self._values.clear()
+        self._integers.clear()
+
+
+class ReleaseIndex:
+    """Lookups into a release of the MusicBrainz API, shared by the plugins.
+
+    Each lookup is built from the release on first use. Raises KeyError
+    if the release lacks the fields needed by a lookup.
+    """
+
+    __slots__ = (
+        "release",
+        "_media",
+        "_tracks",
+        "_recordings",
+        "_video_tracks",
+        "_relations",
+    )
+
+    def __init__(self, release: Dict[str, Any]) -> None:
+        self.release = release
+        self._media: Optional[Dict[int, Dict[str, Any]]] = None
+        self._tracks: Optional[Dict[Tuple[int, int], Dict[str, Any]]] = None
+        self._recordings: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._video_tracks: Optional[Dict[int, Set[int]]] = None
+        self._relations: Optional[
+            Dict[Tuple[str, str, str], List[Dict[str, Any]]]
+        ] = None
+
+    @property
+    def media(self) -> Dict[int, Dict[str, Any]]:
+        """Media of the release by position, in the order of the release."""
+        if self._media is None:
+            self._media = {
+                medium["position"]: medium for medium in self.release["media"]
+            }
+        return self._media
+
+    @property
+    def tracks(self) -> Dict[Tuple[int, int], Dict[str, Any]]:
+        """Tracks by medium and track position."""
+        if self._tracks is None:
+            self._tracks = {
+                (medium_pos, track["position"]): track
+                for medium_pos, medium in self.media.items()
+                for track in medium["tracks"]
+            }
+        return self._tracks
+
+    @property
+    def recordings(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Tracks by recording MBID."""
+        if self._recordings is None:
+            recordings: Dict[str, List[Dict[str, Any]]] = {}
+            for track in self.tracks.values():
+                recordings.setdefault(track["recording"]["id"], []).append(
+                    track
+                )
+            self._recordings = recordings
+        return self._recordings
+
+    @property
+    def video_tracks(self) -> Dict[int, Set[int]]:
+        """Positions of the video tracks by medium position.
+
+        Only media with video tracks are included.
+        """
+        if self._video_tracks is None:
+            video_tracks: Dict[int, Set[int]] = {}
+            for (medium_pos, track_pos), track in self.tracks.items():
+                if track["recording"]["video"]:
+                    video_tracks.setdefault(medium_pos, set()).add(track_pos)
+            self._video_tracks = video_tracks
+        return self._video_tracks
+
+    def relations(
+        self,
+        relation_type: str,
+        target_type: str = "release",
+        direction: str = "forward",
+    ) -> List[Dict[str, Any]]:
+        """Return the relationships of the release of a type."""
+        if self._relations is None:
+            relations: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = {}
+            for relation in self.release["relations"]:
+                key = (
+                    relation["type"],
+                    relation["target-type"],
+                    relation["direction"],
+                )
+                relations.setdefault(key, []).append(relation)
+            self._relations = relations
+        return self._relations.get((relation_type, target_type, direction), [])
+
+
+# Index of the release processed last, see `release_index`
+_release_index: Optional[ReleaseIndex] = None
+
+
+def release_index(release: Dict[str, Any]) -> ReleaseIndex:
+    """Return the index of a release, shared by the album processors.
+
+    Picard runs the album processors one after the other for a release, so
+    only the index of the last release is kept.
+    """
+    global _release_index
+    if _release_index is None or _release_index.release is not release:
+        _release_index = ReleaseIndex(release)
+    return _release_index
+
+
+class AlbumState(Generic[T]):
+    """State kept by a plugin for each loaded album.
+
+    Values are keyed by `Album` object, not by release ID. A value is
+    dropped when its album is removed from Picard, or when the `Album`
+    object is deleted, so the state does not grow with every album loaded
+    during a session.
+    """
+
+    def __init__(self) -> None:
+        self._values: "WeakKeyDictionary[Album, T]" = WeakKeyDictionary()
+        _album_states.add(self)
+
+    def get(self, album: "Album") -> Optional[T]:
+        """Return the value of an album, or None."""
+        return self._values.get(album)
+
+    def pop(self, album: "Album") -> Optional[T]:
+        """Remove and return the value of an album, or None."""
+        return self._values.pop(album, None)
+
+    def __getitem__(self, album: "Album") -> T:
+        """Return the value of an album."""
+        return self._values[album]
+
+    def __setitem__(self, album: "Album", value: T) -> None:
+        """Set the value of an album."""
+        _register_album_removal()
+        self._values[album] = value
+
+    def __contains__(self, album: object) -> bool:
+        """Return whether an album has a value."""
+        return album in self._values
+
+    def __len__(self) -> int:
+        """Return the number of albums with a value."""
+        return len(self._values)
+
+
+_album_states: "WeakSet[AlbumState[Any]]" = WeakSet()
+_album_removal_registered = False
+
+
+def remove_album_states(album: "Album") -> None:
+    """Drop the values of an album from every `AlbumState`."""
+    for state in list(_album_states):
+        state.pop(album)
+
+
+def _register_album_removal() -> None:
+    """Register `remove_album_states` when the first state is set.
+
+    `picard.album` is only imported then, it is slow to import outside of
+    Picard.
+    """
+    global _album_removal_registered
+    if _album_removal_registered:
+        return
+    _album_removal_registered = True
+
+    try:
+        from picard.album import register_album_post_removal_processor
+    except ImportError:  # Picard < 2.6, states are dropped with the albums
+        return
+    register_album_post_removal_processor(remove_album_states)
+
+
+class PipelineStep(NamedTuple):
+    """A metadata processor run by the pipeline."""
+
+    # Name of the plugin, None if the function is not from a plugin
+    plugin: Optional[str]
+    priority: int
+    function: Processor
+    # The function with timing instrumentation
+    timed: Processor
+
+
+def _plugin_name(module: str) -> Optional[str]:
+    if module.startswith(_PLUGIN_MODULE_PREFIX):
+        # picard.plugins.<name>[.<submodule>]
+        return module.split(".")[2]
+    return None
+
+
+class Pipeline:
+    """Metadata processors run from a single album and track processor.
+
+    Processors run by decreasing priority, and in the order they were
+    registered for the same priority, like Picard runs them. The track
+    processors are passed a `TrackContext` as fifth argument.
+
+    Only the processors of `enabled_plugins` are run, or of the plugins
+    enabled in Picard if it is None. The enabled track processors are
+    resolved once per album, by `run_album`, and only record their timings
+    if the instrumentation was enabled then.
+    """
+
+    def __init__(
+        self, enabled_plugins: Optional[Container[str]] = None
+    ) -> None:
+        self.enabled_plugins = enabled_plugins
+        self.album_processors: List[PipelineStep] = []
+        self.track_processors: List[PipelineStep] = []
+        # Track processors of the enabled plugins, for each album
+        self.album_track_processors: AlbumState[List[Processor]] = AlbumState()
+        # Reused for each track, the processors must not keep it
+        self._context = TrackContext(Metadata())
+
+    @staticmethod
+    def _add(
+        steps: List[PipelineStep], function: Processor, priority: int
+    ) -> None:
+        steps.append(
+            PipelineStep(
+                _plugin_name(function.__module__),
+                priority,
+                function,
+                instrumentation.wrap(function),
+            )
+        )
+        # The sort is stable, so the registration order is kept
+        steps.sort(key=lambda step: -step.priority)
+
+    def add_album_processor(self, function: Processor, priority: int) -> None:
+        """Add an album metadata processor to the pipeline."""
+        self._add(self.album_processors, function, priority)
+
+    def add_track_processor(self, function: Processor, priority: int) -> None:
+        """Add a track metadata processor to the pipeline."""
+        self._add(self.track_processors, function, priority)
+
+    def _enabled_plugins(self) -> Container[str]:
+        if self.enabled_plugins is not None:
+            return self.enabled_plugins
+        config = get_config()
+        enabled_plugins: Container[str] = (
+            config.setting["enabled_plugins"] if config else ()
+        )
+        return enabled_plugins
+
+    def _enabled(self, steps: List[PipelineStep]) -> List[Processor]:
+        enabled_plugins = self._enabled_plugins()
+        timed = instrumentation.enabled
+        return [
+            step.timed if timed else step.function
+            for step in steps
+            if step.plugin is None or step.plugin in enabled_plugins
+        ]
+
+    def run_album(
+        self,
+        album: "Album",
+        metadata: Metadata,
+        release: Dict[str, Any],
+    ) -> None:
+        """Run the album metadata processors of the enabled plugins."""
+        for function in self._enabled(self.album_processors):
+            function(album, metadata, release)
+        self.album_track_processors[album] = self._enabled(
+            self.track_processors
+        )
+
+    def run_track(
+        self,
+        album: "Album",
+        metadata: Metadata,
+        track: Dict[str, Any],
+        release: Dict[str, Any],
+    ) -> None:
+        """Run the track metadata processors of the enabled plugins."""
+        functions = self.album_track_processors.get(album)
+        if functions is None:
+            functions = self._enabled(self.track_processors)
+            self.album_track_processors[album] = functions
+
+        context = self._context
+        context.reset(metadata)
+        for function in functions:
+            function(album, metadata, track, release, context)
+
+
+pipeline: Optional[Pipeline] = None
+
+if environ.get(PIPELINE_VARIABLE):
+    pipeline = Pipeline()
+    # Picard runs the pipeline as the processors of this plugin
+    picard_metadata.register_album_metadata_processor(pipeline.run_album)
+    picard_metadata.register_track_metadata_processor(pipeline.run_track)
+
+
+def register_album_metadata_processor(
+    function: Processor,
+    priority: int = PluginPriority.NORMAL,
+) -> None:
+    """Register an album metadata processor with timing instrumentation."""
+    if pipeline is not None:
+        pipeline.add_album_processor(function, priority)
+        return
+    picard_metadata.register_album_metadata_processor(
+        instrumentation.wrap(function), priority
+    )
+
+
+def register_track_metadata_processor(
+    function: Processor,
+    priority: int = PluginPriority.NORMAL,
+) -> None:
+    """Register a track metadata processor with timing instrumentation.
+
+    When the pipeline is enabled, `function` is passed a `TrackContext` as
+    fifth argument.
+    """
+    if pipeline is not None:
+        pipeline.add_track_processor(function, priority)
+        return
+    picard_metadata.register_track_metadata_processor(
+        instrumentation.wrap(function), priority
+    )
+
+
+def dump_timings(_parser: ScriptParser, path: str = "") -> str:
+    """Log the processor timings, or write them to `path` if specified."""
+    if path:
+        instrumentation.dump(path)
+    else:
+        instrumentation.log_summary()
+    return ""
+
+
+def deep_getsizeof(obj: Any) -> int:
+    """Return the approximate memory used by an object and its contents.
+
+    Follows the items of containers and the attributes of objects, counting
+    each object once.
+    """
+    size = 0
+    seen: Set[int] = set()
+    objects = [obj]
+
+    while objects:
+        current = objects.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size += getsizeof(current)
+
+        if isinstance(current, dict):
+            objects.extend(current.keys())
+            objects.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            objects.extend(current)
+        elif hasattr(current, "__dict__") and not callable(current):
+            objects.append(vars(current))
+
+    return size
+
+
+class StateStats(NamedTuple):
+    """Size of a container kept by a plugin."""
+
+    entries: int
+    size: int
+
+    def __str__(self) -> str:
+        """Describe the size of the container."""
+        return f"{self.entries} entries ({self.size / 1024:.1f} KiB)"
+
+
+class StateRegistry:
+    """Containers of the plugins which may grow while Picard is running."""
+
+    def __init__(self) -> None:
+        self.states: Dict[str, Tuple[object, Tuple[str, ...]]] = {}
+
+    def register(self, module: str, obj: object, *attributes: str) -> None:
+        """Register attributes of `obj` as state of the plugin `module`."""
+        self.states[module] = (obj, attributes)
+
+    def stats(self) -> Dict[str, Dict[str, StateStats]]:
+        """Return the size of each registered container, by plugin."""
+        return {
+            module.rsplit(".", 1)[-1]: {
+                attribute: StateStats(
+                    len(getattr(obj, attribute)),
+                    deep_getsizeof(getattr(obj, attribute)),
+                )
+                for attribute in attributes
+            }
+            for module, (obj, attributes) in self.states.items()
+        }
+
+    def allocations(self) -> Dict[str, int]:
+        """Return the memory allocated by the code of each plugin.
+
+        Only available if tracemalloc is tracing memory allocations.
+        """
+        if not tracemalloc.is_tracing():
+            return {}
+
+        snapshot = tracemalloc.take_snapshot()
+        allocations: Dict[str, int] = {}
+
+        for module in self.states:
+            filename = getattr(modules.get(module), "__file__", None)
+            if not filename:
+                continue
+            traces = snapshot.filter_traces(
+                [tracemalloc.Filter(True, filename)]
+            )
+            allocations[module.rsplit(".", 1)[-1]] = sum(
+                stat.size for stat in traces.statistics("filename")
+            )
+
+        return allocations
+
+    def summary(self) -> List[str]:
+        """Describe the size of the state of each plugin."""
+        lines = [
+            f"{plugin}.{attribute}: {stats}"
+            for plugin, plugin_stats in sorted(self.stats().items())
+            for attribute, stats in plugin_stats.items()
+        ]
+        lines.extend(
+            f"{plugin}: {size / 1024:.1f} KiB allocated"
+            for plugin, size in sorted(self.allocations().items())
+        )
+        return lines
+
+
+state_registry = StateRegistry()
+
+
+def register_state(module: str, obj: object, *attributes: str) -> None:
+    """Report the size of attributes of `obj` in `$pluginstats()`.
+
+    `module` is the name of the plugin module, `__name__`.
+    """
+    state_registry.register(module, obj, *attributes)
+
+
+def _track_log_settings() -> Tuple[int, int]:
+    """Return the debug messages logged per album, and the sampling rate."""
+    try:
+        limit, sample = environ[TRACK_LOG_VARIABLE].split(",")
+        return int(limit), int(sample)
+    except (KeyError, ValueError):
+        return TRACK_LOG_LIMIT, TRACK_LOG_SAMPLE
+
+
+class _AlbumLog:
+    """Debug messages of a plugin for the tracks of an album."""
+
+    __slots__ = ("tracks", "processed", "messages", "logged")
+
+    def __init__(self) -> None:
+        # Total number of tracks, known once a track is processed
+        self.tracks = 0
+        self.processed = 0
+        self.messages = 0
+        self.logged = 0
+
+
+class TrackLog:
+    """Limit the debug messages logged by a plugin for the tracks of albums.
+
+    Debug messages logged for each track must be guarded by `enabled`::
+
+        if track_log.enabled(album):
+            log.debug("Setting %s to %s", name, value)
+
+    When debug logging is disabled, `enabled` only checks the log level, so
+    the messages are not formatted. Otherwise the first `limit` messages of
+    each album are logged, then one in `sample`, or none if it is 0. The
+    track processors wrapped with `processor` log how many messages were not
+    logged once all the tracks of the album are processed.
+    """
+
+    def __init__(
+        self,
+        module: str,
+        limit: Optional[int] = None,
+        sample: Optional[int] = None,
+    ) -> None:
+        default_limit, default_sample = _track_log_settings()
+        self.plugin = module.rsplit(".", 1)[-1]
+        self.limit = default_limit if limit is None else limit
+        self.sample = default_sample if sample is None else sample
+        self.albums: AlbumState[_AlbumLog] = AlbumState()
+
+    def enabled(self, album: "Album") -> bool:
+        """Return whether to log a debug message for a track of `album`."""
+        if not log.main_logger.isEnabledFor(DEBUG):
+            return False
+
+        album_log = self.albums.get(album)
+        if album_log is None:
+            album_log = self.albums[album] = _AlbumLog()
+
+        album_log.messages += 1
+        skipped = album_log.messages - self.limit
+        if skipped > 0 and not (self.sample and skipped % self.sample == 0):
+            return False
+        album_log.logged += 1
+        return True
+
+    def processor(self, function: Processor) -> Processor:
+        """Return a track processor logging a summary for each album."""
+
+        @wraps(function)
+        def processor(*args: Any) -> None:
+            function(*args)
+            if log.main_logger.isEnabledFor(DEBUG):
+                # Arguments of the track processors
+                self._track_done(args[0], args[3])
+
+        return processor
+
+    def _track_done(self, album: "Album", release: Dict[str, Any]) -> None:
+        album_log = self.albums.get(album)
+        if album_log is None:
+            album_log = self.albums[album] = _AlbumLog()
+        if not album_log.tracks:
+            album_log.tracks = sum(
+                len(medium.get("tracks", []))
+                + len(medium.get("data-tracks", []))
+                + (1 if medium.get("pregap") else 0)
+                for medium in release.get("media", [])
+            )
+
+        album_log.processed += 1
+        if album_log.processed < album_log.tracks:
+            return
+
+        self.albums.pop(album)
+        if album_log.messages:
+            log.debug(
+                "%s: %d of %d debug messages logged for the %d tracks of %s",
+                self.plugin,
+                album_log.logged,
+                album_log.messages,
+                album_log.tracks,
+                release.get("title", album),
+            )
+
+
+def plugin_stats(_parser: ScriptParser) -> str:
+    """Log and return the size of the state of each plugin."""
+    lines = state_registry.summary()
+    for line in lines:
+        log.info("Plugin state: %s", line)
+    return "; ".join(lines)
+
+
+def _dump_timings_on_exit() -> None:
+    target = environ.get(TIMINGS_VARIABLE, "")
+    if target.endswith(".json"):
+        instrumentation.dump(target)
+    else:
+        instrumentation.log_summary()
+
+
+if instrumentation.enabled:
+    register_exit_function(_dump_timings_on_exit)
+
+if environ.get(TRACEMALLOC_VARIABLE) and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+register_script_function(dump_timings, name="dumptimings")
+register_script_function(plugin_stats, name="pluginstats")
@@ -1,19 +1,72 @@
 """Album / track / show swap sort."""
 
-from re import match as re_match
-from typing import Any, Dict, Iterable, Tuple
+from functools import lru_cache
+from re import compile as re_compile
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Pattern,
+    Tuple,
+)
 
 from picard import log
-from picard.album import Album
-from picard.metadata import (
-    Metadata,
-    register_album_metadata_processor,
-    register_track_metadata_processor,
-)
+from picard.metadata import Metadata
 from picard.plugin import PluginPriority
 from picard.script import ScriptParser, register_script_function
 
 
+if TYPE_CHECKING:
+    from picard.album import Album
+
+try:
+    from picard.plugins._support import (
+        TrackContext,
+        TrackLog,
+        register_album_metadata_processor,
+        register_track_metadata_processor,
+    )
+except ImportError:  # The plugin support library is not enabled
+    from picard.metadata import (
+        register_album_metadata_processor,
+        register_track_metadata_processor,
+    )
+
+    class TrackContext:  # type: ignore[no-redef]
+        """Tags of a track."""
+
+        def __init__(self, metadata: Metadata) -> None:
+            self.metadata = metadata
+
+        def get(self, name: str) -> str:
+            """Return the value of a tag, or an empty string."""
+            value: str = self.metadata[name]
+            return value
+
+        def set(self, name: str, value: Any) -> None:  # noqa: A003
+            """Change the value of a tag."""
+            self.metadata[name] = value
+
+    class TrackLog:  # type: ignore[no-redef]
+        """Log all the debug messages."""
+
+        def __init__(self, _module: str) -> None:
+            pass
+
+        def enabled(self, _album: "Album") -> bool:
+            """Return whether to log a debug message."""
+            return True
+
+        def processor(
+            self, function: Callable[..., None]
+        ) -> Callable[..., None]:
+            """Return the track processor unchanged."""
+            return function
+
+
 PLUGIN_NAME = "Album / track / show swap sort"
 PLUGIN_AUTHOR = "Alexis Jeandeau"
 PLUGIN_DESCRIPTION = """
@@ -21,6 +74,8 @@ Set `albumsort`, `titlesort` and `showsort` by swapping the prefix of the
 corresponding tags (e.g. “A”, “The”, etc.).
 
 Supports common prefixes for English, French, Spanish, Italian and German.
+
+Uses the “Plugin support library” plugin if it is enabled.
 """
 PLUGIN_VERSION = "1.0"
 PLUGIN_API_VERSIONS = [
@@ -31,6 +86,7 @@ PLUGIN_LICENSE = "GPL-2.0-or-later"
 PLUGIN_LICENSE_URL = "https://www.gnu.org/licenses/gpl-2.0.html"
 
 _SET_IF_SAME = False
+
 _DEFAULT_PREFIXES: Dict[str, Tuple[str, ...]] = {
     # English
     "eng": (
@@ -76,6 +132,18 @@ _DEFAULT_PREFIXES: Dict[str, Tuple[str, ...]] = {
     ),
 }
 
+track_log = TrackLog(__name__)
+
+
+@lru_cache(maxsize=64)
+def _prefix_regex(prefixes: Tuple[str, ...]) -> Pattern[str]:
+    """Return a regex matching any of the prefixes, compiled once."""
+    return re_compile(
+        "("
+        + ")|(".join(map(lambda prefix: prefix.replace(" ", r"\s+"), prefixes))
+        + ")"
+    )
+
 
 def delete_prefix(
     _parser: ScriptParser,
@@ -93,12 +161,7 @@ def delete_prefix(
             + _DEFAULT_PREFIXES["spa"]
         )
     text = text.strip()
-    regex = (
-        "("
-        + ")|(".join(map(lambda prefix: prefix.replace(" ", r"\s+"), prefixes))
-        + ")"
-    )
-    match = re_match(regex, text)
+    match = _prefix_regex(prefixes).match(text)
     if not match:
         return text, ""
 
@@ -121,9 +184,11 @@ def swap_prefix(parser: ScriptParser, text: str, *prefixes: str) -> str:
     return text
 
 
-def swap_sort_tags(metadata: Metadata, tags: Iterable[str]) -> None:
+def swap_sort_tags(
+    album: "Album", context: TrackContext, tags: Iterable[str]
+) -> None:
     """Swap the prefix of `tags` to set the corresponding sort fields."""
-    language = metadata["~releaselanguage"]
+    language = context.get("~releaselanguage")
 
     if language != "eng" and language in _DEFAULT_PREFIXES:
         prefixes = _DEFAULT_PREFIXES[language] + _DEFAULT_PREFIXES["eng"]
@@ -132,39 +197,41 @@ def swap_sort_tags(metadata: Metadata, tags: Iterable[str]) -> None:
         prefixes = ()
 
     for tag in tags:
-        if tag not in metadata:
+        value: str = context.get(tag)
+        if not value:
             continue
 
-        value: str = metadata[tag]
         swapped = swap_prefix(None, value, *prefixes)
 
         if swapped != value or _SET_IF_SAME:
             sort_tag = f"{tag}sort"
-            log.debug("Setting %s to %s", sort_tag, swapped)
-            metadata[sort_tag] = swapped
+            if track_log.enabled(album):
+                log.debug("Setting %s to %s", sort_tag, swapped)
+            context.set(sort_tag, swapped)
 
 
 def swap_sort_album(
-    _tagger: Album,
+    album: "Album",
     metadata: Metadata,
     _release: Dict[str, Any],
 ) -> None:
     """Swap the prefix of the `album` fields to set the `albumsort` field."""
-    swap_sort_tags(metadata, ["album"])
+    swap_sort_tags(album, TrackContext(metadata), ["album"])
 
 
 def swap_sort_track(
-    _tagger: Album,
+    album: "Album",
     metadata: Metadata,
     _track: Dict[str, Any],
     _release: Dict[str, Any],
+    context: Optional[TrackContext] = None,
 ) -> None:
     """Set `titlesort` and `showsort`.
 
     Swap the prefix of the `title` and `show` fields to set the corresponding
     sort fields.
     """
-    swap_sort_tags(metadata, ["title", "show"])
+    swap_sort_tags(album, context or TrackContext(metadata), ["title", "show"])
 
 
 register_script_function(
@@ -173,4 +240,6 @@ register_script_function(
     check_argcount=False,
 )
 register_album_metadata_processor(swap_sort_album, PluginPriority.HIGH)
-register_track_metadata_processor(swap_sort_track, PluginPriority.HIGH)
+register_track_metadata_processor(
+    track_log.processor(swap_sort_track), PluginPriority.HIGH
+)
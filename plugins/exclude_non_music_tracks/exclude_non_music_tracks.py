@@ -1,21 +1,122 @@
 """Exclude non-music tracks from disc and track count."""
 
-from collections import defaultdict
-from typing import Any, DefaultDict, Dict, Set
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    NamedTuple,
+    Optional,
+    Set,
+    TypeVar,
+)
+from weakref import WeakKeyDictionary
 
 from picard import log
-from picard.album import Album
-from picard.metadata import (
-    Metadata,
-    register_album_metadata_processor,
-    register_track_metadata_processor,
-)
+from picard.metadata import Metadata
+
+
+if TYPE_CHECKING:
+    from picard.album import Album
+
+try:
+    from picard.plugins._support import (
+        AlbumState,
+        TrackContext,
+        TrackLog,
+        register_album_metadata_processor,
+        register_state,
+        register_track_metadata_processor,
+        release_index,
+    )
+except ImportError:  # The plugin support library is not enabled
+    from picard.metadata import (
+        register_album_metadata_processor,
+        register_track_metadata_processor,
+    )
+
+    T = TypeVar("T")
+
+    class AlbumState(Generic[T]):  # type: ignore[no-redef]
+        """State of the plugin for each album, dropped with the album."""
+
+        def __init__(self) -> None:
+            self.states: "WeakKeyDictionary[Album, T]" = WeakKeyDictionary()
+
+        def get(self, album: "Album") -> Optional[T]:
+            """Return the state of an album, or None."""
+            return self.states.get(album)
+
+        def pop(self, album: "Album") -> Optional[T]:
+            """Remove and return the state of an album, or None."""
+            return self.states.pop(album, None)
+
+        def __setitem__(self, album: "Album", value: T) -> None:
+            """Set the state of an album."""
+            self.states[album] = value
+
+    def register_state(_module: str, _obj: object, *_attributes: str) -> None:
+        """Do nothing, the state is only reported by the library."""
+
+    class TrackContext:  # type: ignore[no-redef]
+        """Tags of a track."""
+
+        def __init__(self, metadata: Metadata) -> None:
+            self.metadata = metadata
+
+        def get(self, name: str) -> str:
+            """Return the value of a tag, or an empty string."""
+            value: str = self.metadata[name]
+            return value
+
+        def integer(self, name: str) -> int:
+            """Return the value of a numeric tag."""
+            return int(self.metadata[name])
+
+        def set(self, name: str, value: Any) -> None:  # noqa: A003
+            """Change the value of a tag."""
+            self.metadata[name] = value
+
+    class TrackLog:  # type: ignore[no-redef]
+        """Log all the debug messages."""
+
+        def __init__(self, _module: str) -> None:
+            pass
+
+        def enabled(self, _album: "Album") -> bool:
+            """Return whether to log a debug message."""
+            return True
+
+        def processor(
+            self, function: Callable[..., None]
+        ) -> Callable[..., None]:
+            """Return the track processor unchanged."""
+            return function
+
+    class _ReleaseIndex(NamedTuple):
+        media: Dict[int, Dict[str, Any]]
+        video_tracks: Dict[int, Set[int]]
+
+    def release_index(release: Dict[str, Any]) -> _ReleaseIndex:
+        """Return the media and the video tracks of a release."""
+        media = {medium["position"]: medium for medium in release["media"]}
+        video_tracks: Dict[int, Set[int]] = {}
+        for medium_pos, medium in media.items():
+            for track in medium["tracks"]:
+                if track["recording"]["video"]:
+                    video_tracks.setdefault(medium_pos, set()).add(
+                        track["position"]
+                    )
+        return _ReleaseIndex(media, video_tracks)
 
 
 PLUGIN_NAME = "Exclude non-music tracks from disc and track count"
 PLUGIN_AUTHOR = "Alexis Jeandeau"
 PLUGIN_DESCRIPTION = """
 Exclude non-music tracks from the disc and track count.
+
+Uses the “Plugin support library” plugin if it is enabled.
 """
 PLUGIN_VERSION = "1.0"
 PLUGIN_API_VERSIONS = [
@@ -36,97 +137,104 @@ class ExcludeNonMusicTracks:
     """MusicBrainz Picard plugin."""
 
     def __init__(self) -> None:
-        self.media_to_skip: DefaultDict[str, Set[int]] = defaultdict(set)
-        self.non_music_tracks: DefaultDict[
-            str, DefaultDict[int, Set[int]]
-        ] = defaultdict(lambda: defaultdict(set))
+        # Positions of the media to skip, for each album with skipped tracks
+        self.media_to_skip: AlbumState[Set[int]] = AlbumState()
+        # Positions of the tracks to skip by medium position, for each album
+        # with skipped tracks
+        self.non_music_tracks: AlbumState[Dict[int, Set[int]]] = AlbumState()
+        self.track_log = TrackLog(__name__)
 
     def parse_release(
         self,
-        _album: Album,
+        album: "Album",
         metadata: Metadata,
         release: Dict[str, Any],
     ) -> None:
         """Album metadata processor."""
         media_count: int = 0
+        media_to_skip: Set[int] = set()
+        non_music_tracks: Dict[int, Set[int]] = {}
 
         try:
-            album_id: str = metadata["musicbrainz_albumid"]
-            media_to_skip = self.media_to_skip[album_id]
-            non_music_tracks = self.non_music_tracks[album_id]
-
-            for medium in release["media"]:
-                medium_pos: int = medium["position"]
+            index = release_index(release)
+            video_tracks = index.video_tracks
 
+            for medium_pos, medium in index.media.items():
                 if medium["format"] == "DVD-Video":
                     media_to_skip.add(medium_pos)
                     continue
 
-                for track in medium["tracks"]:
-                    if track["recording"]["video"]:
-                        track_pos: int = track["position"]
-                        non_music_tracks[medium_pos].add(track_pos)
-
-                track_count: int = medium["track-count"]
-
-                if (
-                    medium_pos in non_music_tracks
-                    and len(non_music_tracks[medium_pos]) == track_count
-                ):
-                    media_to_skip.add(medium_pos)
-                    del non_music_tracks[medium_pos]
-                    continue
+                if medium_pos in video_tracks:
+                    track_count: int = medium["track-count"]
+                    if len(video_tracks[medium_pos]) == track_count:
+                        media_to_skip.add(medium_pos)
+                        continue
+                    # The index is shared with the other plugins
+                    non_music_tracks[medium_pos] = set(
+                        video_tracks[medium_pos]
+                    )
 
                 media_count += 1
         except KeyError as e:
             log.error("Error when parsing release: %s", e)
 
+        # Drop the state of a previous load of the album
+        if media_to_skip or non_music_tracks:
+            self.media_to_skip[album] = media_to_skip
+            self.non_music_tracks[album] = non_music_tracks
+        else:
+            self.media_to_skip.pop(album)
+            self.non_music_tracks.pop(album)
+
         if media_count != metadata["totaldiscs"]:
             metadata["totaldiscs"] = media_count
 
     def set_track_count(
         self,
-        _tagger: Album,
+        album: "Album",
         metadata: Metadata,
         _track: Dict[str, Any],
         _release: Dict[str, Any],
+        context: Optional[TrackContext] = None,
     ) -> None:
         """Track metadata processor."""
-        try:
-            album_id: str = metadata["musicbrainz_albumid"]
+        media_to_skip = self.media_to_skip.get(album)
+        non_music_tracks = self.non_music_tracks.get(album)
 
-            if (
-                album_id not in self.media_to_skip
-                or album_id not in self.non_music_tracks
-            ):
-                return
+        if media_to_skip is None or non_music_tracks is None:
+            return
 
-            title: str = metadata["title"]
-            discnumber = int(metadata["discnumber"])
+        if context is None:
+            context = TrackContext(metadata)
 
-            if discnumber in self.media_to_skip[album_id]:
+        try:
+            title: str = context.get("title")
+            discnumber = context.integer("discnumber")
+
+            if discnumber in media_to_skip:
                 return
 
             disc_skip: int = 0
             for disc in range(1, discnumber + 1):
-                if disc in self.media_to_skip[album_id]:
+                if disc in media_to_skip:
                     disc_skip += 1
 
             new_discnumber = discnumber - disc_skip
 
-            log.debug(
-                "Changing disc number from %d to %d for %s",
-                discnumber,
-                new_discnumber,
-                title,
-            )
+            if self.track_log.enabled(album):
+                log.debug(
+                    "Changing disc number from %d to %d for %s",
+                    discnumber,
+                    new_discnumber,
+                    title,
+                )
 
-            metadata["discnumber"] = new_discnumber
+            context.set("discnumber", new_discnumber)
 
-            if discnumber in self.non_music_tracks[album_id]:
-                tracks_to_skip = self.non_music_tracks[album_id][discnumber]
-                tracknumber = int(metadata["tracknumber"])
-                totaltracks = int(metadata["totaltracks"])
+            if discnumber in non_music_tracks:
+                tracks_to_skip = non_music_tracks[discnumber]
+                tracknumber = context.integer("tracknumber")
+                totaltracks = context.integer("totaltracks")
                 track_skip = 0
 
                 for track in range(1, tracknumber + 1):
@@ -136,23 +244,28 @@ class ExcludeNonMusicTracks:
                 new_tracknumber = tracknumber - track_skip
                 new_totaltracks = totaltracks - len(tracks_to_skip)
 
-                log.debug(
-                    "Changing track number from %d to %d "
-                    "and total tracks from %d to %d for %s",
-                    tracknumber,
-                    new_tracknumber,
-                    totaltracks,
-                    new_totaltracks,
-                    title,
-                )
-
-                metadata["tracknumber"] = new_tracknumber
-                metadata["totaltracks"] = new_totaltracks
+                if self.track_log.enabled(album):
+                    log.debug(
+                        "Changing track number from %d to %d "
+                        "and total tracks from %d to %d for %s",
+                        tracknumber,
+                        new_tracknumber,
+                        totaltracks,
+                        new_totaltracks,
+                        title,
+                    )
+
+                context.set("tracknumber", new_tracknumber)
+                context.set("totaltracks", new_totaltracks)
         except (KeyError, ValueError) as e:
             log.error("Error when setting the track count: %s", e)
 
 
 plugin = ExcludeNonMusicTracks()
 
+register_state(__name__, plugin, "media_to_skip", "non_music_tracks")
+
 register_album_metadata_processor(plugin.parse_release)
-register_track_metadata_processor(plugin.set_track_count)
+register_track_metadata_processor(
+    plugin.track_log.processor(plugin.set_track_count)
+)
@@ -0,0 +1,70 @@
+"""Replace multiple strings in a single pass."""
+
+from functools import lru_cache
+from re import compile as re_compile, escape
+from typing import Dict, Pattern, Tuple
+
+from picard.script import ScriptParser, register_script_function
+
+
+PLUGIN_NAME = "Replace many"
+PLUGIN_AUTHOR = "Alexis Jeandeau"
+PLUGIN_DESCRIPTION = """
+Add a `$replacemany(text,search1,replace1,search2,replace2,...)` script
+function, which replaces all the `search` strings by the corresponding
+`replace` strings in a single pass.
+
+At each position of `text`, the first `search` string found there is
+replaced. Unlike chained `$replace` calls, the replaced text is not searched
+again.
+"""
+PLUGIN_VERSION = "1.0"
+PLUGIN_API_VERSIONS = [
+    "2.0",
+    "2.1",
+    "2.2",
+    "2.3",
+    "2.4",
+    "2.5",
+    "2.6",
+    "2.7",
+]
+PLUGIN_LICENSE = "GPL-2.0-or-later"
+PLUGIN_LICENSE_URL = "https://www.gnu.org/licenses/gpl-2.0.html"
+
+
+@lru_cache(maxsize=256)
+def compile_replacements(
+    replacements: Tuple[str, ...],
+) -> Tuple[Pattern[str], Dict[str, str]]:
+    """Return a regex matching the search strings and their replacements.
+
+    `replacements` alternates search and replace strings. Empty search
+    strings are ignored, and only the first replacement of a search string
+    is kept.
+    """
+    mapping: Dict[str, str] = {}
+    for search, replace in zip(replacements[::2], replacements[1::2]):
+        if search:
+            mapping.setdefault(search, replace)
+    return re_compile("|".join(map(escape, mapping))), mapping
+
+
+def replace_many(
+    parser: ScriptParser,
+    text: str,
+    search: str,
+    replace: str,
+    *replacements: str,
+) -> str:
+    """Replace multiple strings of `text` in a single pass.
+
+    A search string without a replacement at the end is ignored.
+    """
+    pattern, mapping = compile_replacements((search, replace) + replacements)
+    if not mapping:
+        return text
+    return pattern.sub(lambda match: mapping[match.group()], text)
+
+
+register_script_function(replace_many, name="replacemany")
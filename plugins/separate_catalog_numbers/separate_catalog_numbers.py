@@ -1,11 +1,58 @@
 """Separate multiple catalog numbers per medium."""
 
 from re import split as re_split
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
 
 from picard import log
-from picard.album import Album
-from picard.metadata import Metadata, register_track_metadata_processor
+from picard.metadata import Metadata
+
+
+if TYPE_CHECKING:
+    from picard.album import Album
+
+try:
+    from picard.plugins._support import (
+        TrackContext,
+        TrackLog,
+        register_track_metadata_processor,
+    )
+except ImportError:  # The plugin support library is not enabled
+    from picard.metadata import register_track_metadata_processor
+
+    class TrackContext:  # type: ignore[no-redef]
+        """Tags of a track."""
+
+        def __init__(self, metadata: Metadata) -> None:
+            self.metadata = metadata
+
+        def get(self, name: str) -> str:
+            """Return the value of a tag, or an empty string."""
+            value: str = self.metadata[name]
+            return value
+
+        def integer(self, name: str) -> int:
+            """Return the value of a numeric tag."""
+            return int(self.metadata[name])
+
+        def set(self, name: str, value: Any) -> None:  # noqa: A003
+            """Change the value of a tag."""
+            self.metadata[name] = value
+
+    class TrackLog:  # type: ignore[no-redef]
+        """Log all the debug messages."""
+
+        def __init__(self, _module: str) -> None:
+            pass
+
+        def enabled(self, _album: "Album") -> bool:
+            """Return whether to log a debug message."""
+            return True
+
+        def processor(
+            self, function: Callable[..., None]
+        ) -> Callable[..., None]:
+            """Return the track processor unchanged."""
+            return function
 
 
 PLUGIN_NAME = "Separate multiple catalog numbers per medium"
@@ -21,6 +68,8 @@ This acts as a fix for
 > overall number that appears on the outer packaging.
 > It is currently not possible to enter them at the medium level, so they can
 > either be added to the full release or listed in the annotation.
+
+Uses the “Plugin support library” plugin if it is enabled.
 """
 PLUGIN_VERSION = "1.0"
 PLUGIN_API_VERSIONS = [
@@ -32,25 +81,35 @@ PLUGIN_LICENSE_URL = "https://www.gnu.org/licenses/gpl-2.0.html"
 _SPLIT_REGEX = r"→|~|～"
 _SEPARATOR = "-"
 
+track_log = TrackLog(__name__)
+
 
 def separate_catalog_numbers(
-    _tagger: Album,
+    album: "Album",
     metadata: Metadata,
     _track: Dict[str, Any],
     _release: Dict[str, Any],
+    context: Optional[TrackContext] = None,
 ) -> None:
     """Separate multiple catalog numbers per medium."""
-    title: str = metadata["title"]
+    if context is None:
+        context = TrackContext(metadata)
 
     if "label" not in metadata or "catalognumber" not in metadata:
-        log.debug("No label or catalog number, skipping %s", title)
+        if track_log.enabled(album):
+            log.debug(
+                "No label or catalog number, skipping %s", context.get("title")
+            )
         return
 
     labels: List[str] = metadata.getraw("label")
     catalognumbers: List[str] = metadata.getraw("catalognumber")
 
     if len(labels) != 1:
-        log.debug("Multiple or no labels, skipping %s", title)
+        if track_log.enabled(album):
+            log.debug(
+                "Multiple or no labels, skipping %s", context.get("title")
+            )
         return
 
     if len(catalognumbers) == 1:
@@ -65,7 +124,10 @@ def separate_catalog_numbers(
         try:
             low, high = re_split(_SPLIT_REGEX, suffix)
         except ValueError:
-            log.debug("Single catalog number, skipping %s", title)
+            if track_log.enabled(album):
+                log.debug(
+                    "Single catalog number, skipping %s", context.get("title")
+                )
             return
 
         if len(low) != len(high):
@@ -80,8 +142,8 @@ def separate_catalog_numbers(
             log.warning("Invalid catalog number: %s", catalognumber)
             return
 
-    discnumber = int(metadata["discnumber"])
-    totaldiscs = int(metadata["totaldiscs"])
+    discnumber = context.integer("discnumber")
+    totaldiscs = context.integer("totaldiscs")
 
     if totaldiscs != len(catalognumbers):
         log.error(
@@ -92,9 +154,27 @@ def separate_catalog_numbers(
         )
         return
 
+    if discnumber > totaldiscs:
+        # Media excluded from the disc count (e.g. by the
+        # exclude_non_music_tracks plugin) keep their original disc number
+        if track_log.enabled(album):
+            log.debug(
+                "Disc %d is not counted, skipping %s",
+                discnumber,
+                context.get("title"),
+            )
+        return
+
     catalognumber = catalognumbers[discnumber - 1]
-    log.debug("Setting catalog number to %s for %s", catalognumber, title)
-    metadata["catalognumber"] = [catalognumber]
+    if track_log.enabled(album):
+        log.debug(
+            "Setting catalog number to %s for %s",
+            catalognumber,
+            context.get("title"),
+        )
+    context.set("catalognumber", [catalognumber])
 
 
-register_track_metadata_processor(separate_catalog_numbers)
+register_track_metadata_processor(
+    track_log.processor(separate_catalog_numbers)
+)
@@ -1,11 +1,55 @@
 """Set the initial key from the track title for classical releases."""
 
+from functools import lru_cache
 from re import IGNORECASE, compile as re_compile
-from typing import Any, Dict, Match, Optional, Pattern
+from typing import TYPE_CHECKING, Any, Callable, Dict, Match, Optional, Pattern
 
 from picard import log
-from picard.album import Album
-from picard.metadata import Metadata, register_track_metadata_processor
+from picard.metadata import Metadata
+
+
+if TYPE_CHECKING:
+    from picard.album import Album
+
+try:
+    from picard.plugins._support import (
+        TrackContext,
+        TrackLog,
+        register_track_metadata_processor,
+    )
+except ImportError:  # The plugin support library is not enabled
+    from picard.metadata import register_track_metadata_processor
+
+    class TrackContext:  # type: ignore[no-redef]
+        """Tags of a track."""
+
+        def __init__(self, metadata: Metadata) -> None:
+            self.metadata = metadata
+
+        def get(self, name: str) -> str:
+            """Return the value of a tag, or an empty string."""
+            value: str = self.metadata[name]
+            return value
+
+        def set(self, name: str, value: Any) -> None:  # noqa: A003
+            """Change the value of a tag."""
+            self.metadata[name] = value
+
+    class TrackLog:  # type: ignore[no-redef]
+        """Log all the debug messages."""
+
+        def __init__(self, _module: str) -> None:
+            pass
+
+        def enabled(self, _album: "Album") -> bool:
+            """Return whether to log a debug message."""
+            return True
+
+        def processor(
+            self, function: Callable[..., None]
+        ) -> Callable[..., None]:
+            """Return the track processor unchanged."""
+            return function
 
 
 PLUGIN_NAME = "Set the initial key from the track title for classical releases"
@@ -15,6 +59,8 @@ Set the initial key from the track title for classical releases.
 
 For example, set the key tag to `C#m` for a track called
 `Symphony No. 5 In C-Sharp Minor`.
+
+Uses the “Plugin support library” plugin if it is enabled.
 """
 PLUGIN_VERSION = "1.0"
 PLUGIN_API_VERSIONS = [
@@ -24,53 +70,59 @@ PLUGIN_LICENSE = "GPL-2.0-or-later"
 PLUGIN_LICENSE_URL = "https://www.gnu.org/licenses/gpl-2.0.html"
 
 
-_KEY_REGEXES: Dict[str, Pattern[str]] = {
+# Patterns of the key in titles, compiled on first use by `_key_regex`
+_KEY_PATTERNS: Dict[str, str] = {
     # English
-    "eng": re_compile(
+    "eng": (
         r"\sin\s"
         r"(?P<key>[A-G])(?:[-‐\s](?P<modifier>Flat|Sharp))?"
-        r"(?:\s(?P<minor>minor))?",
-        IGNORECASE,
+        r"(?:\s(?P<minor>minor))?"
     ),
     # German
-    "deu": re_compile(
+    "deu": (
         r"\sin\s"
         r"(?P<key>[A-H])(?P<modifier>es|is)?"
-        r"(?:[\s\-‐](?P<minor>Moll))?",
-        IGNORECASE,
+        r"(?:[\s\-‐](?P<minor>Moll))?"
     ),
     # French
-    "fra": re_compile(
+    "fra": (
         r"\sen\s"
         r"(?P<key>do|ré|mi|fa|sol|la|si)(?:\s(?P<modifier>bémol|dièse))?"
-        r"(?:\s(?P<minor>mineur))?",
-        IGNORECASE,
+        r"(?:\s(?P<minor>mineur))?"
     ),
     # Italian
-    "ita": re_compile(
+    "ita": (
         r"\sin\s"
         r"(?P<key>do|re|mi|fa|sol|la|si)(?:\s(?P<modifier>bemolle|diesis))?"
-        r"(?:\s(?P<minor>minore))?",
-        IGNORECASE,
+        r"(?:\s(?P<minor>minore))?"
     ),
 }
 
+track_log = TrackLog(__name__)
+
+
+@lru_cache(maxsize=None)
+def _key_regex(language: str) -> Pattern[str]:
+    """Return the regex of the key in titles of a language."""
+    return re_compile(_KEY_PATTERNS[language], IGNORECASE)
+
 
 def parse_key(
-    _tagger: Album,
+    album: "Album",
     metadata: Metadata,
     _track: Dict[str, Any],
     _release: Dict[str, Any],
+    context: Optional[TrackContext] = None,
 ) -> None:
     """Parse the key from the title and set the `key` tag."""
-    language = metadata["~releaselanguage"]
-    regex = (
-        _KEY_REGEXES[language]
-        if language in _KEY_REGEXES
-        else _KEY_REGEXES["eng"]
-    )
+    if context is None:
+        context = TrackContext(metadata)
+
+    language = context.get("~releaselanguage")
+    title = context.get("title")
+    regex = _key_regex(language if language in _KEY_PATTERNS else "eng")
 
-    match: Optional[Match[str]] = regex.search(metadata["title"])
+    match: Optional[Match[str]] = regex.search(title)
 
     if not match:
         return
@@ -106,9 +158,10 @@ def parse_key(
     if match.group("minor"):
         key += "m"
 
-    log.debug("Setting the key of %s to %s", metadata["title"], key)
+    if track_log.enabled(album):
+        log.debug("Setting the key of %s to %s", title, key)
 
-    metadata["key"] = key
+    context.set("key", key)
 
 
-register_track_metadata_processor(parse_key)
+register_track_metadata_processor(track_log.processor(parse_key))
@@ -1,18 +1,118 @@
 """Album and track sorting using translations / transliterations."""
 
-from collections import defaultdict
 from functools import partial
-from typing import Any, DefaultDict, Dict, List
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    List,
+    NamedTuple,
+    Optional,
+    TypeVar,
+)
+from weakref import WeakKeyDictionary
 
-from PyQt5.QtNetwork import QNetworkReply
 from picard import log
-from picard.album import Album
-from picard.metadata import (
-    Metadata,
-    register_album_metadata_processor,
-    register_track_metadata_processor,
-)
-from picard.tagger import Tagger
+from picard.metadata import Metadata
+
+
+if TYPE_CHECKING:
+    from PyQt5.QtNetwork import QNetworkReply
+    from picard.album import Album
+    from picard.tagger import Tagger
+
+try:
+    from picard.plugins._support import (
+        AlbumState,
+        TrackContext,
+        TrackLog,
+        register_album_metadata_processor,
+        register_state,
+        register_track_metadata_processor,
+        release_index,
+    )
+except ImportError:  # The plugin support library is not enabled
+    from picard.metadata import (
+        register_album_metadata_processor,
+        register_track_metadata_processor,
+    )
+
+    T = TypeVar("T")
+
+    class AlbumState(Generic[T]):  # type: ignore[no-redef]
+        """State of the plugin for each album, dropped with the album."""
+
+        def __init__(self) -> None:
+            self.states: "WeakKeyDictionary[Album, T]" = WeakKeyDictionary()
+
+        def get(self, album: "Album") -> Optional[T]:
+            """Return the state of an album, or None."""
+            return self.states.get(album)
+
+        def pop(self, album: "Album") -> Optional[T]:
+            """Remove and return the state of an album, or None."""
+            return self.states.pop(album, None)
+
+        def __setitem__(self, album: "Album", value: T) -> None:
+            """Set the state of an album."""
+            self.states[album] = value
+
+    def register_state(_module: str, _obj: object, *_attributes: str) -> None:
+        """Do nothing, the state is only reported by the library."""
+
+    class TrackContext:  # type: ignore[no-redef]
+        """Tags of a track."""
+
+        def __init__(self, metadata: Metadata) -> None:
+            self.metadata = metadata
+
+        def get(self, name: str) -> str:
+            """Return the value of a tag, or an empty string."""
+            value: str = self.metadata[name]
+            return value
+
+        def integer(self, name: str) -> int:
+            """Return the value of a numeric tag."""
+            return int(self.metadata[name])
+
+        def set(self, name: str, value: Any) -> None:  # noqa: A003
+            """Change the value of a tag."""
+            self.metadata[name] = value
+
+    class TrackLog:  # type: ignore[no-redef]
+        """Log all the debug messages."""
+
+        def __init__(self, _module: str) -> None:
+            pass
+
+        def enabled(self, _album: "Album") -> bool:
+            """Return whether to log a debug message."""
+            return True
+
+        def processor(
+            self, function: Callable[..., None]
+        ) -> Callable[..., None]:
+            """Return the track processor unchanged."""
+            return function
+
+    class _ReleaseIndex(NamedTuple):
+        release: Dict[str, Any]
+
+        def relations(self, relation_type: str) -> List[Dict[str, Any]]:
+            """Return the forward relationships to releases of a type."""
+            return [
+                relation
+                for relation in self.release["relations"]
+                if relation["type"] == relation_type
+                and relation["target-type"] == "release"
+                and relation["direction"] == "forward"
+            ]
+
+    def release_index(release: Dict[str, Any]) -> _ReleaseIndex:
+        """Return the relationships of a release."""
+        return _ReleaseIndex(release)
 
 
 PLUGIN_NAME = (
@@ -23,6 +123,8 @@ PLUGIN_AUTHOR = "Alexis Jeandeau"
 PLUGIN_DESCRIPTION = """
 Fetch latin script tracklists using translation / transliteration relationships
 and use them to set the `albumsort` and `titlesort` tags.
+
+Uses the “Plugin support library” plugin if it is enabled.
 """
 PLUGIN_VERSION = "1.0"
 PLUGIN_API_VERSIONS = [
@@ -38,16 +140,19 @@ class TransliterationSort:
     SCRIPT = "Latn"
 
     def __init__(self) -> None:
-        self.tracks: DefaultDict[
-            str, DefaultDict[int, DefaultDict[int, Dict[str, str]]]
-        ] = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+        # Transliterated title and recording MBID by medium and track
+        # position, for each album with a transliterated release
+        self.tracks: AlbumState[
+            Dict[int, Dict[int, Dict[str, str]]]
+        ] = AlbumState()
+        self.track_log = TrackLog(__name__)
 
     def transliterated_release_dl_callback(
         self,
-        album: Album,
+        album: "Album",
         metadata: Metadata,
         document: Dict[str, Any],
-        http: QNetworkReply,
+        http: "QNetworkReply",
         error: int,
     ) -> None:
         """MusicBrainz `get_release_by_id` callback."""
@@ -65,7 +170,7 @@ class TransliterationSort:
             album_latin: str = document["title"]
             metadata["albumsort"] = album_latin
 
-            original_album_id: str = metadata["musicbrainz_albumid"]
+            tracks: Dict[int, Dict[int, Dict[str, str]]] = {}
 
             medium: Dict[str, Any]
             for medium in document["media"]:
@@ -77,18 +182,22 @@ class TransliterationSort:
                     title: str = track["title"]
                     recording_id: str = track["recording"]["id"]
 
-                    log.debug(
-                        "Found transliterated title for %s %d-%d: %s",
-                        metadata["album"],
-                        mediumpos,
-                        trackpos,
-                        title,
-                    )
+                    if self.track_log.enabled(album):
+                        log.debug(
+                            "Found transliterated title for %s %d-%d: %s",
+                            metadata["album"],
+                            mediumpos,
+                            trackpos,
+                            title,
+                        )
 
-                    self.tracks[original_album_id][mediumpos][trackpos] = {
+                    tracks.setdefault(mediumpos, {})[trackpos] = {
                         "title": title,
                         "mbid": recording_id,
                     }
+
+            if tracks:
+                self.tracks[album] = tracks
         except KeyError as e:
             log.error("Error when parsing transliterated release: %s", e)
         finally:
@@ -97,11 +206,14 @@ class TransliterationSort:
 
     def fetch_transliterations(
         self,
-        album: Album,
+        album: "Album",
         metadata: Metadata,
         release: Dict[str, Any],
     ) -> None:
         """Album metadata processor."""
+        # Drop the titles fetched by a previous load of the album
+        self.tracks.pop(album)
+
         try:
             if (
                 metadata["releasestatus"] == "pseudo-release"
@@ -112,34 +224,29 @@ class TransliterationSort:
             transl_release_ids: List[str] = []
 
             relation: Dict[str, Any]
-            for relation in release["relations"]:
-                if (
-                    relation["target-type"] == "release"
-                    and relation["type"] == "transl-tracklisting"
-                    and relation["direction"] == "forward"
+            for relation in release_index(release).relations(
+                "transl-tracklisting"
+            ):
+                transl_release: Dict[str, Any] = relation["release"]
+                log.debug(
+                    "Found transliterated / translated release %s",
+                    transl_release,
+                )
+
+                disambiguation: str = transl_release["disambiguation"].lower()
+                language: str = transl_release["text-representation"][
+                    "language"
+                ]
+
+                release_id: str = transl_release["id"]
+                if "transliterated" in disambiguation or (
+                    language and language != "eng"
                 ):
-                    transl_release: Dict[str, Any] = relation["release"]
-                    log.debug(
-                        "Found transliterated / translated release %s",
-                        transl_release,
-                    )
-
-                    disambiguation: str = transl_release[
-                        "disambiguation"
-                    ].lower()
-                    language: str = transl_release["text-representation"][
-                        "language"
-                    ]
-
-                    release_id: str = transl_release["id"]
-                    if "transliterated" in disambiguation or (
-                        language and language != "eng"
-                    ):
-                        # Prioritize transliterations over translations
-                        # This is sometimes specified in the disambiguation
-                        transl_release_ids.insert(0, release_id)
-                    else:
-                        transl_release_ids.append(release_id)
+                    # Prioritize transliterations over translations
+                    # This is sometimes specified in the disambiguation
+                    transl_release_ids.insert(0, release_id)
+                else:
+                    transl_release_ids.append(release_id)
 
             if not transl_release_ids:
                 return
@@ -151,7 +258,7 @@ class TransliterationSort:
                 metadata["album"],
             )
             album._requests += 1
-            tagger: Tagger = album.tagger
+            tagger: "Tagger" = album.tagger
             tagger.mb_api.get_release_by_id(
                 release_id,
                 partial(
@@ -166,55 +273,68 @@ class TransliterationSort:
 
     def set_transliterations(
         self,
-        _tagger: Album,
+        album: "Album",
         metadata: Metadata,
         _track: Dict[str, Any],
         _release: Dict[str, Any],
+        context: Optional[TrackContext] = None,
     ) -> None:
         """Track metadata processor."""
+        tracks = self.tracks.get(album)
+        if tracks is None:
+            return
+
+        if context is None:
+            context = TrackContext(metadata)
+
         try:
-            album_id = metadata["musicbrainz_albumid"]
-            discnumber = int(metadata["discnumber"])
-            tracknumber = int(metadata["tracknumber"])
+            discnumber = context.integer("discnumber")
+            tracknumber = context.integer("tracknumber")
 
             if (
-                not self.tracks
-                or album_id not in self.tracks
-                or discnumber not in self.tracks[album_id]
-                or tracknumber not in self.tracks[album_id][discnumber]
+                discnumber not in tracks
+                or tracknumber not in tracks[discnumber]
             ):
                 return
 
-            track_info = self.tracks[album_id][discnumber][tracknumber]
+            track_info = tracks[discnumber][tracknumber]
+
+            title = context.get("title")
+            recording_id = context.get("musicbrainz_recordingid")
 
-            if track_info["mbid"] == metadata["musicbrainz_recordingid"]:
-                if track_info["title"] != metadata["title"]:
-                    log.debug(
-                        "Setting titlesort for %s to %s",
-                        metadata["title"],
-                        track_info["title"],
-                    )
-                    metadata["titlesort"] = track_info["title"]
+            if track_info["mbid"] == recording_id:
+                if track_info["title"] != title:
+                    if self.track_log.enabled(album):
+                        log.debug(
+                            "Setting titlesort for %s to %s",
+                            title,
+                            track_info["title"],
+                        )
+                    context.set("titlesort", track_info["title"])
             else:
                 log.error(
                     "MBID for %s (%s) does not match MBID for %s (%s).",
                     track_info["title"],
                     track_info["mbid"],
-                    metadata["title"],
-                    metadata["musicbrainz_recordingid"],
+                    title,
+                    recording_id,
                 )
 
             # Cleanup fetched data
-            del self.tracks[album_id][discnumber][tracknumber]
-            if not self.tracks[album_id][discnumber]:
-                del self.tracks[album_id][discnumber]
-            if not self.tracks[album_id]:
-                del self.tracks[album_id]
+            del tracks[discnumber][tracknumber]
+            if not tracks[discnumber]:
+                del tracks[discnumber]
+            if not tracks:
+                self.tracks.pop(album)
         except (KeyError, ValueError) as e:
             log.error("Error when setting track title transliterations: %s", e)
 
 
 plugin = TransliterationSort()
 
+register_state(__name__, plugin, "tracks")
+
 register_album_metadata_processor(plugin.fetch_transliterations)
-register_track_metadata_processor(plugin.set_transliterations)
+register_track_metadata_processor(
+    plugin.track_log.processor(plugin.set_transliterations)
+)
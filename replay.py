@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+"""Record MusicBrainz releases and replay them through the plugins offline.
+
+`record` downloads releases and the releases they link to for
+transliterated tracklists into a corpus folder. `replay` runs every
+metadata processor of this repository on the corpus, serving the web
+service requests of the plugins from disk, and reports the throughput of
+each plugin.
+"""
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from json import dump as json_dump, load as json_load, loads as json_loads
+from pathlib import Path
+from time import monotonic, sleep
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+)
+from urllib.request import Request, urlopen
+
+from picard import log
+
+from harness import Release, load_processors, process_release
+
+
+# MusicBrainz web service URL for releases
+MB_RELEASE_URL = "https://musicbrainz.org/ws/2/release/{}?inc={}&fmt=json"
+
+# Includes requested by Picard when loading a release
+RELEASE_INCLUDES = (
+    "labels",
+    "recordings",
+    "release-rels",
+    "media",
+    "artist-credits",
+    "release-groups",
+)
+
+# Includes requested by the plugins for related releases
+RELATED_INCLUDES = ("recordings",)
+
+# Minimum delay between two requests, see
+# https://musicbrainz.org/doc/MusicBrainz_API/Rate_Limiting
+REQUEST_INTERVAL = 1.0
+
+USER_AGENT = (
+    "picard-plugins-replay/1.0 "
+    "(https://github.com/jeandeaual/picard-plugins-scripts)"
+)
+
+# Subfolders of the corpus
+RELEASES_DIR = "releases"
+RELATED_DIR = "related"
+
+
+def fetch_release(release_id: str, includes: Iterable[str]) -> Release:
+    """Download a release from the MusicBrainz web service."""
+    request = Request(  # noqa: S310
+        MB_RELEASE_URL.format(release_id, "+".join(includes)),
+        headers={"User-Agent": USER_AGENT, "Accept": "application/json"},
+    )
+    with urlopen(request) as response:  # noqa: S310
+        release: Release = json_loads(response.read().decode("utf-8"))
+    return release
+
+
+def get_related_release_ids(release: Release) -> List[str]:
+    """Return the IDs of the releases the plugins may request."""
+    return [
+        relation["release"]["id"]
+        for relation in release.get("relations", [])
+        if relation.get("target-type") == "release"
+        and relation.get("type") == "transl-tracklisting"
+        and relation.get("direction") == "forward"
+    ]
+
+
+def save_release(path: Path, release: Release) -> None:
+    """Save release JSON to the corpus."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as out_file:
+        json_dump(release, out_file, ensure_ascii=False, sort_keys=True)
+
+
+def load_release(path: Path) -> Optional[Release]:
+    """Load release JSON from the corpus, if it exists."""
+    if not path.is_file():
+        return None
+    with open(path, "r", encoding="utf-8") as in_file:
+        release: Release = json_load(in_file)
+    return release
+
+
+def record(
+    corpus: Path,
+    release_ids: Iterable[str],
+    fetch: Callable[[str, Iterable[str]], Release] = fetch_release,
+    interval: float = REQUEST_INTERVAL,
+) -> None:
+    """Download releases and their transliterations to the corpus.
+
+    Releases already in the corpus are not downloaded again.
+    """
+    last_request = 0.0
+
+    def throttled_fetch(release_id: str, includes: Iterable[str]) -> Release:
+        nonlocal last_request
+        delay = last_request + interval - monotonic()
+        if delay > 0:
+            sleep(delay)
+        last_request = monotonic()
+        return fetch(release_id, includes)
+
+    for release_id in release_ids:
+        path = corpus / RELEASES_DIR / f"{release_id}.json"
+        release = load_release(path)
+        if release is None:
+            release = throttled_fetch(release_id, RELEASE_INCLUDES)
+            save_release(path, release)
+            print(f"Recorded {release_id}: {release.get('title')}")
+
+        for related_id in get_related_release_ids(release):
+            related_path = corpus / RELATED_DIR / f"{related_id}.json"
+            if not related_path.is_file():
+                save_release(
+                    related_path, throttled_fetch(related_id, RELATED_INCLUDES)
+                )
+                print(f"Recorded {related_id} (related to {release_id})")
+
+
+class CorpusReleases(Mapping[str, Release]):
+    """Releases of a corpus folder by ID, read from disk on each access."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def __getitem__(self, release_id: str) -> Release:
+        """Load a release from the corpus."""
+        release = load_release(self.path / f"{release_id}.json")
+        if release is None:
+            raise KeyError(release_id)
+        return release
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the release IDs of the corpus."""
+        return (path.stem for path in sorted(self.path.glob("*.json")))
+
+    def __len__(self) -> int:
+        """Return the number of releases in the corpus."""
+        return sum(1 for _ in self.path.glob("*.json"))
+
+
+class Throughput(NamedTuple):
+    """Time spent by a plugin processing the corpus."""
+
+    seconds: float
+    albums: int
+    tracks: int
+
+    @property
+    def albums_per_second(self) -> float:
+        """Number of albums processed per second."""
+        return self.albums / self.seconds if self.seconds else float("inf")
+
+    @property
+    def tracks_per_second(self) -> float:
+        """Number of tracks processed per second."""
+        return self.tracks / self.seconds if self.seconds else float("inf")
+
+
+def replay(corpus: Path, repeat: int = 1) -> Dict[str, Throughput]:
+    """Run all the metadata processors on the releases of the corpus.
+
+    Returns the throughput of each plugin.
+    """
+    processors = load_processors()
+    timings: Dict[str, float] = {}
+    albums = 0
+    tracks = 0
+
+    related = CorpusReleases(corpus / RELATED_DIR)
+    release_paths = sorted((corpus / RELEASES_DIR).glob("*.json"))
+
+    for _ in range(repeat):
+        for path in release_paths:
+            release = load_release(path)
+            if release is None:
+                continue
+            _album_metadata, tracks_metadata = process_release(
+                processors, release, related, timings
+            )
+            albums += 1
+            tracks += len(tracks_metadata)
+
+    plugin_timings: Dict[str, float] = {}
+    for processor in processors.album + processors.track:
+        plugin_timings[processor.plugin] = plugin_timings.get(
+            processor.plugin, 0.0
+        ) + timings.get(processor.id, 0.0)
+
+    return {
+        plugin: Throughput(seconds, albums, tracks)
+        for plugin, seconds in plugin_timings.items()
+    }
+
+
+def main() -> None:
+    """Program entrypoint."""
+    parser = ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--corpus",
+        default=Path("corpus"),
+        type=Path,
+        help="path of the corpus folder",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    record_parser = subparsers.add_parser(
+        "record",
+        help="download releases to the corpus",
+    )
+    record_parser.add_argument(
+        "release_ids",
+        metavar="MBID",
+        nargs="+",
+        help="MusicBrainz release ID",
+    )
+
+    replay_parser = subparsers.add_parser(
+        "replay",
+        help="run the plugins on the corpus",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    replay_parser.add_argument(
+        "--repeat",
+        default=1,
+        type=int,
+        help="number of times the corpus is processed",
+    )
+    replay_parser.add_argument(
+        "--log-level",
+        default="WARNING",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="level of the messages logged by the plugins",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.corpus, args.release_ids)
+        return
+
+    log.set_level(args.log_level)
+
+    results = replay(args.corpus, args.repeat)
+    width = max(map(len, results), default=0)
+
+    for plugin, throughput in sorted(results.items()):
+        print(
+            f"{plugin:<{width}} {throughput.seconds * 1000:10.3f}ms "
+            f"{throughput.albums_per_second:12.1f} albums/s "
+            f"{throughput.tracks_per_second:12.1f} tracks/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+"""Load many albums at the same time with randomly interleaved callbacks.
+
+Synthetic albums are loaded like in MusicBrainz Picard: the album metadata
+processors run first, the web service callbacks of the plugins arrive
+later in a random order, and the track metadata processors run once all
+the requests of an album are done, with the tracks of different albums
+interleaved. Some releases are loaded twice at the same time, as separate
+albums.
+
+The tags of each album are compared with those of the album loaded alone,
+and the state kept by the plugins is checked to be dropped with the
+albums. The throughput is reported for each number of albums loading at
+the same time.
+"""
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from gc import collect
+from random import Random
+from sys import exit, modules
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from picard import log
+from picard.metadata import Metadata
+from picard.plugin import _PLUGIN_MODULE_PREFIX
+
+from harness import (
+    FakeAlbum,
+    FakeMBAPIHelper,
+    FakeTagger,
+    Processors,
+    Release,
+    iter_tracks,
+    load_processors,
+    make_release,
+    process_release,
+    release_to_metadata,
+    track_to_metadata,
+)
+
+
+# Tags of an album, then of each of its tracks
+AlbumTags = List[Dict[str, List[str]]]
+
+# Albums loading at the same time by default
+CONCURRENCY = (1, 4, 16, 64, 256)
+
+T = TypeVar("T")
+
+
+def _pop_at(items: List[T], index: int) -> T:
+    """Remove an item of a list in constant time, changing their order."""
+    items[index], items[-1] = items[-1], items[index]
+    return items.pop()
+
+
+class DeferredMBAPIHelper(FakeMBAPIHelper):
+    """Stand-in for `MBAPIHelper` queueing the callbacks.
+
+    The callbacks are called by `run_callback`, in any order.
+    """
+
+    def __init__(
+        self, get_release: Callable[[str], Optional[Release]]
+    ) -> None:
+        super().__init__(get_release)
+        self.callbacks: List[Callable[[], None]] = []
+
+    def get_release_by_id(
+        self,
+        releaseid: str,
+        handler: Callable[[Release, Any, int], None],
+        inc: Optional[Sequence[str]] = None,
+        priority: bool = False,
+        important: bool = False,
+        mblogin: bool = False,
+        refresh: bool = False,
+    ) -> None:
+        """Queue the call of `handler` with the release `releaseid`."""
+        self.callbacks.append(
+            lambda: super(DeferredMBAPIHelper, self).get_release_by_id(
+                releaseid, handler, inc
+            )
+        )
+
+    def run_callback(self, index: int) -> None:
+        """Call the callback queued at `index`."""
+        _pop_at(self.callbacks, index)()
+
+
+class _Load:
+    """An album being loaded."""
+
+    def __init__(
+        self,
+        release: Release,
+        index: int,
+        tagger: FakeTagger,
+        ready: Callable[["_Load"], None],
+    ) -> None:
+        self.album = StressAlbum(release, tagger, lambda: ready(self))
+        self.release = release
+        # Position of the album in the albums to load
+        self.index = index
+        self.tracks: List[Tuple[Dict[str, Any], Metadata]] = []
+        self.next_track = 0
+
+
+class StressAlbum(FakeAlbum):
+    """Stand-in for `Album`, finalized when its requests are done."""
+
+    def __init__(
+        self, release: Release, tagger: FakeTagger, ready: Callable[[], None]
+    ) -> None:
+        super().__init__(release["id"], tagger)
+        self.metadata = release_to_metadata(release)
+        self.ready = ready
+
+    def _finalize_loading(self, error: Optional[bool]) -> None:
+        if self._requests == 0:
+            self.ready()
+
+
+def album_tags(metadata: Metadata, tracks: Sequence[Metadata]) -> AlbumTags:
+    """Return the tags of an album and of its tracks."""
+    return [
+        {name: list(values) for name, values in item.rawitems()}
+        for item in (metadata, *tracks)
+    ]
+
+
+def make_albums(
+    count: int,
+    seed: int = 0,
+    duplicates: float = 0.1,
+    missing_related: float = 0.1,
+) -> Tuple[List[Release], Dict[str, Release]]:
+    """Return the releases of synthetic albums, and the releases they link.
+
+    A fraction of the releases is loaded twice, and a fraction of the
+    related releases is missing from the web service.
+    """
+    rand = Random(seed)
+    releases: List[Release] = []
+    related: Dict[str, Release] = {}
+
+    for index in range(count):
+        release, release_related = make_release(
+            rand.randint(1, 3),
+            rand.randint(4, 15),
+            seed=seed * count + index,
+            language=rand.choice(("jpn", "jpn", "eng", "fra", None)),
+        )
+        releases.append(release)
+        if rand.random() >= missing_related:
+            related.update(release_related)
+
+    releases.extend(rand.sample(releases, int(len(releases) * duplicates)))
+    rand.shuffle(releases)
+    return releases, related
+
+
+class StressResult(NamedTuple):
+    """Outcome of loading albums at the same time."""
+
+    concurrency: int
+    albums: int
+    tracks: int
+    seconds: float
+    # Positions of the albums whose tags differ from an album loaded alone
+    mismatches: List[int]
+    # Entries left in the state of the plugins, by plugin and attribute
+    leaked: Dict[str, int]
+
+    @property
+    def albums_per_second(self) -> float:
+        """Number of albums loaded per second."""
+        return self.albums / self.seconds if self.seconds else float("inf")
+
+    @property
+    def tracks_per_second(self) -> float:
+        """Number of tracks processed per second."""
+        return self.tracks / self.seconds if self.seconds else float("inf")
+
+
+def leaked_state() -> Dict[str, int]:
+    """Return the entries in the registered state of the plugins."""
+    support = modules[f"{_PLUGIN_MODULE_PREFIX}_support"]
+    collect()
+    return {
+        f"{plugin}.{attribute}": stats.entries
+        for plugin, attributes in support.state_registry.stats().items()
+        for attribute, stats in attributes.items()
+        if stats.entries
+    }
+
+
+def _run_interleaved(
+    processors: Processors,
+    releases: Sequence[Release],
+    related: Dict[str, Release],
+    concurrency: int,
+    rand: Random,
+) -> List[AlbumTags]:
+    """Load albums, `concurrency` at a time, in a random interleaving.
+
+    Returns the tags of each album.
+    """
+    mb_api = DeferredMBAPIHelper(related.get)
+    tagger = FakeTagger(mb_api)
+    results: List[AlbumTags] = [[] for _ in releases]
+    # Albums whose requests are done
+    ready: List[_Load] = []
+    loading = 0
+    next_album = 0
+
+    def start(index: int) -> None:
+        release = releases[index]
+        load = _Load(release, index, tagger, ready.append)
+        album = load.album
+
+        # The request of the release itself
+        album._requests = 1
+        for processor in processors.album:
+            processor.function(album, album.metadata, release)
+        album._requests -= 1
+        album._finalize_loading(None)
+
+    def process_track(ready_index: int) -> bool:
+        """Process the next track of an album, return whether it is done."""
+        load = ready[ready_index]
+        album = load.album
+        if not load.tracks:
+            load.tracks = [
+                (track, track_to_metadata(album.metadata, medium, track))
+                for medium, track in iter_tracks(load.release)
+            ]
+        track, metadata = load.tracks[load.next_track]
+        for processor in processors.track:
+            processor.function(album, metadata, track, load.release)
+        load.next_track += 1
+
+        if load.next_track < len(load.tracks):
+            return False
+        results[load.index] = album_tags(
+            album.metadata, [metadata for _track, metadata in load.tracks]
+        )
+        _pop_at(ready, ready_index)
+        return True
+
+    while next_album < len(releases) or loading:
+        can_start = next_album < len(releases) and loading < concurrency
+        choice = rand.randrange(
+            int(can_start) + len(mb_api.callbacks) + len(ready)
+        )
+        if can_start and choice == 0:
+            loading += 1
+            start(next_album)
+            next_album += 1
+            continue
+        choice -= int(can_start)
+        if choice < len(mb_api.callbacks):
+            mb_api.run_callback(choice)
+        elif process_track(choice - len(mb_api.callbacks)):
+            loading -= 1
+
+    return results
+
+
+def run_stress(
+    processors: Processors,
+    releases: Sequence[Release],
+    related: Dict[str, Release],
+    concurrency: int,
+    seed: int = 0,
+) -> StressResult:
+    """Load albums `concurrency` at a time and check their tags and state.
+
+    The tags of each album are compared with the tags of the album loaded
+    alone, see `process_release`.
+    """
+    expected = [
+        album_tags(*process_release(processors, release, related))
+        for release in releases
+    ]
+
+    start = perf_counter()
+    results = _run_interleaved(
+        processors, releases, related, concurrency, Random(seed)
+    )
+    seconds = perf_counter() - start
+
+    return StressResult(
+        concurrency=concurrency,
+        albums=len(releases),
+        tracks=sum(len(tags) - 1 for tags in results),
+        seconds=seconds,
+        mismatches=[
+            index
+            for index, (tags, expected_tags) in enumerate(
+                zip(results, expected)
+            )
+            if tags != expected_tags
+        ],
+        leaked=leaked_state(),
+    )
+
+
+def main() -> None:
+    """Program entrypoint."""
+    parser = ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--albums",
+        default=300,
+        type=int,
+        help="number of synthetic releases",
+    )
+    parser.add_argument(
+        "--concurrency",
+        default=list(CONCURRENCY),
+        nargs="+",
+        type=int,
+        help="numbers of albums loading at the same time",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="seed of the releases and of the interleaving",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="CRITICAL",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        help=(
+            "level of the messages logged by the plugins, which log errors "
+            "for the missing related releases"
+        ),
+    )
+    args = parser.parse_args()
+
+    log.set_level(args.log_level)
+
+    processors = load_processors()
+    releases, related = make_albums(args.albums, args.seed)
+    failed = False
+
+    for concurrency in args.concurrency:
+        result = run_stress(
+            processors, releases, related, concurrency, args.seed
+        )
+        print(
+            f"{concurrency:4d} albums at a time: "
+            f"{result.albums_per_second:10.1f} albums/s "
+            f"{result.tracks_per_second:10.1f} tracks/s"
+        )
+        for index in result.mismatches:
+            print(f"  Wrong tags for {releases[index]['id']} (#{index})")
+        for name, entries in result.leaked.items():
+            print(f"  {entries} entries left in {name}")
+        failed = failed or bool(result.mismatches or result.leaked)
+
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
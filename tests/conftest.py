@@ -1,4 +1,5 @@
 from gettext import gettext
+from sys import modules
 from typing import Any, Callable, Sequence
 
 from PyQt5.QtCore import QObject, pyqtSignal
@@ -10,10 +11,15 @@ from picard.webservice.api_helpers import MBAPIHelper
 from pytest import fixture
 from pytest_mock import MockerFixture
 
+from plugins._support import _support as support_plugin
+
 
 # Inject missing import in album
 album_package._ = gettext
 
+# Plugins import the support library from where Picard loads it
+modules["picard.plugins._support"] = support_plugin
+
 
 class FakeTagger(QObject):
     tagger_stats_changed = pyqtSignal()
@@ -0,0 +1,91 @@
+from io import StringIO
+from json import dumps as json_dumps, loads as json_loads
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from picard.metadata import Metadata
+
+from batch import run_batch, tag_changes
+from harness import Release, make_release
+
+
+def write_releases(tmp_path: Path) -> Tuple[List[Release], Path]:
+    releases: List[Release] = []
+    related_dir = tmp_path / "related"
+    related_dir.mkdir()
+
+    for seed, language in enumerate(("jpn", "eng", "jpn")):
+        release, related = make_release(2, 3, seed=seed, language=language)
+        releases.append(release)
+        for release_id, related_release in related.items():
+            (related_dir / f"{release_id}.json").write_text(
+                json_dumps(related_release), encoding="utf-8"
+            )
+
+    return releases, related_dir
+
+
+def read_lines(output: StringIO) -> List[Dict[str, Any]]:
+    return [json_loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_tag_changes() -> None:
+    before = Metadata(title="Title", album="Album", tracknumber="2")
+    after = Metadata(title="Title", album="Album", titlesort="Sort")
+    after.add("album", "Other")
+
+    assert tag_changes(before, after) == {
+        "album": {"old": ["Album"], "new": ["Album", "Other"]},
+        "titlesort": {"old": [], "new": ["Sort"]},
+        "tracknumber": {"old": ["2"], "new": []},
+    }
+
+
+def test_run_batch(tmp_path: Path) -> None:
+    releases, related_dir = write_releases(tmp_path)
+    source = tmp_path / "releases.jsonl"
+    source.write_text(
+        "".join(f"{json_dumps(release)}\n" for release in releases),
+        encoding="utf-8",
+    )
+
+    output = StringIO()
+    assert run_batch(str(source), output, related_dir) == 3
+    diffs = read_lines(output)
+
+    assert [diff["release"] for diff in diffs[:6]] == [releases[0]["id"]] * 6
+    assert all(
+        diff["changes"]["titlesort"]["new"][0].endswith("(Romaji)")
+        for diff in diffs
+        if diff["release"] != releases[1]["id"]
+    )
+
+    # Same output, in the same order, with a pool of processes
+    pool_output = StringIO()
+    assert run_batch(str(source), pool_output, related_dir, jobs=2) == 3
+    assert read_lines(pool_output) == diffs
+
+
+def test_run_batch_folder(tmp_path: Path) -> None:
+    releases, related_dir = write_releases(tmp_path)
+    releases_dir = tmp_path / "releases"
+    releases_dir.mkdir()
+    for release in releases:
+        (releases_dir / f"{release['id']}.json").write_text(
+            json_dumps(release), encoding="utf-8"
+        )
+    (releases_dir / "invalid.json").write_text("{}", encoding="utf-8")
+
+    output = StringIO()
+    assert run_batch(str(releases_dir), output) == 4
+    diffs = read_lines(output)
+
+    assert {"error": "Invalid release: KeyError('id')"} in diffs
+    # The transliterations are not found without the related releases
+    assert not any(
+        value.endswith("(Romaji)")
+        for diff in diffs
+        for value in diff.get("changes", {})
+        .get("titlesort", {})
+        .get("new", [])
+    )
@@ -0,0 +1,124 @@
+from pathlib import Path
+from typing import Dict
+
+from pytest import MonkeyPatch, raises
+
+import benchmark
+from benchmark import Regression, benchmark_size, find_regressions
+from harness import (
+    load_processors,
+    make_pipeline,
+    make_release,
+    process_release,
+    process_release_pipeline,
+)
+
+
+def test_make_release() -> None:
+    release, related = make_release(10, 20, seed=1, language="jpn")
+
+    assert make_release(10, 20, seed=1, language="jpn") == (release, related)
+    assert make_release(10, 20, seed=2, language="jpn") != (release, related)
+
+    assert len(release["media"]) == 10
+    assert all(len(medium["tracks"]) == 20 for medium in release["media"])
+    assert len(related) == 1
+    assert release["relations"][0]["release"]["id"] in related
+
+
+def test_process_release() -> None:
+    processors = load_processors()
+
+    plugins = {
+        processor.plugin for processor in processors.album + processors.track
+    }
+    assert plugins == {
+        "album_track_swap_sort",
+        "exclude_non_music_tracks",
+        "separate_catalog_numbers",
+        "set_key_from_title_classical",
+        "transliteration_sort",
+    }
+
+    release, related = make_release(3, 5, language="jpn")
+    timings: Dict[str, float] = {}
+    album_metadata, tracks_metadata = process_release(
+        processors, release, related, timings
+    )
+
+    assert album_metadata["albumsort"].endswith("(Romaji)")
+    assert len(tracks_metadata) == 15
+    assert all(
+        metadata["titlesort"].endswith("(Romaji)")
+        for metadata in tracks_metadata
+    )
+    assert set(timings) == {
+        processor.id for processor in processors.album + processors.track
+    }
+
+
+def test_process_release_pipeline() -> None:
+    processors = load_processors()
+
+    for language in ("jpn", "eng"):
+        release, related = make_release(2, 5, language=language)
+        album_metadata, tracks_metadata = process_release(
+            processors, release, related
+        )
+        timings: Dict[str, float] = {}
+        (
+            pipeline_album_metadata,
+            pipeline_tracks_metadata,
+        ) = process_release_pipeline(
+            make_pipeline(processors), release, related, timings
+        )
+
+        assert pipeline_album_metadata == album_metadata
+        assert pipeline_tracks_metadata == tracks_metadata
+        assert list(timings) == ["pipeline"]
+
+
+def test_benchmark_size() -> None:
+    processors = load_processors()
+    timings = benchmark_size(processors, 1, 2, repeat=2)
+
+    assert all(timing >= 0 for timing in timings.values())
+
+    timings = benchmark_size(
+        processors, 1, 2, repeat=2, pipeline=make_pipeline(processors)
+    )
+
+    assert "pipeline" in timings
+    assert timings["processors"] > 0
+
+
+def test_find_regressions() -> None:
+    baseline = {"small": {"a": 1.0, "b": 1.0, "c": 1.0}}
+    results = {"small": {"a": 1.1, "b": 1.5, "c": 1.3, "d": 2.0}}
+
+    assert find_regressions(results, baseline, 0.2, 0.0) == [
+        Regression("small", "b", 1.0, 1.5),
+        Regression("small", "c", 1.0, 1.3),
+    ]
+    assert find_regressions(results, baseline, 0.2, 0.4) == [
+        Regression("small", "b", 1.0, 1.5),
+    ]
+
+
+def test_missing_baseline(monkeypatch: MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(benchmark, "run_benchmarks", lambda *args: {})
+    monkeypatch.delenv("CI", raising=False)
+    argv = ["benchmark.py", "--baseline", str(tmp_path / "baseline.json")]
+
+    monkeypatch.setattr("sys.argv", argv)
+    benchmark.main()
+
+    monkeypatch.setattr("sys.argv", [*argv, "--require-baseline"])
+    with raises(SystemExit) as error:
+        benchmark.main()
+    assert error.value.code == 1
+
+    monkeypatch.setenv("CI", "true")
+    monkeypatch.setattr("sys.argv", argv)
+    with raises(SystemExit):
+        benchmark.main()
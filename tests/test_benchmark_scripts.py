@@ -0,0 +1,34 @@
+from benchmark_scripts import make_tracks, run_benchmarks
+
+
+def test_make_tracks() -> None:
+    tracks = make_tracks(50, seed=1)
+
+    assert make_tracks(50, seed=1) == tracks
+    assert make_tracks(50, seed=2) != tracks
+    assert len(tracks) == 50
+    assert all("title" in track for track in tracks)
+
+
+def test_run_benchmarks() -> None:
+    results = run_benchmarks(
+        ["typographic_apostrophes", "unset_sort_field_if_same"], 20
+    )
+
+    assert set(results) == {
+        "typographic_apostrophes",
+        "unset_sort_field_if_same",
+    }
+    typographic_apostrophes = results["typographic_apostrophes"]
+    assert typographic_apostrophes.seconds > 0
+    assert typographic_apostrophes.functions["set"].calls == 60
+    assert typographic_apostrophes.functions["replacemany"].calls == 60
+    assert "if" not in typographic_apostrophes.functions
+
+    unset_sort_field_if_same = results["unset_sort_field_if_same"]
+    assert unset_sort_field_if_same.functions["if"].calls == 60
+    assert unset_sort_field_if_same.functions["eq"].calls == 60
+    assert all(
+        timings.seconds >= 0
+        for timings in unset_sort_field_if_same.functions.values()
+    )
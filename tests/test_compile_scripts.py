@@ -0,0 +1,202 @@
+from ast import ImportFrom, parse
+from random import Random
+from sys import modules
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+from picard.album import Album
+from picard.metadata import Metadata
+from picard.script import ScriptParser
+from pytest import mark, raises
+from pytest_mock import MockerFixture
+
+from compile_scripts import UnsupportedScript, can_fuse, compile_script
+from lib import SCRIPT_DIR, Script
+from plugins._support._support import Pipeline, TrackContext
+
+
+COMPILED_SCRIPTS = (
+    "convert_triple_dot_to_ellipsis",
+    "french_spaces",
+    "typographic_apostrophes",
+)
+
+SAMPLES: List[Dict[str, object]] = [
+    {"title": "Qu'est-ce que c'est ?", "album": "J'ai l'amour"},
+    {"title": "L'été... indien", "work": "Y'a d'la joie !"},
+    {"title": "Rock'n'roll's... not dead", "album": "It's ok", "work": ""},
+    {"title": "<< Hello >> : world ; yes ! no ?", "album": "« Bon »"},
+    {"title": ["j'y vais", "l'an 2000..."], "album": "....."},
+    {"title": "Plain title"},
+    {"artist": "No title at all"},
+    {"title": "...", "album": "'s", "work": " ? ! : ;"},
+]
+
+LANGUAGES = ("fra", "eng", None)
+
+
+def load_plugin(
+    mocker: MockerFixture,
+    script: Script,
+) -> Callable[..., None]:
+    register = mocker.patch.object(
+        modules["picard.plugins._support"],
+        "register_track_metadata_processor",
+    )
+    module = ModuleType("compiled_plugin")
+    exec(compile_script(script, "test"), module.__dict__)  # noqa: S102
+    register.assert_called_once()
+    processor: Callable[..., None] = register.call_args[0][0]
+    return processor
+
+
+def make_metadata(
+    sample: Dict[str, object],
+    language: Optional[str],
+) -> Metadata:
+    metadata = Metadata(sample)
+    if language:
+        metadata["~releaselanguage"] = language
+    return metadata
+
+
+def assert_equivalent(
+    mocker: MockerFixture,
+    script: Script,
+    metadata: Metadata,
+) -> None:
+    expected = Metadata(metadata)
+    ScriptParser().eval(script.source, expected)
+
+    processor = load_plugin(mocker, script)
+    processor(None, metadata, {}, {})
+
+    assert dict(metadata.rawitems()) == dict(expected.rawitems())
+
+
+@mark.parametrize("name", COMPILED_SCRIPTS)
+@mark.parametrize("sample", SAMPLES)
+@mark.parametrize("language", LANGUAGES)
+def test_compiled_script(
+    mocker: MockerFixture,
+    name: str,
+    sample: Dict[str, object],
+    language: Optional[str],
+) -> None:
+    script = Script.load(SCRIPT_DIR / f"{name}.ptsp")
+    assert_equivalent(mocker, script, make_metadata(sample, language))
+
+
+def test_compiled_script_random(mocker: MockerFixture) -> None:
+    random = Random(0)
+    alphabet = "jJlLyYs'.« »<>?!:; a"
+
+    for name in COMPILED_SCRIPTS:
+        script = Script.load(SCRIPT_DIR / f"{name}.ptsp")
+        for _ in range(200):
+            title = "".join(random.choices(alphabet, k=random.randint(0, 12)))
+            assert_equivalent(
+                mocker, script, make_metadata({"title": title}, "fra")
+            )
+
+
+def test_compiled_script_pipeline(mocker: MockerFixture) -> None:
+    script = Script.load(SCRIPT_DIR / "typographic_apostrophes.ptsp")
+    titles: List[str] = []
+
+    def read_title(*args: Any) -> None:
+        context: TrackContext = args[4]
+        titles.append(context.get("title"))
+
+    pipeline = Pipeline(enabled_plugins=())
+    pipeline.add_track_processor(read_title, 0)
+    pipeline.add_track_processor(load_plugin(mocker, script), 0)
+    pipeline.add_track_processor(read_title, 0)
+
+    metadata = Metadata(title="l'été", album="'s")
+    expected = Metadata(metadata)
+    ScriptParser().eval(script.source, expected)
+    pipeline.run_track(Album("id"), metadata, {}, {})
+
+    assert dict(metadata.rawitems()) == dict(expected.rawitems())
+    # The later processors see the tags changed by the script
+    assert titles == ["l'été", "l’été"]
+
+
+def test_compiled_script_imports() -> None:
+    source = compile_script(Script.load(SCRIPT_DIR / "french_spaces.ptsp"), "")
+
+    # Only imported for type checking, it is slow to import
+    assert "picard.album" not in {
+        node.module
+        for node in parse(source).body
+        if isinstance(node, ImportFrom)
+    }
+
+
+def test_compile_overlapping_patterns(mocker: MockerFixture) -> None:
+    script = Script(
+        script_id="",
+        title="Overlapping",
+        source=(
+            "$set(title,$replace(%title%,bc,x))\n"
+            "$set(title,$replace(%title%,ab,y))\n"
+            "$set(title,$replace(%title%,xd,z))\n"
+        ),
+    )
+
+    assert "text.replace(" in compile_script(script, "test")
+    for title in ("abcd", "abc", "bcd", "ab", "xd"):
+        assert_equivalent(mocker, script, Metadata(title=title))
+
+
+@mark.parametrize(
+    "source",
+    [
+        # A later pattern containing an earlier replacement
+        "$set(title,$replace(%title%,q,X))\n"
+        "$set(title,$replace(%title%,aXb,Z))",
+        # A later pattern matching around an earlier deletion
+        "$set(title,$replace(%title%,q,))\n"
+        "$set(title,$replace(%title%,ab,Z))",
+    ],
+)
+def test_compile_patterns_across_replacement(
+    mocker: MockerFixture, source: str
+) -> None:
+    script = Script(script_id="", title="Across", source=source)
+
+    for title in ("aqb", "aXb", "ab", "q"):
+        assert_equivalent(mocker, script, Metadata(title=title))
+
+
+def test_can_fuse() -> None:
+    assert can_fuse((("j'", "j’"), ("l'", "l’"), ("'s", "’s")))
+    # A later pattern overlapping an earlier one from the left
+    assert not can_fuse((("bc", "x"), ("ab", "y")))
+    # A later pattern matching an earlier replacement
+    assert not can_fuse((("a", "b"), ("b", "c")))
+    # A later pattern containing an earlier one
+    assert not can_fuse((("b", "x"), ("abc", "y")))
+    # A later pattern containing an earlier replacement
+    assert not can_fuse((("q", "X"), ("aXb", "Z")))
+    # A later pattern matching around an earlier deletion
+    assert not can_fuse((("q", ""), ("ab", "Z")))
+    assert can_fuse((("q", ""), ("a", "Z")))
+    assert not can_fuse((("", "x"),))
+
+
+@mark.parametrize(
+    "source",
+    [
+        "$set(title,%album%)",
+        "$set(title,$replace(%album%,a,b))",
+        "$delete(title)",
+        "$if(%title%,$set(title,$replace(%title%,a,b)))",
+        "$if(%x%,$set(title,$replace(%title%,a,b)),)",
+        "$set(title,$replacemany(%title%,a,b,b,c))",
+    ],
+)
+def test_compile_unsupported(source: str) -> None:
+    with raises(UnsupportedScript):
+        compile_script(Script("", "Unsupported", source), "test")
@@ -5,6 +5,7 @@ from picard.album import Album
 from picard.metadata import Metadata
 from pytest import fixture
 
+from plugins._support._support import remove_album_states
 from plugins.exclude_non_music_tracks.exclude_non_music_tracks import (
     ExcludeNonMusicTracks,
 )
@@ -133,3 +134,9 @@ def test_exclude_non_music_tracks(
     assert metadata["totaldiscs"] == "1"
     assert metadata["tracknumber"] == "1"
     assert metadata["totaltracks"] == "1"
+    assert album in plugin.media_to_skip
+
+    remove_album_states(album)
+
+    assert album not in plugin.media_to_skip
+    assert album not in plugin.non_music_tracks
@@ -1,10 +1,35 @@
-from json import load as json_load
+from gzip import open as gzip_open
+from hashlib import sha256
+from json import dumps, load as json_load, loads as json_loads
 from pathlib import Path
+from re import fullmatch
+from subprocess import run  # noqa: S404
+from sys import executable
+from threading import Event, Thread
+from typing import Dict, List, Set, Tuple
 
-from pytest import fixture
+from pytest import MonkeyPatch, TempPathFactory, fixture, mark, raises
 
-from generate import build_json, zip_files
-from lib import get_plugin_dirs
+from generate import (
+    INDEX_FILE,
+    SCRIPTS_FILE,
+    build_json,
+    build_scripts_json,
+    update_json,
+    zip_files,
+)
+import lib
+from lib import (
+    PluginTree,
+    get_plugin_dirs,
+    get_plugin_tree,
+    get_script_paths,
+    watch_plugin_dirs,
+)
+
+
+# Seconds to wait for the watcher before failing
+WATCH_TIMEOUT = 10
 
 
 @fixture
@@ -21,6 +46,47 @@ def test_get_plugin_dirs() -> None:
     assert len(get_plugin_dirs()) > 1
 
 
+def test_plugin_tree(tmp_path: Path) -> None:
+    single = tmp_path / "single"
+    (single / "__pycache__").mkdir(parents=True)
+    (single / "single.py").write_text("# Single")
+    (single / "__pycache__" / "single.cpython-36.pyc").touch()
+    package = tmp_path / "package"
+    (package / "data").mkdir(parents=True)
+    (package / "__init__.py").touch()
+    (package / "module.py").touch()
+    (package / "data" / "file.txt").write_text("Data")
+    (tmp_path / "__pycache__").mkdir()
+    (tmp_path / ".hidden").mkdir()
+
+    tree = PluginTree(tmp_path)
+
+    assert [plugin.name for plugin in tree] == ["package", "single"]
+
+    plugin = tree.get("single")
+    assert plugin is not None
+    assert plugin.is_single_file
+    assert not plugin.is_package
+    assert [file.name for file in plugin.files] == ["single.py"]
+    assert plugin.size == len("# Single")
+
+    plugin = tree.get("package")
+    assert plugin is not None
+    assert not plugin.is_single_file
+    assert plugin.is_package
+    assert [file.name for file in plugin.files] == [
+        "__init__.py",
+        "data/file.txt",
+        "module.py",
+    ]
+    assert [file.name for file in plugin.python_files] == [
+        "__init__.py",
+        "module.py",
+    ]
+
+    assert tree.get("missing") is None
+
+
 def test_build_json(dest_dir: Path, json_file: Path) -> None:
     build_json(dest_dir)
 
@@ -53,3 +119,240 @@ def test_generate_zip(dest_dir: Path) -> None:
 
     # Number of folders should be equal to number of zips
     assert len(plugin_zips) == len(plugin_dirs)
+
+
+def test_generate_zip_content_addressed(
+    dest_dir: Path, json_file: Path
+) -> None:
+    archives: Dict[str, str] = {}
+    zip_files(dest_dir, archives)
+
+    assert archives.keys() == {plugin.name for plugin in get_plugin_tree()}
+    for name, archive in archives.items():
+        assert fullmatch(rf"{name}-[0-9a-f]{{16}}\.zip", archive)
+        assert (dest_dir / archive).is_file()
+    assert not (dest_dir / "_support.zip").exists()
+
+    # Unchanged plugins get the same archives, which are not rewritten
+    mtimes = {path: path.stat().st_mtime_ns for path in dest_dir.glob("*.zip")}
+    rebuilt: Dict[str, str] = {}
+    zip_files(dest_dir, rebuilt)
+
+    assert rebuilt == archives
+    assert {
+        path: path.stat().st_mtime_ns for path in dest_dir.glob("*.zip")
+    } == mtimes
+
+    build_json(dest_dir, archives=archives)
+
+    with json_file.open("r", encoding="utf-8") as f:
+        plugins = json_load(f)["plugins"]
+
+    for name, data in plugins.items():
+        assert data["archive"] == archives[name]
+
+
+def test_build_json_with_archives(
+    monkeypatch: MonkeyPatch, tmp_path_factory: TempPathFactory
+) -> None:
+    separate = tmp_path_factory.mktemp("separate")
+    archives: Dict[str, str] = {}
+    zip_files(separate, archives)
+    build_json(separate, archives=archives)
+
+    def fail(*_args: object) -> None:
+        raise AssertionError("The files are hashed separately")
+
+    # The files are hashed while they are zipped
+    monkeypatch.setattr("generate.md5", fail)
+    combined = tmp_path_factory.mktemp("combined")
+    combined_archives: Dict[str, str] = {}
+    build_json(combined, archives=combined_archives, zip_archives=True)
+
+    assert combined_archives == archives
+    assert (combined / "plugins.json").read_text() == (
+        separate / "plugins.json"
+    ).read_text()
+    assert sorted(path.name for path in combined.glob("*.zip")) == sorted(
+        path.name for path in separate.glob("*.zip")
+    )
+
+
+def test_build_json_sharded(dest_dir: Path, json_file: Path) -> None:
+    build_json(dest_dir, sharded=True)
+
+    with json_file.open("r", encoding="utf-8") as f:
+        plugins = json_load(f)["plugins"]
+
+    with (dest_dir / INDEX_FILE).open("r", encoding="utf-8") as f:
+        index = json_load(f)["plugins"]
+
+    assert index.keys() == plugins.keys()
+
+    for module_name, entry in index.items():
+        assert entry["version"] == plugins[module_name]["version"]
+
+        shard = dest_dir / entry["shard"]
+        data = shard.read_bytes()
+        assert sha256(data).hexdigest() == entry["sha256"]
+        assert json_loads(data) == plugins[module_name]
+
+        with gzip_open(f"{shard}.gz", "rb") as gz_file:
+            assert gz_file.read() == data
+
+    # Compressed files are reproducible
+    gz_data = (dest_dir / f"{INDEX_FILE}.gz").read_bytes()
+    build_json(dest_dir, sharded=True)
+    assert (dest_dir / f"{INDEX_FILE}.gz").read_bytes() == gz_data
+
+
+def test_update_json(
+    dest_dir: Path,
+    json_file: Path,
+    tmp_path_factory: TempPathFactory,
+) -> None:
+    build_json(dest_dir)
+
+    plugin_dir = tmp_path_factory.mktemp("plugins") / "test"
+    plugin_dir.mkdir()
+    (plugin_dir / "test.py").write_text('PLUGIN_NAME = "Test"\n')
+
+    update_json(dest_dir, [plugin_dir])
+
+    with json_file.open("r", encoding="utf-8") as f:
+        plugins = json_load(f)["plugins"]
+
+    assert plugins["test"]["name"] == "Test"
+    assert len(plugins) == len(get_plugin_dirs()) + 1
+
+    (plugin_dir / "test.py").unlink()
+    plugin_dir.rmdir()
+
+    update_json(dest_dir, [plugin_dir])
+
+    with json_file.open("r", encoding="utf-8") as f:
+        plugins = json_load(f)["plugins"]
+
+    assert "test" not in plugins
+    assert len(plugins) == len(get_plugin_dirs())
+
+
+def test_build_scripts_json(dest_dir: Path) -> None:
+    scripts_file = dest_dir / SCRIPTS_FILE
+
+    build_scripts_json(dest_dir, compress=True)
+
+    with open(scripts_file, "r", encoding="utf-8") as in_file:
+        scripts = json_load(in_file)["scripts"]
+    with gzip_open(f"{scripts_file}.gz", "rt", encoding="utf-8") as in_file:
+        assert json_load(in_file)["scripts"] == scripts
+
+    assert set(scripts) == {path.stem for path in get_script_paths()}
+    french_spaces = scripts["french_spaces"]
+    assert french_spaces["id"] == "6899b9d2-2531-439e-94b7-220557011887"
+    assert french_spaces["title"] == "French spaces"
+    assert french_spaces["script_language_version"] == "1.1"
+    assert french_spaces["script"].startswith("$noop(Requires the")
+    assert french_spaces["script"].endswith(")")
+    assert (
+        french_spaces["sha256"]
+        == sha256(
+            (lib.SCRIPT_DIR / "french_spaces.ptsp").read_bytes()
+        ).hexdigest()
+    )
+
+    # Unchanged scripts are taken from the previous bundle
+    scripts["french_spaces"]["title"] = "Cached"
+    scripts["typographic_apostrophes"]["sha256"] = "outdated"
+    scripts_file.write_text(
+        dumps({"scripts": scripts}, ensure_ascii=False), encoding="utf-8"
+    )
+
+    build_scripts_json(dest_dir)
+
+    with open(scripts_file, "r", encoding="utf-8") as in_file:
+        scripts = json_load(in_file)["scripts"]
+
+    assert scripts["french_spaces"]["title"] == "Cached"
+    assert scripts["typographic_apostrophes"]["sha256"] != "outdated"
+
+
+@mark.parametrize(
+    "content",
+    [
+        'title: Invalid\nscript: "$set(title"\nid: invalid\n',
+        'title: Unknown\nscript: "$unknown(title)"\nid: unknown\n',
+        "title: Missing ID\nscript: $noop()\n",
+    ],
+)
+def test_build_scripts_json_invalid(
+    monkeypatch: MonkeyPatch, tmp_path: Path, content: str
+) -> None:
+    script_dir = tmp_path / "scripts"
+    script_dir.mkdir()
+    (script_dir / "invalid.ptsp").write_text(content, encoding="utf-8")
+    monkeypatch.setattr(lib, "SCRIPT_DIR", script_dir)
+
+    with raises(SystemExit):
+        build_scripts_json(tmp_path)
+
+    assert not (tmp_path / SCRIPTS_FILE).exists()
+
+
+@mark.parametrize("polling", [False, True])
+def test_watch_plugin_dirs(
+    polling: bool,
+    tmp_path: Path,
+    monkeypatch: MonkeyPatch,
+) -> None:
+    plugin_dir = tmp_path / "test"
+    plugin_dir.mkdir()
+    (plugin_dir / "test.py").touch()
+    (tmp_path / "other").mkdir()
+    (tmp_path / "README.md").touch()
+    monkeypatch.setattr(lib, "PLUGIN_DIR", tmp_path)
+
+    # Set once the watcher took its first snapshot or added its watches
+    ready = Event()
+    snapshot = lib._snapshot
+    inotify_init = lib._Inotify.__init__
+
+    def ready_snapshot() -> Dict[Path, Tuple[int, int]]:
+        result = snapshot()
+        ready.set()
+        return result
+
+    def ready_inotify_init(self: lib._Inotify, root: Path) -> None:
+        inotify_init(self, root)
+        ready.set()
+
+    monkeypatch.setattr(lib, "_snapshot", ready_snapshot)
+    monkeypatch.setattr(lib._Inotify, "__init__", ready_inotify_init)
+
+    changes = watch_plugin_dirs(poll_interval=0.05, polling=polling)
+    changed: List[Set[Path]] = []
+    # Daemon thread, so that a missed change fails instead of hanging
+    thread = Thread(target=lambda: changed.append(next(changes)), daemon=True)
+    thread.start()
+    assert ready.wait(WATCH_TIMEOUT)
+
+    # A deleted file at the top level is not a plugin
+    (tmp_path / "README.md").unlink()
+    (plugin_dir / "test.py").write_text("# Changed")
+
+    thread.join(WATCH_TIMEOUT)
+    assert changed == [{plugin_dir}]
+    changes.close()
+
+
+def test_generate_without_picard() -> None:
+    # Picard is only needed to build the tagging scripts
+    run(  # noqa: S603
+        [
+            executable,
+            "-c",
+            "import sys, generate; assert 'picard' not in sys.modules",
+        ],
+        cwd=str(Path(__file__).parent.parent),
+        check=True,
+    )
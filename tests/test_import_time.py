@@ -0,0 +1,94 @@
+from json import loads as json_loads
+from pathlib import Path
+from subprocess import PIPE, run  # noqa: S404
+from sys import executable
+from typing import Any, Dict, List
+
+from pytest import mark
+
+from lib import get_plugin_tree
+
+
+# Modules loaded by Picard before the plugins
+PICARD_MODULES = (
+    "picard.config",
+    "picard.log",
+    "picard.metadata",
+    "picard.plugin",
+    "picard.script",
+)
+
+# Modules the plugins must not import when they are loaded
+SLOW_MODULES = ("PyQt5.QtNetwork", "picard.album", "picard.tagger")
+
+# A plugin must load faster than this module, measured in the same
+# interpreter rather than against a fixed time so slow runners do not fail
+BASELINE_MODULE = "picard.album"
+
+MEASURE_IMPORT = """
+from importlib import import_module
+from json import dumps
+from sys import argv, modules
+from time import perf_counter
+
+for name in argv[1].split(","):
+    import_module(name)
+
+if argv[2] != "_support":
+    # Loaded by Picard before the other plugins
+    support = import_module("plugins._support._support")
+    modules["picard.plugins._support"] = support
+baseline = set(modules)
+
+start = perf_counter()
+import_module(f"plugins.{argv[2]}.{argv[2]}")
+seconds = perf_counter() - start
+loaded = sorted(set(modules) - baseline)
+
+start = perf_counter()
+import_module(argv[3])
+baseline_seconds = perf_counter() - start
+
+print(
+    dumps(
+        {
+            "seconds": seconds,
+            "modules": loaded,
+            "baseline_seconds": baseline_seconds,
+        }
+    )
+)
+"""
+
+
+def plugin_names() -> List[str]:
+    return [plugin.name for plugin in get_plugin_tree() if plugin.python_files]
+
+
+def measure_import(*modules: str, plugin: str) -> Dict[str, Any]:
+    result = run(  # noqa: S603
+        [
+            executable,
+            "-c",
+            MEASURE_IMPORT,
+            ",".join(modules),
+            plugin,
+            BASELINE_MODULE,
+        ],
+        cwd=str(Path(__file__).parent.parent),
+        stdout=PIPE,
+        stderr=PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    measure: Dict[str, Any] = json_loads(result.stdout.splitlines()[-1])
+    return measure
+
+
+@mark.parametrize("plugin", plugin_names())
+def test_import_time(plugin: str) -> None:
+    # Import each plugin in a fresh interpreter, like Picard does on startup
+    result = measure_import(*PICARD_MODULES, plugin=plugin)
+
+    assert not set(result["modules"]) & set(SLOW_MODULES)
+    assert result["seconds"] < result["baseline_seconds"]
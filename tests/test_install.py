@@ -1,8 +1,32 @@
+from json import load as json_load
 from pathlib import Path
+from subprocess import run  # noqa: S404
+from sys import executable
+from typing import Any, Dict
+from zipfile import ZipFile
 
 from pytest import MonkeyPatch, TempPathFactory
 
-from install import create_symlink, get_picard_user_plugin_dir, path_from_env
+from generate import PLUGIN_FILE, build_json, zip_files
+from install import (
+    apply_patch,
+    create_symlink,
+    get_picard_user_plugin_dir,
+    install_from_build,
+    install_plugin,
+    install_plugins,
+    is_loadable_package,
+    link_archive,
+    path_from_env,
+    read_plugin_dirs,
+)
+from lib import (
+    PluginTree,
+    archive_digest,
+    archive_files,
+    create_zip,
+    scan_plugin,
+)
 
 
 def test_get_picard_user_plugin_dir() -> None:
@@ -36,3 +60,207 @@ def test_create_symlink(tmp_path_factory: TempPathFactory) -> None:
 
     assert symlink.is_symlink()
     assert symlink.exists()
+
+
+def test_install_package_dev(tmp_path_factory: TempPathFactory) -> None:
+    source = tmp_path_factory.mktemp("source")
+    target = tmp_path_factory.mktemp("target")
+
+    plugin_dir = source / "package"
+    plugin_dir.mkdir()
+    (plugin_dir / "__init__.py").write_text("PLUGIN_NAME = 'Package'\n")
+    (plugin_dir / "module.py").touch()
+    plugin = scan_plugin(plugin_dir)
+    # A copy of the plugin installed by hand
+    (target / "package").mkdir()
+    (target / "package" / "__init__.py").touch()
+
+    assert install_plugin(plugin, target, dev=True)
+
+    symlink = target / "package"
+    assert symlink.is_symlink()
+    assert symlink.resolve() == plugin_dir.resolve()
+    assert is_loadable_package(symlink)
+
+    # Picard would load an archive of the same name instead
+    (target / "package.zip").touch()
+    assert install_plugin(plugin, target, dev=True)
+    assert not (target / "package.zip").exists()
+
+    (plugin_dir / "__init__.py").unlink()
+    assert not is_loadable_package(symlink)
+
+
+def test_create_zip_skips_unchanged(tmp_path_factory: TempPathFactory) -> None:
+    source = tmp_path_factory.mktemp("source")
+    target = tmp_path_factory.mktemp("target")
+
+    plugin_dir = source / "test"
+    plugin_dir.mkdir()
+    file = plugin_dir / "test.py"
+    file.write_text("PLUGIN_NAME = 'Test'\n")
+    plugin = scan_plugin(plugin_dir)
+    # Only the files found by the scan are archived
+    (plugin_dir / "new.py").write_text("")
+
+    assert create_zip(plugin, target, single_file=True)
+    with ZipFile(target / "test.zip") as zip_file:
+        assert zip_file.namelist() == ["test.py"]
+    (plugin_dir / "new.py").unlink()
+    archive = target / "test.zip"
+    digest = archive_digest(archive)
+    inode = archive.stat().st_ino
+
+    assert not create_zip(scan_plugin(plugin_dir), target, single_file=True)
+    assert archive.stat().st_ino == inode
+    assert archive_digest(archive) == digest
+
+    file.write_text("PLUGIN_NAME = 'Changed'\n")
+
+    assert create_zip(scan_plugin(plugin_dir), target, single_file=True)
+    assert archive_digest(archive) != digest
+    # No temporary files are left behind
+    assert [path.name for path in target.iterdir()] == ["test.zip"]
+
+
+def test_install_from_build_patch(
+    monkeypatch: MonkeyPatch, tmp_path_factory: TempPathFactory
+) -> None:
+    source = tmp_path_factory.mktemp("source")
+    build_dir = tmp_path_factory.mktemp("build")
+    target = tmp_path_factory.mktemp("target")
+    monkeypatch.setattr("generate.get_plugin_tree", lambda: PluginTree(source))
+
+    plugin_dir = source / "test"
+    (plugin_dir / "data").mkdir(parents=True)
+    (plugin_dir / "__init__.py").write_text("PLUGIN_NAME = 'Test'\n")
+    (plugin_dir / "module.py").write_text("VALUE = 1\n")
+    (plugin_dir / "data" / "large.bin").write_bytes(bytes(100_000))
+    (plugin_dir / "data" / "old.txt").write_text("Old")
+
+    def build() -> Dict[str, Any]:
+        zip_files(build_dir)
+        build_json(build_dir, deltas=True)
+        with open(build_dir / PLUGIN_FILE, "r", encoding="utf-8") as f:
+            data: Dict[str, Any] = json_load(f)["plugins"]["test"]
+        return data
+
+    data = build()
+    assert "delta" not in data
+
+    install_from_build(build_dir, target)
+    archive = target / "test.zip"
+    assert archive_files(archive, "test") == data["files"]
+    old_archive = archive.read_bytes()
+
+    (plugin_dir / "module.py").write_text("VALUE = 2\n")
+    (plugin_dir / "data" / "new.txt").write_text("New")
+    (plugin_dir / "data" / "old.txt").unlink()
+
+    data = build()
+    delta = data["delta"]
+    assert delta["changed"] == ["data/new.txt", "module.py"]
+    assert delta["removed"] == ["data/old.txt"]
+
+    # The patch only contains the changed files
+    patch = build_dir / delta["patch"]
+    with ZipFile(patch) as patch_zip:
+        assert sorted(patch_zip.namelist()) == [
+            "test/data/new.txt",
+            "test/module.py",
+        ]
+    assert patch.stat().st_size < 1000
+
+    install_from_build(build_dir, target)
+    assert archive_files(archive, "test") == data["files"]
+
+    # The patch of the next version does not apply to the first one
+    archive.write_bytes(old_archive)
+    (plugin_dir / "module.py").write_text("VALUE = 3\n")
+    data = build()
+    assert not apply_patch(
+        archive, build_dir / data["delta"]["patch"], "test", data
+    )
+    assert archive.read_bytes() == old_archive
+
+    # A rebuild without changes keeps the delta
+    assert build()["delta"] == data["delta"]
+
+
+def test_install_plugins_to_many(tmp_path_factory: TempPathFactory) -> None:
+    source = tmp_path_factory.mktemp("source")
+    targets = [tmp_path_factory.mktemp(f"target{i}") for i in range(3)]
+
+    single_dir = source / "single"
+    single_dir.mkdir()
+    (single_dir / "single.py").write_text("PLUGIN_NAME = 'Single'\n")
+    package_dir = source / "package"
+    package_dir.mkdir()
+    (package_dir / "__init__.py").write_text("PLUGIN_NAME = 'Package'\n")
+    (package_dir / "module.py").touch()
+    plugins = [scan_plugin(single_dir), scan_plugin(package_dir)]
+
+    assert install_plugins(plugins, targets, dev=False)
+
+    for name in ("single.zip", "package.zip"):
+        inodes = {(target / name).stat().st_ino for target in targets}
+        # Built once and hardlinked to the other folders
+        assert len(inodes) == 1
+
+    assert install_plugins(plugins, targets, dev=True)
+
+    for target in targets:
+        assert (target / "single.py").is_symlink()
+        assert (target / "package").is_symlink()
+        # Picard would load the archives instead of the symlinks
+        assert not (target / "single.zip").exists()
+        assert not (target / "package.zip").exists()
+
+
+def test_link_archive_copy(
+    monkeypatch: MonkeyPatch, tmp_path_factory: TempPathFactory
+) -> None:
+    source = tmp_path_factory.mktemp("source")
+    target = tmp_path_factory.mktemp("target")
+    plugin_dir = source / "test"
+    plugin_dir.mkdir()
+    (plugin_dir / "test.py").write_text("PLUGIN_NAME = 'Test'\n")
+    create_zip(scan_plugin(plugin_dir), source, single_file=True)
+    archive = source / "test.zip"
+    digest = archive_digest(archive)
+
+    def fail(*_args: object) -> None:
+        raise OSError("Invalid cross-device link")
+
+    # Copy when the folders are on different filesystems
+    monkeypatch.setattr("install.link", fail)
+    monkeypatch.setattr("install._reflink", lambda *_args: False)
+
+    assert link_archive(archive, target, digest)
+    assert archive_digest(target / "test.zip") == digest
+    assert (target / "test.zip").stat().st_ino != archive.stat().st_ino
+
+    assert not link_archive(archive, target, digest)
+
+
+def test_read_plugin_dirs(tmp_path: Path) -> None:
+    path = tmp_path / "targets.txt"
+    path.write_text("# Profiles\n/srv/a/plugins\n\n  /srv/b/plugins  \n")
+
+    assert read_plugin_dirs(path) == [
+        Path("/srv/a/plugins"),
+        Path("/srv/b/plugins"),
+    ]
+
+
+def test_install_without_picard() -> None:
+    # The installer runs outside of Picard's environment
+    run(  # noqa: S603
+        [
+            executable,
+            "-c",
+            "import sys, install; assert 'picard' not in sys.modules",
+        ],
+        cwd=str(Path(__file__).parent.parent),
+        check=True,
+    )
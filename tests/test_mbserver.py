@@ -0,0 +1,133 @@
+from json import loads as json_loads
+from typing import Any, Dict, Iterator, Tuple
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from PyQt5.QtCore import QObject
+from picard import config
+from picard.album import AlbumStatus
+from pytest import MonkeyPatch, fixture, raises
+
+from harness import Processors, Release, load_processors
+from mbserver import (
+    FakeMusicBrainz,
+    ServiceSettings,
+    _Tagger,
+    connect_picard,
+    load_albums,
+    make_releases,
+    percentiles,
+    without_plugin,
+)
+
+
+@fixture
+def picard(monkeypatch: MonkeyPatch) -> Iterator[None]:
+    # Restore the Picard settings and tagger changed by connect_picard
+    monkeypatch.setattr(config, "config", None)
+    monkeypatch.setattr(QObject, "tagger", _Tagger(), raising=False)
+    yield
+
+
+@fixture(scope="module")
+def processors() -> Processors:
+    return load_processors()
+
+
+def make_release() -> Tuple[Release, Dict[str, Release]]:
+    releases, release_ids = make_releases(1, 2, 3, "jpn")
+    return releases[release_ids[0]], releases
+
+
+def get(server: FakeMusicBrainz, release_id: str) -> Dict[str, Any]:
+    url = f"http://{server.host}:{server.port}/ws/2/release/{release_id}"
+    with urlopen(f"{url}?inc=recordings&fmt=json") as response:  # noqa: S310
+        document: Dict[str, Any] = json_loads(response.read())
+    return document
+
+
+def test_fake_musicbrainz() -> None:
+    release, releases = make_release()
+
+    with FakeMusicBrainz(releases.get) as server:
+        assert get(server, release["id"]) == release
+        with raises(HTTPError) as error:
+            get(server, "00000000-0000-0000-0000-000000000000")
+        assert error.value.code == 404
+
+    with FakeMusicBrainz(
+        releases.get, ServiceSettings(error_rate=1.0)
+    ) as server:
+        with raises(HTTPError) as error:
+            get(server, release["id"])
+        assert error.value.code == 500
+
+    with FakeMusicBrainz(
+        releases.get, ServiceSettings(rate_limit=0.001)
+    ) as server:
+        assert get(server, release["id"]) == release
+        with raises(HTTPError) as error:
+            get(server, release["id"])
+        assert error.value.code == 503
+        assert server.requests == 2
+        assert server.throttled == 1
+
+
+def test_load_albums(picard: None, processors: Processors) -> None:
+    release, releases = make_release()
+
+    with FakeMusicBrainz(releases.get) as server:
+        loads = load_albums(
+            connect_picard(server), [release["id"]], processors
+        )
+        # The release and its transliteration
+        assert server.requests == 2
+
+    album = loads[0].album
+    assert album.errors == []
+    assert album.status == AlbumStatus.LOADED
+    assert album._requests == 0
+    assert loads[0].latency > 0
+    assert album.metadata["album"] == release["title"]
+    assert len(album.tracks) == 6
+    assert all(
+        track.metadata["titlesort"].endswith("(Romaji)")
+        for track in album.tracks
+    )
+
+    with FakeMusicBrainz(releases.get) as server:
+        loads = load_albums(
+            connect_picard(server),
+            [release["id"]],
+            without_plugin(processors, "transliteration_sort"),
+        )
+        assert server.requests == 1
+
+    assert len(loads[0].album.tracks) == 6
+    assert not any(
+        track.metadata["titlesort"].endswith("(Romaji)")
+        for track in loads[0].album.tracks
+    )
+
+
+def test_load_albums_error(picard: None, processors: Processors) -> None:
+    release, releases = make_release()
+
+    with FakeMusicBrainz(
+        releases.get, ServiceSettings(error_rate=1.0)
+    ) as server:
+        loads = load_albums(
+            connect_picard(server), [release["id"]], processors
+        )
+
+    assert loads[0].album.errors
+    assert loads[0].album.status == AlbumStatus.ERROR
+    assert loads[0].album.tracks == []
+
+
+def test_percentiles() -> None:
+    values = [float(value) for value in range(100, 0, -1)]
+
+    assert percentiles(values) == {50: 50.0, 90: 90.0, 99: 99.0}
+    assert percentiles([1.0], (0, 100)) == {0: 1.0, 100: 1.0}
+    assert percentiles([]) == {}
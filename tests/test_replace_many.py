@@ -0,0 +1,49 @@
+from typing import Tuple
+
+from picard.metadata import Metadata
+from picard.script import ScriptParser
+from pytest import mark
+
+from plugins.replace_many.replace_many import (
+    compile_replacements,
+    replace_many,
+)
+
+
+@mark.parametrize(
+    "text,replacements,expected",
+    [
+        ("l'été", ("l'", "l’"), "l’été"),
+        ("j'ai l'air", ("j'", "j’", "l'", "l’"), "j’ai l’air"),
+        # The replaced text is not searched again
+        ("ab", ("a", "b", "b", "c"), "bc"),
+        # The first search string found at a position wins
+        ("abc", ("ab", "x", "abc", "y"), "xc"),
+        ("abc", ("b", "x", "b", "y"), "axc"),
+        # Empty search strings are ignored
+        ("abc", ("", "x", "c", "z"), "abz"),
+        ("abc", ("", "x"), "abc"),
+        # A search string without replacement is ignored
+        ("abc", ("a", "x", "b"), "xbc"),
+        ("a.c", (".", "-"), "a-c"),
+    ],
+)
+def test_replace_many(
+    text: str, replacements: Tuple[str, ...], expected: str
+) -> None:
+    assert replace_many(None, text, *replacements) == expected
+
+
+def test_compile_replacements_cache() -> None:
+    pattern, mapping = compile_replacements(("a", "b", "c", "d"))
+
+    assert compile_replacements(("a", "b", "c", "d"))[0] is pattern
+    assert mapping == {"a": "b", "c": "d"}
+
+
+def test_replacemany_script_function(parser: ScriptParser) -> None:
+    metadata = Metadata({"title": "Qu'est-ce que c'est... l'été ?"})
+
+    parser.eval(r"$set(title,$replacemany(%title%,',’,...,…))", metadata)
+
+    assert metadata["title"] == "Qu’est-ce que c’est… l’été ?"
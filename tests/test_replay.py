@@ -0,0 +1,55 @@
+from pathlib import Path
+from typing import Iterable, List
+
+from harness import Release, make_release
+from replay import RELATED_DIR, RELEASES_DIR, CorpusReleases, record, replay
+
+
+def test_record(tmp_path: Path) -> None:
+    release, related = make_release(2, 3, language="jpn")
+    releases = {release["id"]: release, **related}
+    requests: List[str] = []
+
+    def fetch(release_id: str, _includes: Iterable[str]) -> Release:
+        requests.append(release_id)
+        return releases[release_id]
+
+    record(tmp_path, [release["id"]], fetch, interval=0)
+    # Releases already in the corpus are not downloaded again
+    record(tmp_path, [release["id"]], fetch, interval=0)
+
+    assert requests == [release["id"], *related]
+    assert (tmp_path / RELEASES_DIR / f"{release['id']}.json").is_file()
+    assert dict(CorpusReleases(tmp_path / RELATED_DIR)) == related
+
+
+def test_replay(tmp_path: Path) -> None:
+    album_ids: List[str] = []
+    releases = {}
+    for language in ("eng", "jpn"):
+        release, related = make_release(2, 3, language=language)
+        album_ids.append(release["id"])
+        releases[release["id"]] = release
+        releases.update(related)
+
+    record(
+        tmp_path,
+        album_ids,
+        lambda release_id, _includes: releases[release_id],
+        interval=0,
+    )
+
+    results = replay(tmp_path, repeat=2)
+
+    assert set(results) == {
+        "album_track_swap_sort",
+        "exclude_non_music_tracks",
+        "separate_catalog_numbers",
+        "set_key_from_title_classical",
+        "transliteration_sort",
+    }
+    for throughput in results.values():
+        assert throughput.albums == 4
+        assert throughput.tracks == 24
+        assert throughput.albums_per_second > 0
+        assert throughput.tracks_per_second > 0
@@ -81,3 +81,24 @@ def test_separate_catalog_numbers(album: Album) -> None:
     assert metadata["totaldiscs"] == "2"
     assert metadata["title"] == "Test Title"
     assert metadata["album"] == "Test Album"
+
+
+def test_separate_catalog_numbers_uncounted_disc(album: Album) -> None:
+    # A medium excluded from the disc count, e.g. by exclude_non_music_tracks
+    metadata = Metadata(
+        {
+            "label": "Test Label",
+            "catalognumber": "ABCD-1001~1002",
+            "discnumber": 3,
+            "totaldiscs": 2,
+            "title": "Test Title",
+            "album": "Test Album",
+        }
+    )
+    track: Dict[str, Any] = {}
+    release: Dict[str, Any] = {}
+
+    separate_catalog_numbers(album, metadata, track, release)
+
+    assert metadata["catalognumber"] == "ABCD-1001~1002"
+    assert metadata["discnumber"] == "3"
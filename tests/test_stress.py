@@ -0,0 +1,48 @@
+from typing import Any, Dict
+
+from picard.metadata import Metadata
+from pytest import mark
+
+from harness import Processor, Processors, load_processors
+from stress import make_albums, run_stress
+
+
+@mark.parametrize("concurrency", [1, 8, 64])
+def test_run_stress(concurrency: int) -> None:
+    releases, related = make_albums(40, seed=1)
+
+    result = run_stress(
+        load_processors(), releases, related, concurrency, seed=concurrency
+    )
+
+    assert result.albums == 44
+    assert result.tracks > 0
+    assert result.mismatches == []
+    assert result.leaked == {}
+
+
+def test_run_stress_cross_talk() -> None:
+    releases, related = make_albums(20, seed=2)
+    # Shared by all the albums
+    last_album: Dict[str, str] = {}
+
+    def remember_album(
+        _album: Any, metadata: Metadata, _release: Dict[str, Any]
+    ) -> None:
+        last_album["title"] = metadata["album"]
+
+    def set_album_title(
+        _album: Any,
+        metadata: Metadata,
+        _track: Dict[str, Any],
+        _release: Dict[str, Any],
+    ) -> None:
+        metadata["~albumtitle"] = last_album["title"]
+
+    processors = Processors(
+        [Processor("test", "remember_album", remember_album, 0)],
+        [Processor("test", "set_album_title", set_album_title, 0)],
+    )
+
+    assert not run_stress(processors, releases, related, 1).mismatches
+    assert run_stress(processors, releases, related, 8).mismatches
@@ -0,0 +1,384 @@
+from gc import collect
+from importlib.util import module_from_spec, spec_from_file_location
+from json import load as json_load
+from logging import DEBUG, INFO
+from pathlib import Path
+from sys import modules
+from typing import Any, Callable, Dict, List
+
+from picard import log
+from picard.metadata import Metadata
+from picard.plugin import PluginPriority
+from picard.script import ScriptParser
+from pytest import LogCaptureFixture, MonkeyPatch, mark, raises
+from pytest_mock import MockerFixture
+
+from lib import PLUGIN_DIR
+from plugins._support import _support as support
+from plugins._support._support import (
+    AlbumState,
+    Instrumentation,
+    Pipeline,
+    ReleaseIndex,
+    StateRegistry,
+    TrackContext,
+    TrackLog,
+    deep_getsizeof,
+    release_index,
+    remove_album_states,
+)
+
+# Register the state of the plugins
+import plugins.exclude_non_music_tracks.exclude_non_music_tracks  # noqa: F401
+import plugins.transliteration_sort.transliteration_sort  # noqa: F401
+
+
+def processor(calls: List[int], value: int) -> None:
+    calls.append(value)
+
+
+def test_instrumentation_disabled() -> None:
+    instrumentation = Instrumentation()
+    timed = instrumentation.wrap(processor)
+    calls: List[int] = []
+
+    timed(calls, 1)
+
+    assert calls == [1]
+    assert instrumentation.timings == {}
+    assert timed.__module__ == processor.__module__
+    assert timed.__name__ == processor.__name__
+
+
+def test_instrumentation(tmp_path: Path) -> None:
+    instrumentation = Instrumentation(enabled=True)
+    timed = instrumentation.wrap(processor)
+    calls: List[int] = []
+
+    timed(calls, 1)
+    timed(calls, 2)
+
+    assert calls == [1, 2]
+    timings = instrumentation.timings["test_support.processor"]
+    assert timings.calls == 2
+    assert sum(timings.histogram) == 2
+    assert 0 < timings.max <= timings.total
+
+    path = tmp_path / "timings.json"
+    instrumentation.dump(str(path))
+
+    with path.open("r", encoding="utf-8") as f:
+        data = json_load(f)
+
+    assert data["test_support.processor"]["calls"] == 2
+    assert sum(data["test_support.processor"]["histogram"].values()) == 2
+
+    instrumentation.reset()
+
+    assert instrumentation.timings == {}
+
+
+class State:
+    def __init__(self) -> None:
+        self.items: Dict[str, List[str]] = {}
+        self.ignored: List[str] = []
+
+
+def test_deep_getsizeof() -> None:
+    assert deep_getsizeof([]) < deep_getsizeof(["a" * 1000])
+    assert deep_getsizeof({"key": ["a" * 1000]}) > 1000
+    # Shared objects are only counted once
+    value = "a" * 1000
+    assert deep_getsizeof([value, value]) < 2000
+
+
+def test_state_registry() -> None:
+    registry = StateRegistry()
+    state = State()
+    registry.register("picard.plugins.test", state, "items")
+
+    stats = registry.stats()
+    assert stats["test"]["items"].entries == 0
+
+    state.items["album"] = ["a" * 1000]
+
+    stats = registry.stats()
+    assert list(stats) == ["test"]
+    assert list(stats["test"]) == ["items"]
+    assert stats["test"]["items"].entries == 1
+    assert stats["test"]["items"].size > 1000
+    assert registry.summary() == [f"test.items: {stats['test']['items']}"]
+
+
+class Album:
+    pass
+
+
+def test_album_state() -> None:
+    state: AlbumState[List[str]] = AlbumState()
+    album, removed_album = Album(), Album()
+    state[album] = ["a"]
+    state[removed_album] = ["b"]
+
+    assert album in state
+    assert state.get(album) == ["a"]
+    assert len(state) == 2
+
+    remove_album_states(removed_album)
+
+    assert removed_album not in state
+    assert state.get(removed_album) is None
+    assert len(state) == 1
+
+    del album
+    collect()
+
+    assert len(state) == 0
+
+
+def test_plugin_stats(parser: ScriptParser) -> None:
+    result = parser.eval("$pluginstats()")
+
+    assert "exclude_non_music_tracks.media_to_skip: 0 entries" in result
+    assert "transliteration_sort.tracks: 0 entries" in result
+
+
+def test_track_context() -> None:
+    metadata = Metadata(tracknumber="3", title="Title")
+    context = TrackContext(metadata)
+
+    assert context.get("title") == "Title"
+    assert context.get("album") == ""
+    assert context.integer("tracknumber") == 3
+
+    context.set("tracknumber", "4")
+
+    assert metadata["tracknumber"] == "4"
+    assert context.integer("tracknumber") == 4
+
+    context.set("title", "")
+
+    assert context.get("title") == ""
+    with raises(ValueError):
+        context.integer("title")
+
+
+def test_release_index() -> None:
+    def track(position: int, recording_id: str, video: bool) -> Dict[str, Any]:
+        return {
+            "position": position,
+            "recording": {"id": recording_id, "video": video},
+        }
+
+    def relation(relation_type: str, direction: str) -> Dict[str, Any]:
+        return {
+            "type": relation_type,
+            "target-type": "release",
+            "direction": direction,
+        }
+
+    release = {
+        "media": [
+            {"position": 2, "tracks": [track(1, "a", True)]},
+            {
+                "position": 1,
+                "tracks": [track(1, "a", False), track(2, "b", True)],
+            },
+        ],
+        "relations": [
+            relation("transl-tracklisting", "forward"),
+            relation("transl-tracklisting", "backward"),
+        ],
+    }
+    index = ReleaseIndex(release)
+
+    assert list(index.media) == [2, 1]
+    assert index.tracks[(1, 2)]["recording"]["id"] == "b"
+    assert [track["position"] for track in index.recordings["a"]] == [1, 1]
+    assert index.video_tracks == {1: {2}, 2: {1}}
+    assert index.relations("transl-tracklisting") == [
+        relation("transl-tracklisting", "forward")
+    ]
+    assert index.relations("transl-tracklisting", direction="backward")
+    assert index.relations("remaster") == []
+
+    assert release_index(release) is release_index(release)
+    assert release_index(release) is not release_index(dict(release))
+    with raises(KeyError):
+        ReleaseIndex({}).media
+
+
+def step(name: str, calls: List[str]) -> Callable[..., None]:
+    def function(*args: Any) -> None:
+        calls.append(name)
+        if len(args) == 5:
+            args[4].set("title", args[4].get("title") + name)
+
+    function.__module__ = f"picard.plugins.{name}"
+    return function
+
+
+def test_pipeline() -> None:
+    calls: List[str] = []
+    pipeline = Pipeline(enabled_plugins={"a", "b", "c"})
+    pipeline.add_track_processor(step("a", calls), PluginPriority.NORMAL)
+    pipeline.add_track_processor(step("b", calls), PluginPriority.HIGH)
+    pipeline.add_track_processor(step("c", calls), PluginPriority.NORMAL)
+    pipeline.add_track_processor(step("disabled", calls), PluginPriority.HIGH)
+    pipeline.add_album_processor(step("c", calls), PluginPriority.LOW)
+    pipeline.add_album_processor(step("a", calls), PluginPriority.NORMAL)
+
+    album = Album()
+    metadata = Metadata(title="")
+    pipeline.run_track(album, metadata, {}, {})
+
+    assert calls == ["b", "a", "c"]
+    assert metadata["title"] == "bac"
+
+    calls.clear()
+    pipeline.run_album(album, Metadata(), {})
+
+    assert calls == ["a", "c"]
+
+    # The enabled plugins are resolved once per album
+    calls.clear()
+    pipeline.enabled_plugins = {"a"}
+    metadata = Metadata(title="")
+    pipeline.run_track(album, metadata, {}, {})
+
+    assert calls == ["b", "a", "c"]
+    assert metadata["title"] == "bac"
+
+    calls.clear()
+    pipeline.run_album(album, Metadata(), {})
+    pipeline.run_track(album, Metadata(title=""), {}, {})
+
+    assert calls == ["a", "a"]
+
+
+def test_pipeline_timings(monkeypatch: MonkeyPatch) -> None:
+    calls: List[str] = []
+    pipeline = Pipeline(enabled_plugins={"a"})
+    pipeline.add_track_processor(step("a", calls), PluginPriority.NORMAL)
+    monkeypatch.setattr(support.instrumentation, "enabled", True)
+    monkeypatch.setattr(support.instrumentation, "timings", {})
+
+    album = Album()
+    pipeline.run_album(album, Metadata(), {})
+    pipeline.run_track(album, Metadata(title=""), {}, {})
+
+    assert calls == ["a"]
+    timings = support.instrumentation.timings
+    assert [timing.calls for timing in timings.values()] == [1]
+
+
+def release(tracks: int) -> Dict[str, Any]:
+    return {"title": "Release", "media": [{"tracks": [{}] * tracks}]}
+
+
+def test_track_log_disabled(caplog: LogCaptureFixture) -> None:
+    caplog.set_level(INFO, logger="main")
+    track_log = TrackLog("picard.plugins.test", limit=1, sample=1)
+    album = Album()
+
+    assert not track_log.enabled(album)
+    assert len(track_log.albums) == 0
+
+
+def test_track_log(caplog: LogCaptureFixture) -> None:
+    caplog.set_level(DEBUG, logger="main")
+    track_log = TrackLog("picard.plugins.test", limit=2, sample=3)
+    album, other_album = Album(), Album()
+
+    def log_twice(album: Album, *_args: Any) -> None:
+        for _ in range(2):
+            if track_log.enabled(album):
+                log.debug("Message")
+
+    processor = track_log.processor(log_twice)
+    for _ in range(3):
+        processor(album, Metadata(), {}, release(5))
+        processor(other_album, Metadata(), {}, release(3))
+
+    assert caplog.messages.count("Message") == 6
+    assert caplog.messages[-1] == (
+        "test: 3 of 6 debug messages logged for the 3 tracks of Release"
+    )
+
+    caplog.clear()
+    for _ in range(2):
+        processor(album, Metadata(), {}, release(5))
+
+    # The 6th message after the first 2 is logged
+    assert caplog.messages == [
+        "Message",
+        "test: 4 of 10 debug messages logged for the 5 tracks of Release",
+    ]
+    assert len(track_log.albums) == 0
+
+
+@mark.parametrize(
+    "name,tag,value",
+    [
+        ("album_track_swap_sort", "titlesort", "Symphony in C minor, The"),
+        ("exclude_non_music_tracks", "discnumber", "1"),
+        ("separate_catalog_numbers", "catalognumber", "ABCD-1002"),
+        ("set_key_from_title_classical", "key", "Cm"),
+        ("transliteration_sort", "titlesort", ""),
+    ],
+)
+def test_plugin_without_support(
+    monkeypatch: MonkeyPatch,
+    mocker: MockerFixture,
+    name: str,
+    tag: str,
+    value: str,
+) -> None:
+    # The plugin support library is not enabled
+    monkeypatch.setitem(modules, "picard.plugins._support", None)
+    album_processors = mocker.patch(
+        "picard.metadata.register_album_metadata_processor"
+    )
+    track_processors = mocker.patch(
+        "picard.metadata.register_track_metadata_processor"
+    )
+
+    spec = spec_from_file_location(
+        f"picard.plugins.{name}", PLUGIN_DIR / name / f"{name}.py"
+    )
+    assert spec is not None and spec.loader is not None
+    spec.loader.exec_module(module_from_spec(spec))
+
+    album = Album()
+    metadata = Metadata(
+        title="The Symphony in C minor",
+        label="Label",
+        catalognumber="ABCD-1001~1002",
+        discnumber="2",
+        totaldiscs="2",
+        tracknumber="1",
+        totaltracks="1",
+    )
+    release: Dict[str, Any] = {
+        "media": [
+            {
+                "position": 1,
+                "format": "DVD-Video",
+                "track-count": 1,
+                "tracks": [],
+            },
+            {
+                "position": 2,
+                "format": "CD",
+                "track-count": 1,
+                "tracks": [{"position": 1, "recording": {"video": False}}],
+            },
+        ],
+        "relations": [],
+    }
+    for call in album_processors.call_args_list:
+        call[0][0](album, metadata, release)
+    track_processors.assert_called_once()
+    track_processors.call_args[0][0](album, metadata, {}, release)
+
+    assert metadata[tag] == value
@@ -174,3 +174,5 @@ def test_transliteration_sort(
     assert metadata["album"] == "Test Album"
     assert metadata["albumsort"] == "Transliterated Test Album"
     assert metadata["titlesort"] == "Transliterated Test Title"
+    # The titles of the album are dropped once every track is set
+    assert album not in plugin.tracks